@@ -0,0 +1,222 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+import analysis
+
+
+# asyncio API: the blocking db and analysis functions on a dedicated thread per database
+# --------------------------------------------------------------------------------------
+
+class AsyncHabitly:
+    """
+    Async access to one Habitly database for asyncio applications such as web services.
+
+    Every call runs on a single worker thread that owns the database connection, so the
+    event loop never waits for SQLite and calls reach the database in the order they were
+    made. Concurrent increment_habit calls are coalesced: while one transaction is being
+    committed, newly arriving events queue up and are all written by the next transaction.
+    Under load this turns one commit per event into one commit per batch. Any other call
+    hands the queued events to the worker thread first, so it still sees them.
+
+    Example:
+        async with AsyncHabitly("main.db") as habitly:
+            await habitly.increment_habit("Yoga", "Selma", mood_before="😐", mood_after="😄")
+            stats = await habitly.summarize_habit("Yoga", "Selma")
+    """
+
+    def __init__(self, name="main.db", profile="durable", coalesce=True, max_batch=1000):
+        """
+        Set up the worker thread; the connection is opened by the first call.
+
+        Args:
+            name (str): Database file name.
+            profile (str): Tuning profile passed to db.get_db.
+            coalesce (bool): Share one transaction between concurrent increment_habit calls.
+            max_batch (int): Upper bound on events written by one coalesced transaction.
+        """
+        self.name = name
+        self.profile = profile
+        self.coalesce = coalesce
+        self.max_batch = max_batch
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="habitly-db")
+        self._connection = None
+        self._pending = []  # (event arguments, future) waiting for the next transaction
+        self._batches = set()  # coalesced transactions handed to the worker thread and not done yet
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def run(self, function, *args, **kwargs):
+        """
+        Call any db or analysis function on the worker thread as function(connection, *args, **kwargs).
+
+        Returns:
+            The function's return value.
+        """
+        loop = asyncio.get_running_loop()
+        self._flush(force=True)  # events logged before this call are written before it
+        return await loop.run_in_executor(self._executor, self._call, function, args, kwargs)
+
+    async def close(self):
+        """
+        Wait for queued events to be written, then close the connection and stop the worker thread.
+        """
+        await self.run(lambda connection: connection.close())  # after every queued event
+        self._connection = None
+        self._executor.shutdown(wait=True)
+
+    # Writing
+    # -------
+
+    async def add_habit(self, name, description, period, user_name):
+        """
+        Async db.add_habit. Returns the new habit's id, or None if the name is taken.
+        """
+        return await self.run(db.add_habit, name, description, period, user_name)
+
+    async def increment_habit(self, name, user_name, event_date=None, mood_before=None, mood_after=None):
+        """
+        Async db.increment_habit. Returns once the event is committed, usually together with
+        the events of other concurrent calls. Raises ValueError if there is no such habit.
+        """
+        if not self.coalesce:
+            return await self.run(_increment_habit, name, user_name, event_date, mood_before, mood_after)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append(((name, user_name, event_date, mood_before, mood_after), future))
+        if len(self._pending) == 1:
+            loop.call_soon(self._flush)  # after this tick, so calls made in the same tick join the batch
+        return await future
+
+    async def delete_habit(self, name, user_name):
+        """
+        Async db.delete_habit.
+        """
+        return await self.run(db.delete_habit, name, user_name)
+
+    async def delete_event(self, name, user_name, date):
+        """
+        Async db.delete_event.
+        """
+        return await self.run(db.delete_event, name, user_name, date)
+
+    # Reading and analytics
+    # ---------------------
+
+    async def get_habit_data(self, name, user_name):
+        """
+        Async db.get_habit_data.
+        """
+        return await self.run(db.get_habit_data, name, user_name)
+
+    async def get_habit_details(self, name, user_name):
+        """
+        Async db.get_habit_details.
+        """
+        return await self.run(db.get_habit_details, name, user_name)
+
+    async def get_habits_for_user(self, user_name):
+        """
+        Async db.get_habits_for_user.
+        """
+        return await self.run(db.get_habits_for_user, user_name)
+
+    async def get_all_users(self):
+        """
+        Async db.get_all_users.
+        """
+        return await self.run(db.get_all_users)
+
+    async def calculate_count(self, habit, user_name):
+        """
+        Async analysis.calculate_count.
+        """
+        return await self.run(analysis.calculate_count, habit, user_name)
+
+    async def summarize_habit(self, habit, user_name, period=None, backend=None):
+        """
+        Async analysis.summarize_habit: count, current and longest streak and mood improvements.
+        """
+        return await self.run(analysis.summarize_habit, habit, user_name, period, backend)
+
+    async def analyze_all_habits(self, user_name=None):
+        """
+        Async analysis.analyze_all_habits.
+        """
+        return await self.run(analysis.analyze_all_habits, user_name)
+
+    # Worker thread
+    # -------------
+
+    def _call(self, function, args, kwargs):
+        """
+        Run on the worker thread: open the connection on first use, then call the function.
+        """
+        if self._connection is None:
+            self._connection = db.get_db(self.name, profile=self.profile)
+        return function(self._connection, *args, **kwargs)
+
+    def _flush(self, force=False):
+        """
+        Hand the queued events to the worker thread as one transaction, unless one is still being written.
+
+        With force, all queued events are handed over right away (in batches of max_batch), so
+        that a call submitted next runs after them: the single worker thread takes its work in
+        the order it was submitted.
+        """
+        if not self._pending or (self._batches and not force):
+            return
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            written = loop.run_in_executor(self._executor, self._call, _write_events, ([event for event, _ in batch],), {})
+            self._batches.add(written)
+            written.add_done_callback(lambda done, batch=batch: self._flushed(batch, done))
+            if not force:
+                break
+
+    def _flushed(self, batch, done):
+        """
+        Resolve the futures of a written batch and start the next one.
+        """
+        self._batches.discard(done)
+        error = done.exception()
+        for (_, future), outcome in zip(batch, [error] * len(batch) if error else done.result()):
+            if future.cancelled():
+                continue
+            if isinstance(outcome, Exception):
+                future.set_exception(outcome)
+            else:
+                future.set_result(outcome)
+        self._flush()
+
+
+def _write_events(connection, events):
+    """
+    Log events with db.increment_habit in one transaction; a failing event doesn't affect the others.
+
+    Returns:
+        list: increment_habit's result or the raised exception, per event.
+    """
+    outcomes = []
+    with db.group_commit(connection) as run:
+        for event in events:
+            try:
+                outcomes.append(run(_increment_habit, *event))
+            except Exception as error:
+                outcomes.append(error)
+    return outcomes
+
+
+def _increment_habit(connection, name, user_name, event_date, mood_before, mood_after):
+    """
+    db.increment_habit, but an unknown habit is raised to the caller instead of printed on the worker thread.
+    """
+    if db.get_habit_id(connection, name, user_name) is None:
+        raise ValueError(f"There is no habit named '{name}' for user '{user_name}'.")
+    db.increment_habit(connection, name, user_name, event_date, mood_before, mood_after)
@@ -1,8 +1,32 @@
-from db import get_habit_data, get_period_for_habit
-from collections import Counter
-from datetime import date, timedelta
+import sqlite3
+import importlib.util
+from array import array
+from bisect import bisect_left, bisect_right
+from periods import get_period, DAILY, WEEKLY
+from db import (
+    iter_habit_events, get_habit_id, get_period_for_habit, get_habit_stats, get_date_storage, route_to_shard, is_sharded,
+    JDN_OFFSET, MOOD_SCORES, STATS_PERIODS,
+)
+from collections import Counter, deque
+from datetime import date
 
+# NumPy is optional (analyze_all_habits falls back to plain Python without it) and takes longer to
+# import than all of Habitly, so it is only looked up here and imported by the first batch run
+HAS_NUMPY = importlib.util.find_spec("numpy") is not None
+np = None
 
+
+# Window functions (LAG, ROW_NUMBER, running SUM) arrived in SQLite 3.25
+SQL_WINDOW_FUNCTIONS = sqlite3.sqlite_version_info >= (3, 25, 0)
+
+# Backend used when summarize_habit has to compute the numbers from the events
+COMPUTE_BACKEND = "sql" if SQL_WINDOW_FUNCTIONS else "python"
+
+# summarize_habit reads the habit_stats summary table maintained by db, and computes only as a fallback
+DEFAULT_BACKEND = "stats"
+
+
+@route_to_shard
 def calculate_count(db, habit, user_name):
     """
     Count the number of completed events for a specific habit.
@@ -15,127 +39,257 @@ def calculate_count(db, habit, user_name):
     Returns:
         int: Number of completed events.
     """
-    data = get_habit_data(db, habit, user_name)
-    return len(data)
+    habit_id = get_habit_id(db, habit, user_name)
+    if habit_id is None:
+        return 0
+    return db.execute("SELECT COUNT(*) FROM tracker WHERE habit_id = ?", (habit_id,)).fetchone()[0]
+
+
+def to_day_ordinals(dates):
+    """
+    Convert completion dates into a sorted, de-duplicated array of day ordinals.
+
+    This is the one representation all streak calculations work on: each date is
+    converted once with date.toordinal, so consecutive days differ by exactly 1.
+    Dates are consumed in a single pass; when they arrive sorted, as from
+    db.iter_habit_events, only the array itself is kept in memory.
+
+    Args:
+        dates (iterable of date): Completion dates, in any order and with duplicates;
+            None entries are skipped. Any iterable or generator works.
+
+    Returns:
+        array: Sorted unique day ordinals (typecode 'i').
+    """
+    days = array("i")
+    ordered = True
+    for d in dates:
+        if d is None:
+            continue
+        day = d.toordinal()
+        if days and day <= days[-1]:
+            if day == days[-1]:
+                continue
+            ordered = False
+        days.append(day)
+
+    if not ordered:
+        days = array("i", sorted(set(days)))
+    return days
+
+
+def to_week_ordinals(days):
+    """
+    Convert sorted unique day ordinals into sorted unique week ordinals.
+
+    Day ordinal 1 (0001-01-01) is a Monday, so (day - 1) // 7 numbers the Monday-to-Sunday
+    (ISO) weeks consecutively across every year boundary: consecutive weeks differ by
+    exactly 1, also where a year has 53 ISO weeks. No calendar lookups are needed.
+
+    Args:
+        days (iterable of int): Sorted day ordinals, as returned by to_day_ordinals.
+
+    Returns:
+        array: Sorted unique week ordinals (typecode 'i').
+    """
+    return to_bucket_ordinals(days, WEEKLY)
+
+
+def week_ordinal(day):
+    """
+    Week ordinal of a day ordinal, as used by to_week_ordinals.
+    """
+    return (day - 1) // 7
+
+
+def to_bucket_ordinals(days, period):
+    """
+    Convert sorted unique day ordinals into the sorted numbers of the period's completed buckets.
+
+    A bucket (a day, a week, a month, ...) counts once it has entries on period.required
+    different days, so "3 per week" only keeps weeks with three days done.
+
+    Args:
+        days (iterable of int): Sorted unique day ordinals, as returned by to_day_ordinals.
+        period (periods.Period): The habit's period.
+
+    Returns:
+        array: Sorted unique bucket numbers (typecode 'i').
+    """
+    if period is DAILY:
+        return days if isinstance(days, array) else array("i", days)
+
+    buckets = array("i")
+    bucket_of = period.bucket
+    required = period.required
+    current, done = None, 0
+    for day in days:
+        bucket = bucket_of(day)
+        if bucket != current:
+            current, done = bucket, 0
+        done += 1
+        if done == required:
+            buckets.append(bucket)
+    return buckets
 
 
 def calculate_streak_by_period(dates, period):
     """
     Calculate the current streak of consecutive habit completions based on periodicity.
 
+    A streak counts consecutive completed buckets of the period (see periods.Period): for
+    daily habits consecutive days up to and including today; for all other periods up to
+    the current bucket or, as long as that isn't completed yet, up to the one before.
+    A weekly streak thus counts consecutive calendar weeks with at least one entry.
+
     Args:
-        dates (list of date): List of completion dates.
-        period (str): Either 'daily' or 'weekly'.
+        dates (iterable of date): Completion dates, e.g. a list or a generator over db.iter_habit_events.
+        period (str): A period name understood by periods.get_period, e.g. 'daily', 'weekly',
+            'monthly', '3 per week' or 'every 2 days'.
 
     Returns:
         int: Length of the current streak.
     """
-    if not dates:
+    days = to_day_ordinals(dates)
+    if not days:
         return 0
-
-    today = date.today()
-    
-    # Handle current daily streak
-    if period == "daily":
-        streak = 0
-        current = today
-        
-        while current in dates:
-            streak += 1
-            current -= timedelta(days=1)
-        return streak 
-
-    # Handle current weekly streak
-    elif period == "weekly":
-        today = date.today()
-        sorted_dates = sorted(set(dates))
-        streak = 0
-    
-        # Check if the last entry is today or within the last 7 days
-        current_date = today
-        for d in reversed(sorted_dates):  # Iterate from the most recent date backward
-            if current_date - d <= timedelta(days=7):
-                streak += 1
-                current_date = d - timedelta(days=1)  # Move to the previous day
-            else:
-                break  # Stop if there's a break greater than 7 days
-    
-        return streak
+    return _current_streak(days, period, date.today().toordinal())
 
 
 def longest_streak_by_period(dates, period):
     """
-    Calculate the longest historical streak for a habit.
+    Calculate the longest historical streak for a habit: the longest run of consecutive
+    completed buckets of its period, e.g. consecutive days for daily habits and consecutive
+    calendar weeks with at least one entry for weekly ones.
 
     Args:
-        dates (list of date): List of completion dates.
-        period (str): Either 'daily' or 'weekly'.
+        dates (iterable of date): Completion dates, e.g. a list or a generator over db.iter_habit_events.
+        period (str): A period name understood by periods.get_period.
 
     Returns:
         int: Longest streak observed.
     """
-    if not dates:
+    days = to_day_ordinals(dates)
+    if not days:
         return 0
+    return _longest_streak(days, period)
 
-    sorted_dates = sorted(set(dates))
 
-    # finding longest daily streak
-    if period == "daily":
-        max_streak = streak = 1
-        for i in range(1, len(sorted_dates)):
-            if (sorted_dates[i] - sorted_dates[i - 1]).days == 1:
-                streak += 1
-                max_streak = max(max_streak, streak)
-            else:
-                streak = 1
-        return max_streak
+def completion_rate(dates, period, start=None):
+    """
+    Calculate the share of the habit's buckets (days, weeks, months, ...) that were completed.
 
-    # finding longest weekly streak
-    elif period == "weekly":
-        # Create a list of (year, week) tuples for each date
-        weeks = [(d.isocalendar()[0], d.isocalendar()[1]) for d in sorted_dates]
-        
-        # Get the unique weeks, sorted by (year, week)
-        unique_weeks = sorted(set(weeks))
+    The buckets are counted from the one holding `start`, or the first entry, up to the
+    current one. The current bucket only counts once it is completed, since it is still open.
 
-        max_streak = streak = 1  # Initialize max streak and current streak
+    Args:
+        dates (iterable of date): Completion dates, e.g. a list or a generator over db.iter_habit_events.
+        period (str): A period name understood by periods.get_period.
+        start (date, optional): First day the habit was due, e.g. its creation date. Defaults to the first entry.
 
-        # Iterate through the list of unique weeks
-        for i in range(1, len(unique_weeks)):
-            curr_year, curr_week = unique_weeks[i]
-            prev_year, prev_week = unique_weeks[i - 1]
+    Returns:
+        float: Completed buckets divided by elapsed buckets, between 0 and 1 (0 for unknown periods).
+    """
+    days = to_day_ordinals(dates)
+    if not days:
+        return 0.0
+    return _completion_rate(days, period, date.today().toordinal(), start.toordinal() if start else None)
 
-            # Handle week 1 of the year (checking the previous year's last week because of edge case december/january)
-            if curr_week == 1:
-                expected_prev = (curr_year - 1, 52 if prev_week >= 52 else 53)
-            else:
-                expected_prev = (curr_year, curr_week - 1)
 
-            # Check if the previous week is consecutive to the current week
-            if (prev_year, prev_week) == expected_prev:
-                streak += 1  # Increment streak if consecutive
-                max_streak = max(max_streak, streak)  # Update max streak if necessary
-            else:
-                streak = 1  # Reset streak if weeks are not consecutive
+def _current_streak(days, period, today):
+    """
+    Current streak over a non-empty array from to_day_ordinals, in buckets of the period.
+    """
+    spec = get_period(period)
+    if spec is None:
+        return 0
+    buckets = to_bucket_ordinals(days, spec)
+    current = spec.bucket(today)
+    i = bisect_right(buckets, current) - 1  # buckets in the future don't count
+    if i < 0 or buckets[i] < current - (1 if spec.grace else 0):
+        return 0
+    return _run_length_at(buckets, i)
 
-        return max_streak  # Return the longest streak
 
-    return 0  # Return 0 if no streak is found
+def _longest_streak(days, period):
+    """
+    Longest streak over a non-empty array from to_day_ordinals, in buckets of the period.
+    """
+    spec = get_period(period)
+    if spec is None:
+        return 0
+    buckets = to_bucket_ordinals(days, spec)
+    return _longest_run(buckets) if buckets else 0
+
+
+def _completion_rate(days, period, today, start=None):
+    """
+    Completion rate over a non-empty array from to_day_ordinals; start is a day ordinal or None.
+    """
+    spec = get_period(period)
+    if spec is None:
+        return 0.0
+    buckets = to_bucket_ordinals(days, spec)
+    first = spec.bucket(days[0] if start is None else start)
+    current = spec.bucket(today)
+
+    end = bisect_right(buckets, current)
+    completed = end - bisect_left(buckets, first)
+    elapsed = current - first + (1 if end and buckets[end - 1] == current else 0)
+    return completed / elapsed if elapsed > 0 else 0.0
+
+
+def _run_length_at(values, i):
+    """
+    Length of the run of consecutive integers in a sorted unique array that ends at index i.
 
+    Within a run, value - index is the same for every entry and it only grows from one run
+    to the next, so the start of the run is found with a binary search.
+    """
+    key = values[i] - i
+    lo, hi = 0, i
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if values[mid] - mid < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    return i - lo + 1
+
+
+def _longest_run(values):
+    """
+    Longest run of consecutive integers in a non-empty sorted unique array.
+    """
+    max_streak = streak = 1
+    for i in range(1, len(values)):
+        if values[i] - values[i - 1] == 1:
+            streak += 1
+            max_streak = max(max_streak, streak)
+        else:
+            streak = 1
+    return max_streak
 
 
-def extract_mood_stats(data):
+def extract_mood_stats(data, before=3, after=4):
     """
     Extract mood data before and after the completion of a habit.
 
     Args:
-        data (list): Tracker records, each row containing date and mood data.
+        data (iterable): Tracker records, each row containing date and mood data. Read in one
+            pass, so iterators such as db.iter_habit_events work too.
+        before (int): Position of the mood before in each row. Defaults to get_habit_data's layout.
+        after (int): Position of the mood after in each row.
 
     Returns:
         tuple: A tuple containing two lists, one for moods before and one for moods after the habit.
     """
-    moods_before = [row[3] for row in data if row[3]]
-    moods_after = [row[4] for row in data if len(row) > 4 and row[4]]
+    moods_before, moods_after = [], []
+    for row in data:
+        if row[before]:
+            moods_before.append(row[before])
+        if len(row) > after and row[after]:
+            moods_after.append(row[after])
     return moods_before, moods_after
 
 
@@ -145,8 +299,8 @@ def count_mood_improvements(moods_before, moods_after):
     Count how many times the user's mood improved after completing a habit.
 
     Args:
-        moods_before (list of str): Mood values before the habit.
-        moods_after (list of str): Mood values after the habit.
+        moods_before (iterable of str): Mood values before the habit.
+        moods_after (iterable of str): Mood values after the habit.
 
     Returns:
         int: Number of times the mood improved.
@@ -159,3 +313,508 @@ def count_mood_improvements(moods_before, moods_after):
 
 
 
+
+
+
+# Habit summary: count, streaks and mood improvements for one habit in a single call
+# ---------------------------------------------------------------------------------
+
+@route_to_shard
+def summarize_habit(db, habit, user_name, period=None, backend=None):
+    """
+    Calculate all analytics of a habit: total count, current streak, longest streak and mood improvements.
+
+    The "stats" backend reads the habit_stats row kept up to date by db, the "sql" backend
+    pushes the whole calculation into one SQLite statement and the "python" backend loads
+    the events and runs the functions above. All three return the same numbers. The stats
+    and sql backends cover daily and weekly habits; other periods are computed in Python.
+
+    Args:
+        db: SQLite database connection.
+        habit (str): Name of the habit.
+        user_name (str): Name of the user.
+        period (str, optional): A period name understood by periods.get_period. Looked up in the database if not given.
+        backend (str, optional): "stats", "sql" or "python". Defaults to DEFAULT_BACKEND.
+
+    Returns:
+        dict: Keys "count", "current_streak", "longest_streak" and "mood_improvements".
+    """
+    if period is None:
+        period = get_period_for_habit(db, habit, user_name)
+
+    backend = backend or DEFAULT_BACKEND
+    if backend == "stats":
+        return _summarize_stats(db, habit, user_name, period)
+    if backend == "sql":
+        return _summarize_sql(db, habit, user_name, period)
+    if backend == "python":
+        return _summarize_python(db, habit, user_name, period)
+    raise ValueError(f"Unknown analytics backend '{backend}'. Choose 'stats', 'sql' or 'python'.")
+
+
+def _summarize_stats(db, habit, user_name, period):
+    """
+    Summarize a habit from its habit_stats row in O(1), computing from the events only when that isn't possible.
+    """
+    if period not in STATS_PERIODS:
+        return summarize_habit(db, habit, user_name, period, backend=COMPUTE_BACKEND)  # habit_stats only tracks these
+
+    stats = get_habit_stats(db, habit, user_name)
+    if stats is None:
+        return summarize_habit(db, habit, user_name, period, backend=COMPUTE_BACKEND)
+
+    today = date.today()
+    last = date.fromisoformat(stats["last_date"]) if stats["last_date"] else None
+
+    if last is None:
+        current = 0
+    elif period == "daily":
+        if last > today:
+            # Entries dated in the future: the stored run doesn't end today, so count it properly
+            return summarize_habit(db, habit, user_name, period, backend=COMPUTE_BACKEND)
+        current = stats["run_length"] if last == today else 0
+    else:
+        this_week, last_week = week_ordinal(today.toordinal()), week_ordinal(last.toordinal())
+        if last_week > this_week:
+            return summarize_habit(db, habit, user_name, period, backend=COMPUTE_BACKEND)
+        current = stats["run_length"] if this_week - last_week <= 1 else 0
+
+    return {
+        "count": stats["total"],
+        "current_streak": current,
+        "longest_streak": stats["longest_streak"],
+        "mood_improvements": stats["mood_improvements"],
+    }
+
+
+def _summarize_python(db, habit, user_name, period):
+    """
+    Summarize a habit in one pass over its streamed events with the Python streak functions.
+    """
+    return summarize_events(iter_habit_events(db, habit, user_name), period)
+
+
+def summarize_events(events, period):
+    """
+    Calculate count, current streak, longest streak and mood improvements from a habit's events.
+
+    The events are read in one pass; only the day ordinals and the moods still waiting for
+    a partner are kept in memory, never the full rows. Gives the same numbers as summarize_habit.
+
+    Args:
+        events (iterable): (date, mood_before, mood_after) rows in date order, as from
+            db.iter_habit_events or the "events" of db.get_habit_report.
+        period (str): A period name understood by periods.get_period.
+
+    Returns:
+        dict: Keys "count", "current_streak", "longest_streak" and "mood_improvements".
+    """
+    count = improvements = 0
+    moods_before, moods_after = deque(), deque()
+
+    def dates():
+        nonlocal count, improvements
+        for event_date, mood_before, mood_after in events:
+            count += 1
+            if mood_before:
+                moods_before.append(mood_before)
+            if mood_after:
+                moods_after.append(mood_after)
+            # The n-th mood before pairs with the n-th mood after, as in count_mood_improvements
+            while moods_before and moods_after:
+                if MOOD_SCORES.get(moods_after.popleft(), 0) > MOOD_SCORES.get(moods_before.popleft(), 0):
+                    improvements += 1
+            yield event_date
+
+    days = to_day_ordinals(dates())
+    return {
+        "count": count,
+        "current_streak": (_current_streak(days, period, date.today().toordinal()) or 0) if days else 0,
+        "longest_streak": _longest_streak(days, period) if days else 0,
+        "mood_improvements": improvements,
+    }
+
+
+def _summarize_sql(db, habit, user_name, period):
+    """
+    Summarize a habit with one gaps-and-islands query over Julian day numbers and week ordinals.
+    """
+    if period not in _STREAK_SQL:
+        return _summarize_python(db, habit, user_name, period)
+    current_streak, longest_streak = _STREAK_SQL[period]
+
+    query = _SUMMARY_SQL.format(
+        day=_DAY_SQL[get_date_storage(db)],
+        current_streak=current_streak,
+        longest_streak=longest_streak,
+    )
+    params = {
+        "habit": habit,
+        "user_name": user_name,
+        "today": date.today().toordinal() + JDN_OFFSET,
+        "this_week": week_ordinal(date.today().toordinal()),
+    }
+    count, current, longest, improvements = db.execute(query, params).fetchone()
+    return {
+        "count": count,
+        "current_streak": current,
+        "longest_streak": longest,
+        "mood_improvements": improvements,
+    }
+
+
+# Julian day number of an event, for dates stored as ISO text or as day ordinals
+_DAY_SQL = {
+    "text": "CAST(julianday(date) + 0.5 AS INTEGER)",
+    "ordinal": f"date + {JDN_OFFSET}",
+}
+
+_MOOD_SCORE_SQL = "CASE {column} WHEN '😞' THEN 0 WHEN '😐' THEN 1 WHEN '😄' THEN 2 ELSE 0 END"
+
+_SUMMARY_SQL = """
+    WITH events AS (
+        SELECT rowid AS id, date, mood_before, mood_after
+        FROM tracker
+        WHERE habit_id = (
+            SELECT habit.id FROM habit JOIN user ON user.id = habit.user_id
+            WHERE user.name = :user_name AND habit.name = :habit
+        )
+    ),
+    days AS (
+        SELECT DISTINCT day FROM (SELECT {day} AS day FROM events) WHERE day IS NOT NULL
+    ),
+    -- moods are paired the way extract_mood_stats + zip pair them: n-th recorded before with n-th recorded after
+    befores AS (
+        SELECT ROW_NUMBER() OVER (ORDER BY date, id) AS n, mood_before AS mood
+        FROM events WHERE mood_before IS NOT NULL AND mood_before != ''
+    ),
+    afters AS (
+        SELECT ROW_NUMBER() OVER (ORDER BY date, id) AS n, mood_after AS mood
+        FROM events WHERE mood_after IS NOT NULL AND mood_after != ''
+    )
+    SELECT
+        (SELECT COUNT(*) FROM events),
+        ({current_streak}),
+        ({longest_streak}),
+        (SELECT COUNT(*) FROM befores b JOIN afters a ON a.n = b.n
+         WHERE """ + _MOOD_SCORE_SQL.format(column="a.mood") + " > " + _MOOD_SCORE_SQL.format(column="b.mood") + """)
+"""
+
+# The current daily streak counts days from the newest backwards until the first gap. The newest day is
+# compared against "tomorrow", so the streak must include today.
+_CURRENT_DAILY_SQL = """
+    SELECT COUNT(*) FROM (
+        SELECT SUM(gap > 1) OVER (ORDER BY day DESC) AS breaks
+        FROM (
+            SELECT day, LAG(day, 1, :today + 1) OVER (ORDER BY day DESC) - day AS gap
+            FROM days
+            WHERE day <= :today
+        )
+    )
+    WHERE breaks = 0
+"""
+
+# The longest run of consecutive integers: they share the same (value - row number), the classic gaps-and-islands key
+_LONGEST_RUN_SQL = """
+    SELECT COALESCE(MAX(length), 0) FROM (
+        SELECT COUNT(*) AS length
+        FROM (SELECT {value} - ROW_NUMBER() OVER (ORDER BY {value}) AS island FROM {source})
+        GROUP BY island
+    )
+"""
+
+# Week ordinals as in to_week_ordinals, from Julian day numbers
+_WEEKS_SQL = f"(SELECT DISTINCT (day - {JDN_OFFSET} - 1) / 7 AS week FROM days)"
+
+# The current weekly streak counts weeks from the newest one that isn't in the future backwards until
+# the first gap, and only if that newest week is this week or last week.
+_CURRENT_WEEKLY_SQL = """
+    SELECT CASE WHEN MAX(week) >= :this_week - 1 THEN COUNT(*) ELSE 0 END FROM (
+        SELECT week, SUM(gap > 1) OVER (ORDER BY week DESC) AS breaks
+        FROM (
+            SELECT week, LAG(week, 1, week + 1) OVER (ORDER BY week DESC) - week AS gap
+            FROM """ + _WEEKS_SQL + """
+            WHERE week <= :this_week
+        )
+    )
+    WHERE breaks = 0
+"""
+
+_STREAK_SQL = {
+    "daily": (_CURRENT_DAILY_SQL, _LONGEST_RUN_SQL.format(value="day", source="days")),
+    "weekly": (_CURRENT_WEEKLY_SQL, _LONGEST_RUN_SQL.format(value="week", source=_WEEKS_SQL)),
+}
+
+
+
+# Batch analytics: every habit of every user (or of one user) in one pass
+# ----------------------------------------------------------------------
+
+# Column order of the rows returned by analyze_all_habits
+BATCH_COLUMNS = (
+    "user_name", "habit", "period", "count", "current_streak", "longest_streak", "mood_improvements", "completion_rate",
+)
+
+# Mood codes used by the batch path: -1 marks a missing mood, unknown moods score 0 like in count_mood_improvements
+_MOOD_CODES = {None: -1, "": -1, "😞": 0, "😐": 1, "😄": 2}
+
+
+def analyze_all_habits(db, user_name=None, use_numpy=None):
+    """
+    Calculate count, streaks and mood improvements for all habits at once, e.g. for nightly reports.
+
+    The habit and tracker tables are read once each. With NumPy installed the events are
+    turned into columnar arrays and every statistic is computed with vectorized operations;
+    otherwise the per-habit Python functions are used. Both give the same numbers as summarize_habit.
+
+    Args:
+        db: SQLite database connection.
+        user_name (str or list, optional): Only analyze the habits of this user, or of these users.
+            Defaults to all users.
+        use_numpy (bool, optional): Force or disable the NumPy path. Defaults to using it when installed.
+
+    Returns:
+        list of tuple: One row per habit, columns as in BATCH_COLUMNS, sorted by user and habit.
+    """
+    if is_sharded(db):
+        rows = [row for shard, users in _shard_batches(db, user_name) for row in analyze_all_habits(shard, users, use_numpy)]
+        return sorted(rows, key=lambda row: (row[0], row[1]))
+
+    habits, events = _load_batch(db, user_name)
+
+    if use_numpy is None:
+        use_numpy = HAS_NUMPY
+    if use_numpy:
+        _import_numpy()
+        results = _analyze_numpy(habits, events)
+    else:
+        results = _analyze_python(habits, events)
+
+    return sorted(results, key=lambda row: (row[0], row[1]))
+
+
+def _shard_batches(db, user_name):
+    """
+    Split an analyze_all_habits call on a sharded database into (shard, users) calls, one per shard involved.
+    """
+    if user_name is None:
+        return [(shard, None) for shard in db.connections]
+
+    users_by_shard = {}
+    for user in [user_name] if isinstance(user_name, str) else user_name:
+        users_by_shard.setdefault(db.shard_index(user), []).append(user)
+    return [(db.connections[index], users) for index, users in users_by_shard.items()]
+
+
+def _import_numpy():
+    """
+    Import NumPy into the module-level name np on first use.
+    """
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+
+
+def _load_batch(db, user_name):
+    """
+    Load the habit list and all their events, grouped by habit id and in date order.
+
+    SQLite turns each date into a day ordinal (0 if it isn't a valid date), so nothing is parsed in Python.
+    """
+    day = _DAY_SQL[get_date_storage(db)]
+    if user_name is None:
+        where, params = "", ()
+    elif isinstance(user_name, str):
+        where, params = "WHERE u.name = ?", (user_name,)
+    else:
+        params = tuple(user_name)
+        where = f"WHERE u.name IN ({', '.join('?' * len(params))})"
+
+    habits = db.execute(
+        f"SELECT h.id, u.name, h.name, h.period FROM habit h JOIN user u ON u.id = h.user_id {where} ORDER BY h.id",
+        params
+    ).fetchall()
+    events = db.execute(
+        f"""
+        SELECT t.habit_id, COALESCE({day} - {JDN_OFFSET}, 0), t.mood_before, t.mood_after
+        FROM tracker t JOIN habit h ON h.id = t.habit_id JOIN user u ON u.id = h.user_id
+        {where}
+        ORDER BY t.habit_id, t.date, t.rowid
+        """,
+        params
+    ).fetchall()
+    return habits, events
+
+
+def _analyze_python(habits, events):
+    """
+    Batch fallback without NumPy: group the events per habit and run the Python functions.
+    """
+    grouped = {habit_id: [] for habit_id, _, _, _ in habits}
+    for habit_id, day, mood_before, mood_after in events:
+        grouped[habit_id].append((day, mood_before, mood_after))
+
+    results = []
+    for habit_id, user_name, name, period in habits:
+        rows = grouped[habit_id]
+        dates = [date.fromordinal(day) for day, _, _ in rows if day]
+        moods_before = [before for _, before, _ in rows if before]
+        moods_after = [after for _, _, after in rows if after]
+        results.append((
+            user_name,
+            name,
+            period,
+            len(rows),
+            calculate_streak_by_period(dates, period) or 0,
+            longest_streak_by_period(dates, period),
+            count_mood_improvements(moods_before, moods_after),
+            completion_rate(dates, period),
+        ))
+    return results
+
+
+def _analyze_numpy(habits, events):
+    """
+    Batch path with NumPy: all habits are analyzed together on columnar arrays.
+    """
+    n_habits = len(habits)
+    habit_ids = np.array([row[0] for row in habits], dtype=np.int64)
+    periods = np.array([row[3] or "" for row in habits], dtype=object)
+
+    counts = np.zeros(n_habits, dtype=np.int64)
+    current = np.zeros(n_habits, dtype=np.int64)
+    longest = np.zeros(n_habits, dtype=np.int64)
+    improvements = np.zeros(n_habits, dtype=np.int64)
+    completed = np.zeros(n_habits, dtype=np.int64)
+    elapsed = np.zeros(n_habits, dtype=np.int64)
+
+    if events:
+        ids, days, befores, afters = zip(*events)
+        # Map habit ids to positions 0..n_habits-1; both lists are sorted by id
+        group = np.searchsorted(habit_ids, np.array(ids, dtype=np.int64))
+        counts = np.bincount(group, minlength=n_habits)
+
+        # Dates arrive as day ordinals (the same numbers date.toordinal gives), 0 marks a missing date
+        days = np.array(days, dtype=np.int64)
+        valid = days > 0
+        days = days[valid]
+        day_group = group[valid]
+
+        # Sorted unique (habit, day) pairs, the columnar counterpart of to_day_ordinals
+        keys = np.unique(day_group * _KEY_STRIDE + days)
+        unique_group = keys // _KEY_STRIDE
+        unique_days = keys % _KEY_STRIDE
+
+        # Each period's habits are analyzed together; habits with unknown periods keep zeros
+        today = date.today().toordinal()
+        for name in set(periods):
+            spec = get_period(name)
+            if spec is None:
+                continue
+            in_period = periods == name
+            selected = in_period[unique_group]
+            streaks = _numpy_period_streaks(unique_group[selected], unique_days[selected], n_habits, today, spec)
+            current, longest, completed, elapsed = (
+                np.where(in_period, new, old) for new, old in zip(streaks, (current, longest, completed, elapsed))
+            )
+
+        before_codes = np.array([_MOOD_CODES.get(m, 0) for m in befores], dtype=np.int64)
+        after_codes = np.array([_MOOD_CODES.get(m, 0) for m in afters], dtype=np.int64)
+        improvements = _numpy_mood_improvements(group, before_codes, after_codes, n_habits)
+
+    return [
+        (
+            user_name, name, period, int(counts[i]), int(current[i]), int(longest[i]), int(improvements[i]),
+            int(completed[i]) / int(elapsed[i]) if elapsed[i] > 0 else 0.0,
+        )
+        for i, (_, user_name, name, period) in enumerate(habits)
+    ]
+
+
+# Habit position and day ordinal are packed into one sortable integer key (ordinals stay below 4 million)
+_KEY_STRIDE = 1 << 22
+
+
+def _run_starts(group, values, step_ok):
+    """
+    Mark where a new run begins: at the first entry of each habit and wherever step_ok is False.
+    """
+    starts = np.ones(len(values), dtype=bool)
+    starts[1:] = (group[1:] != group[:-1]) | ~step_ok
+    return starts
+
+
+def _longest_runs(group, starts, n_habits):
+    """
+    Length of the longest run per habit, given the run start markers.
+    """
+    run_id = np.cumsum(starts) - 1
+    run_length = np.bincount(run_id)
+    longest = np.zeros(n_habits, dtype=np.int64)
+    np.maximum.at(longest, group[starts], run_length)
+    return longest
+
+
+def _numpy_period_streaks(group, days, n_habits, today, period):
+    """
+    Streaks and completion counts of habits sharing one period, from sorted unique (habit, day) pairs.
+
+    Returns:
+        tuple: Current streak, longest streak, completed buckets up to the current one and
+            elapsed buckets (as in _completion_rate), one array entry per habit.
+    """
+    buckets = period.np_bucket(days)
+    first = np.full(n_habits, np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(first, group, buckets)
+
+    # Sorted unique (habit, bucket) pairs with enough days done, the columnar counterpart of to_bucket_ordinals
+    keys, done = np.unique(group * _KEY_STRIDE + buckets, return_counts=True)
+    keys = keys[done >= period.required]
+    bucket_group = keys // _KEY_STRIDE
+    values = keys % _KEY_STRIDE
+
+    starts = _run_starts(bucket_group, values, np.diff(values) == 1)
+    longest = _longest_runs(bucket_group, starts, n_habits)
+
+    # The current streak is the run of the newest bucket that isn't in the future,
+    # if that is the current bucket (or, with grace, the one before)
+    current_bucket = int(period.np_bucket(np.array([today], dtype=np.int64))[0])
+    run_start = values[starts][np.cumsum(starts) - 1]
+    index = np.arange(len(values))
+    newest = np.full(n_habits, -1, dtype=np.int64)
+    past = values <= current_bucket
+    np.maximum.at(newest, bucket_group[past], index[past])
+
+    habits = np.flatnonzero(newest >= 0)
+    newest = newest[habits]
+    recent = values[newest] >= current_bucket - (1 if period.grace else 0)
+    current = np.zeros(n_habits, dtype=np.int64)
+    current[habits[recent]] = values[newest[recent]] - run_start[newest[recent]] + 1
+
+    # Completion rate: the current bucket is only counted once it is completed
+    completed = np.bincount(bucket_group[past], minlength=n_habits)
+    current_done = np.zeros(n_habits, dtype=np.int64)
+    current_done[bucket_group[values == current_bucket]] = 1
+    elapsed = np.where(first <= current_bucket, current_bucket - np.minimum(first, current_bucket) + current_done, 0)
+    return current, longest, completed, elapsed
+
+
+def _numpy_mood_improvements(group, before_codes, after_codes, n_habits):
+    """
+    Count improvements, pairing the n-th recorded mood before with the n-th recorded mood after per habit.
+    """
+    def ranked(codes):
+        present = codes >= 0
+        present_group = group[present]
+        position = np.arange(len(present_group))
+        first = np.full(n_habits, len(present_group), dtype=np.int64)
+        np.minimum.at(first, present_group, position)
+        return present_group * _KEY_STRIDE + (position - first[present_group]), codes[present]
+
+    before_keys, before_scores = ranked(before_codes)
+    after_keys, after_scores = ranked(after_codes)
+    _, before_at, after_at = np.intersect1d(before_keys, after_keys, assume_unique=True, return_indices=True)
+
+    improved = after_scores[after_at] > before_scores[before_at]
+    return np.bincount(before_keys[before_at][improved] // _KEY_STRIDE, minlength=n_habits)
@@ -0,0 +1,7 @@
+"""
+Benchmarks for the database and analysis hot paths of Habitly.
+
+Run them from the project root with:
+
+    python -m benchmarks.run --scale small medium --output bench.json
+"""
@@ -0,0 +1,319 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from db import (
+    get_db,
+    increment_habit,
+    increment_habits_bulk,
+    get_all_users,
+    get_habit_periods,
+    get_habit_data,
+    iter_habit_events,
+    get_habit_report,
+)
+from analysis import (
+    calculate_streak_by_period,
+    longest_streak_by_period,
+    extract_mood_stats,
+    count_mood_improvements,
+    summarize_events,
+    completion_rate,
+    analyze_all_habits,
+)
+from aiohabitly import AsyncHabitly
+from writequeue import WriteQueue
+from reports import run_report
+from profiling import profiled, profile_settings
+from benchmarks.synthetic import generate, user_names, habit_names
+
+
+# Benchmark scales: (users, habits per user, years of history)
+# ------------------------------------------------------------
+
+SCALES = {
+    "tiny": (2, 3, 1),
+    "small": (5, 3, 1),
+    "medium": (20, 5, 3),
+    "large": (100, 6, 5),
+}
+
+
+# Scenarios: each one times a single call of a hot path against a prepared context
+# --------------------------------------------------------------------------------
+
+def show_habit_analytics_data(db, user_name, habit):
+    """
+    The database and analysis calls main.show_habit_analytics makes for one view, without the prompts.
+    """
+    get_all_users(db)
+    get_habit_periods(db, user_name)
+    report = get_habit_report(db, habit, user_name)
+    dates = (event_date for event_date, _, _ in report["events"])
+    return summarize_events(report["events"], report["period"]), completion_rate(dates, report["period"])
+
+
+# Number of check-ins in the burst scenarios, e.g. many users logging at the same moment.
+# The burst scenarios use the "durable" profile, where every commit waits for an fsync.
+# Write scenarios log into a copy of the database, so what the read scenarios measure
+# doesn't depend on --repeat or on the write scenarios that ran before them.
+BURST = 200
+
+
+def sync_burst(context):
+    """
+    BURST increment_habit calls one after another, each with its own commit.
+    """
+    for _ in range(BURST):
+        increment_habit(context["durable_db"], context["daily_habit"], context["user_name"], str(date.today()), "😐", "😄")
+
+
+def async_burst(context):
+    """
+    BURST concurrent increment_habit calls through aiohabitly, coalesced into shared transactions.
+    """
+    habitly = context["async_habitly"]
+
+    async def burst():
+        await asyncio.gather(*(
+            habitly.increment_habit(context["daily_habit"], context["user_name"], str(date.today()), "😐", "😄")
+            for _ in range(BURST)
+        ))
+
+    asyncio.run(burst())
+
+
+def queued_burst(context):
+    """
+    BURST increment_habit calls through the group-commit write queue, waiting until all are durable.
+    """
+    writes = context["write_queue"]
+    futures = [
+        writes.increment_habit(context["daily_habit"], context["user_name"], str(date.today()), "😐", "😄")
+        for _ in range(BURST)
+    ]
+    for future in futures:
+        future.result()
+
+
+def _bulk_events(context):
+    """
+    1000 backdated events for the bulk habit, starting where the previous run stopped.
+    """
+    start = context["bulk_start"]
+    context["bulk_start"] = start - timedelta(days=1000)
+    return ((start - timedelta(days=i), context["daily_habit"], context["user_name"], "😐", "😄") for i in range(1000))
+
+
+SCENARIOS = {
+    "increment_habit": lambda c: increment_habit(
+        c["write_db"], c["daily_habit"], c["user_name"], str(date.today()), "😐", "😄"
+    ),
+    "increment_habit_burst": sync_burst,
+    "aiohabitly_increment_burst": async_burst,
+    "writequeue_increment_burst": queued_burst,
+    "increment_habits_bulk": lambda c: increment_habits_bulk(c["write_db"], _bulk_events(c)),
+    "get_habit_data": lambda c: get_habit_data(c["db"], c["daily_habit"], c["user_name"]),
+    "iter_habit_events": lambda c: sum(1 for _ in iter_habit_events(c["db"], c["daily_habit"], c["user_name"])),
+    "calculate_streak_by_period": lambda c: calculate_streak_by_period(c["daily_dates"], "daily"),
+    "longest_streak_by_period": lambda c: longest_streak_by_period(c["daily_dates"], "daily"),
+    "longest_streak_by_period_weekly": lambda c: longest_streak_by_period(c["weekly_dates"], "weekly"),
+    "longest_streak_by_period_3_per_week": lambda c: longest_streak_by_period(c["daily_dates"], "3 per week"),
+    "longest_streak_by_period_monthly": lambda c: longest_streak_by_period(c["daily_dates"], "monthly"),
+    "count_mood_improvements": lambda c: count_mood_improvements(*c["moods"]),
+    "show_habit_analytics": lambda c: show_habit_analytics_data(c["db"], c["user_name"], c["daily_habit"]),
+    "analyze_all_habits": lambda c: analyze_all_habits(c["db"]),
+    # Scaling of the nightly report over worker processes (including their start-up)
+    "run_report_1_worker": lambda c: run_report(c["path"], workers=1),
+    "run_report_2_workers": lambda c: run_report(c["path"], workers=2, chunk_size=5),
+    "run_report_4_workers": lambda c: run_report(c["path"], workers=4, chunk_size=5),
+}
+
+
+def prepare(scale, path, seed=0):
+    """
+    Build the benchmark database for a scale and collect the inputs the scenarios need.
+
+    The write scenarios get connections to a copy of the database, <path>-writes.db.
+
+    Args:
+        scale (str): One of the keys of SCALES.
+        path (str): Database file to create.
+        seed (int): Seed for the synthetic data.
+
+    Returns:
+        dict: The scenario context.
+    """
+    users, habits_per_user, years = SCALES[scale]
+    db = get_db(path, profile="fast")
+    events = generate(db, users, habits_per_user, years, seed=seed)
+
+    # The busiest user's first daily and first weekly habit stand in for "a habit"
+    user_name = user_names(users)[0]
+    daily_habit = next(name for name, period in habit_names(habits_per_user) if period == "daily")
+    weekly_habit = next((name for name, period in habit_names(habits_per_user) if period == "weekly"), daily_habit)
+
+    daily_data = get_habit_data(db, daily_habit, user_name)
+    weekly_data = get_habit_data(db, weekly_habit, user_name)
+
+    write_path = os.path.splitext(path)[0] + "-writes.db"
+    copy = sqlite3.connect(write_path)
+    db.backup(copy)
+    copy.close()
+    return {
+        "db": db,
+        "path": path,
+        "write_db": get_db(write_path, profile="fast"),
+        "durable_db": get_db(write_path),
+        "async_habitly": AsyncHabitly(write_path),
+        "write_queue": WriteQueue(write_path, flush_at_exit=False),
+        "events": events,
+        "user_name": user_name,
+        "daily_habit": daily_habit,
+        "daily_dates": [row[0] for row in daily_data],
+        "weekly_dates": [row[0] for row in weekly_data],
+        "moods": extract_mood_stats(daily_data),
+        "bulk_start": date.today() - timedelta(days=365 * (years + 1)),
+    }
+
+
+def time_scenario(function, context, repeat):
+    """
+    Call a scenario `repeat` times and return the individual timings in seconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(context)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run(scales, scenarios=None, repeat=5, seed=0, profile=None, profile_memory=False):
+    """
+    Run the selected scenarios at the selected scales.
+
+    Args:
+        scales (list): Keys of SCALES.
+        scenarios (list, optional): Keys of SCENARIOS. Defaults to all of them.
+        repeat (int): Timed calls per scenario.
+        seed (int): Seed for the synthetic data.
+        profile (str, optional): Directory for profiles. After its timed calls, each scenario is
+            called `repeat` more times under cProfile, written to <profile>/<scale>/<scenario>.pstats,
+            so the timings aren't slowed down by the profiler.
+        profile_memory (bool): With profile, also write <scenario>.allocations.txt (tracemalloc).
+
+    Returns:
+        dict: Environment information and one result entry per (scale, scenario).
+    """
+    scenarios = scenarios or list(SCENARIOS)
+    results = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in scales:
+            context = prepare(scale, os.path.join(directory, f"{scale}.db"), seed=seed)
+            for name in scenarios:
+                timings = time_scenario(SCENARIOS[name], context, repeat)
+                results.append({
+                    "scenario": name,
+                    "scale": scale,
+                    "events": context["events"],
+                    "repeat": repeat,
+                    "min": min(timings),
+                    "median": statistics.median(timings),
+                    "mean": statistics.mean(timings),
+                    "max": max(timings),
+                })
+                if profile:
+                    with profiled(name, os.path.join(profile, scale), profile_memory):
+                        for _ in range(repeat):
+                            SCENARIOS[name](context)
+            context["db"].close()
+            context["write_db"].close()
+            context["durable_db"].close()
+            asyncio.run(context["async_habitly"].close())
+            context["write_queue"].close()
+
+    return {
+        "commit": _git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "seed": seed,
+        "results": results,
+    }
+
+
+def compare(report, baseline):
+    """
+    Pair each result with the same (scale, scenario) of a baseline report.
+
+    Returns:
+        list: (scale, scenario, baseline median, median, ratio) tuples; ratio > 1 means slower now.
+    """
+    previous = {(row["scale"], row["scenario"]): row["median"] for row in baseline["results"]}
+    rows = []
+    for row in report["results"]:
+        key = (row["scale"], row["scenario"])
+        if key in previous:
+            rows.append((*key, previous[key], row["median"], row["median"] / previous[key] if previous[key] else float("inf")))
+    return rows
+
+
+def _git_commit():
+    """
+    Short hash of the checked-out commit, or None outside a git checkout.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    """
+    Command-line entry point: run the benchmarks, print a table and optionally save/compare JSON.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark Habitly's database and analysis hot paths.")
+    parser.add_argument("--scale", nargs="+", default=["small"], choices=list(SCALES))
+    parser.add_argument("--scenario", nargs="+", choices=list(SCENARIOS), help="defaults to all scenarios")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--profile", metavar="DIR", help="also profile every scenario into DIR/<scale>/<scenario>.pstats (default: $HABITLY_PROFILE)")
+    parser.add_argument("--profile-memory", action="store_true", help="with --profile, also write the top allocations of every scenario")
+    args = parser.parse_args(argv)
+
+    profile, profile_memory = profile_settings(args.profile, args.profile_memory)
+    report = run(args.scale, args.scenario, repeat=args.repeat, seed=args.seed, profile=profile, profile_memory=profile_memory)
+
+    print(f"{'scale':<8} {'scenario':<36} {'events':>9} {'median ms':>11} {'min ms':>9}")
+    for row in report["results"]:
+        print(f"{row['scale']:<8} {row['scenario']:<36} {row['events']:>9} {row['median'] * 1000:>11.3f} {row['min'] * 1000:>9.3f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fp:
+            json.dump(report, fp, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fp:
+            baseline = json.load(fp)
+        print(f"\nCompared with {baseline.get('commit') or args.compare}:")
+        for scale, scenario, before, after, ratio in compare(report, baseline):
+            print(f"{scale:<8} {scenario:<36} {before * 1000:>9.3f} -> {after * 1000:>9.3f} ms  ({ratio:.2f}x)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
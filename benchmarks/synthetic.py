@@ -0,0 +1,94 @@
+import random
+from datetime import date, timedelta
+
+from db import add_habit, increment_habits_bulk
+
+
+# Synthetic data generator: N users x M habits x K years of events, always the same for the same seed
+# ---------------------------------------------------------------------------------------------------
+
+MOODS = ["😞", "😐", "😄"]
+
+
+def user_names(users):
+    """
+    Names of the generated users.
+
+    Args:
+        users (int): Number of users.
+
+    Returns:
+        list: ["user_000", "user_001", ...]
+    """
+    return [f"user_{i:03d}" for i in range(users)]
+
+
+def habit_names(habits_per_user):
+    """
+    Names and periods of the habits every generated user gets; every third habit is weekly.
+
+    Args:
+        habits_per_user (int): Number of habits per user.
+
+    Returns:
+        list: List of (name, period) tuples.
+    """
+    return [(f"habit_{i:02d}", "weekly" if i % 3 == 2 else "daily") for i in range(habits_per_user)]
+
+
+def generate(db, users, habits_per_user, years, seed=0, end=None):
+    """
+    Fill a database with habits and a realistic, streaky event history.
+
+    Daily habits are done on most days, with streaks that break and restart; weekly
+    habits get one or two entries in most weeks. Moods are random.
+
+    Args:
+        db: SQLite database connection.
+        users (int): Number of users.
+        habits_per_user (int): Number of habits per user.
+        years (int): Length of the history, ending today (or at `end`).
+        seed (int): Random seed, so every run produces the same data.
+        end (date, optional): Last day of the history. Defaults to today.
+
+    Returns:
+        int: Number of events inserted.
+    """
+    rng = random.Random(seed)
+    end = end or date.today()
+    start = end - timedelta(days=365 * years)
+
+    for user_name in user_names(users):
+        for name, period in habit_names(habits_per_user):
+            add_habit(db, name, f"Synthetic {period} habit", period, user_name)
+
+    def events():
+        for user_name in user_names(users):
+            for name, period in habit_names(habits_per_user):
+                for day in _history(rng, period, start, end):
+                    yield (day, name, user_name, rng.choice(MOODS), rng.choice(MOODS))
+
+    inserted, _ = increment_habits_bulk(db, events(), chunk_size=5000)
+    return inserted
+
+
+def _history(rng, period, start, end):
+    """
+    Completion dates of one habit between start and end.
+    """
+    day = start
+    if period == "daily":
+        # A two-state chain: on a streak most days are done, after a break it takes a while to restart
+        on_streak = True
+        while day <= end:
+            on_streak = rng.random() < (0.92 if on_streak else 0.35)
+            if on_streak:
+                yield day
+            day += timedelta(days=1)
+    else:
+        while day <= end:
+            if rng.random() < 0.8:
+                for offset in sorted(rng.sample(range(7), rng.choice([1, 1, 2]))):
+                    if day + timedelta(days=offset) <= end:
+                        yield day + timedelta(days=offset)
+            day += timedelta(days=7)
@@ -0,0 +1,368 @@
+import argparse
+import json
+import sqlite3
+import sys
+from contextlib import contextmanager, ExitStack
+from datetime import date
+
+from db import (
+    get_db,
+    is_sharded,
+    add_habit,
+    increment_habit,
+    delete_habit,
+    delete_event,
+    get_habit_id,
+    get_habit_details,
+    import_events,
+    export_events,
+    EVENT_FORMATS,
+)
+
+from analysis import summarize_habit, analyze_all_habits, BATCH_COLUMNS
+from periods import is_period
+from profiling import profile_if_enabled
+
+
+# Non-interactive command line: habitly log / stats / delete / import, for scripts and cron jobs
+# ----------------------------------------------------------------------------------------------
+
+# Mood names accepted on the command line next to the emojis the interactive menu uses
+MOODS = {"good": "😄", "neutral": "😐", "bad": "😞", "😄": "😄", "😐": "😐", "😞": "😞"}
+
+
+class CommandError(Exception):
+    """
+    A command could not be carried out; the message is shown to the user and the exit code is 1.
+    """
+
+
+def build_parser():
+    """
+    Build the argument parser for the non-interactive commands.
+
+    Returns:
+        argparse.ArgumentParser: Parser with the log, stats, delete, import, export, shard and rebalance subcommands.
+    """
+    parser = argparse.ArgumentParser(prog="habitly", description="Habitly without prompts, for scripts and cron jobs.")
+    parser.add_argument("--db", default="main.db", help="database file or shard directory (default: main.db)")
+    parser.add_argument("--json", action="store_true", help="print machine-readable JSON")
+    parser.add_argument("--metrics", metavar="FILE", help="record query and function metrics into FILE (.prom for Prometheus text, otherwise JSON)")
+    parser.add_argument("--profile", metavar="DIR", help="write a cProfile .pstats file of the command into DIR (default: $HABITLY_PROFILE)")
+    parser.add_argument("--profile-memory", action="store_true", help="with --profile, also write the top allocations (tracemalloc)")
+
+    # The same options after the command; SUPPRESS keeps the command from resetting a value given before it
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--db", default=argparse.SUPPRESS, help="database file or shard directory (default: main.db)")
+    common.add_argument("--json", action="store_true", default=argparse.SUPPRESS, help="print machine-readable JSON")
+    common.add_argument("--metrics", metavar="FILE", default=argparse.SUPPRESS, help="record query and function metrics into FILE")
+    common.add_argument("--profile", metavar="DIR", default=argparse.SUPPRESS, help="write a cProfile .pstats file of the command into DIR")
+    common.add_argument("--profile-memory", action="store_true", default=argparse.SUPPRESS, help="also write the top allocations (tracemalloc)")
+
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    log = commands.add_parser("log", parents=[common], help="log a habit completion")
+    log.add_argument("habit")
+    log.add_argument("--user", required=True)
+    log.add_argument("--date", type=_parse_date, default=None, help="YYYY-MM-DD (default: today)")
+    log.add_argument("--before", type=_parse_mood, help="mood before: good, neutral, bad or an emoji")
+    log.add_argument("--after", type=_parse_mood, help="mood after: good, neutral, bad or an emoji")
+    log.add_argument(
+        "--period", type=_parse_period,
+        help="create the habit with this period if it does not exist yet: daily, weekly, monthly, 'N per week' or 'every N days'",
+    )
+    log.add_argument("--description", default="", help="description for a newly created habit")
+    log.set_defaults(handler=log_command)
+
+    stats = commands.add_parser("stats", parents=[common], help="show count, streaks and mood improvements")
+    stats.add_argument("habit", nargs="?", help="a single habit (default: all habits)")
+    stats.add_argument("--user", help="the habit's owner; required together with a habit")
+    stats.add_argument("--workers", type=int, help="analyze all users' habits in this many processes (not with --user)")
+    stats.set_defaults(handler=stats_command)
+
+    delete = commands.add_parser("delete", parents=[common], help="delete a habit, or one of its events with --date")
+    delete.add_argument("habit")
+    delete.add_argument("--user", required=True)
+    delete.add_argument("--date", type=_parse_date, help="only delete the event on this day")
+    delete.set_defaults(handler=delete_command)
+
+    load = commands.add_parser("import", parents=[common], help="import events from a CSV or JSON Lines file ('-' for stdin)")
+    load.add_argument("file")
+    load.add_argument("--format", choices=EVENT_FORMATS, help="default: guessed from the file extension, csv for stdin")
+    load.set_defaults(handler=import_command)
+
+    dump = commands.add_parser("export", parents=[common], help="export events to a CSV or JSON Lines file ('-' for stdout)")
+    dump.add_argument("file")
+    dump.add_argument("--format", choices=EVENT_FORMATS, help="default: guessed from the file extension, csv for stdout")
+    dump.add_argument("--user", help="only export this user's events")
+    dump.set_defaults(handler=export_command)
+
+    shard = commands.add_parser("shard", parents=[common], help="copy the --db file into a new shard directory")
+    shard.add_argument("directory")
+    shard.add_argument("--shards", type=_parse_shards, required=True, help="number of shard files")
+    shard.set_defaults(handler=shard_command)
+
+    rebalance = commands.add_parser("rebalance", parents=[common], help="change the number of shards of the --db directory")
+    rebalance.add_argument("--shards", type=_parse_shards, required=True, help="new number of shard files")
+    rebalance.set_defaults(handler=rebalance_command)
+
+    return parser
+
+
+def run(argv=None):
+    """
+    Parse the arguments, run one command and print its result.
+
+    Args:
+        argv (list, optional): Command-line arguments without the program name. Defaults to sys.argv[1:].
+
+    Returns:
+        int: Exit code, 0 on success and 1 if the command failed.
+    """
+    args = build_parser().parse_args(argv)
+    with _measured(args):
+        return _run_command(args)
+
+
+@contextmanager
+def _measured(args):
+    """
+    Record metrics (--metrics) and a profile (--profile or HABITLY_PROFILE) of a command if asked to.
+    """
+    with ExitStack() as stack:
+        if args.metrics:
+            import instrumentation  # only loaded when metrics are asked for
+            instrumentation.reset()
+            instrumentation.enable()
+            stack.callback(instrumentation.write_snapshot, args.metrics)
+            stack.callback(instrumentation.disable)
+        stack.enter_context(profile_if_enabled(args.command, args.profile, args.profile_memory))
+        yield
+
+
+def _run_command(args):
+    """
+    Open the database, run the parsed command and print its result; returns the exit code.
+    """
+    db = None
+    try:
+        db = _open_db(args.db)
+        result = args.handler(db, args)
+    except CommandError as error:
+        print(f"⚠️  {error}", file=sys.stderr)
+        return 1
+    finally:
+        if db is not None:
+            db.close()
+
+    if result is None:
+        pass  # the command's output went to stdout already
+    elif args.json:
+        print(json.dumps(result, ensure_ascii=False))
+    else:
+        print(_format_text(result))
+    return 0
+
+
+# Commands: each one returns a JSON-serializable result
+# ----------------------------------------------------
+
+def log_command(db, args):
+    """
+    Log one completion of a habit, creating the habit first if --period is given.
+    """
+    event_date = str(args.date or date.today())
+    if get_habit_id(db, args.habit, args.user) is None:
+        if not args.period:
+            raise CommandError(f"There is no habit named '{args.habit}' for {args.user}. Pass --period to create it.")
+        add_habit(db, args.habit, args.description, args.period, args.user)
+
+    increment_habit(db, args.habit, args.user, event_date, args.before, args.after)
+    return {
+        "user_name": args.user,
+        "habit": args.habit,
+        "date": event_date,
+        "mood_before": args.before,
+        "mood_after": args.after,
+    }
+
+
+def stats_command(db, args):
+    """
+    Summarize one habit, or every habit (of one user) in a single batch.
+    """
+    if args.habit is None:
+        if args.workers and args.user is not None:
+            raise CommandError("--workers spreads all users over processes and can't be combined with --user.")
+        if args.workers:
+            from reports import run_report  # multiprocessing is only imported when it's used
+            rows = run_report(args.db, workers=args.workers)
+        else:
+            rows = analyze_all_habits(db, args.user)
+        return [dict(zip(BATCH_COLUMNS, row)) for row in rows]
+
+    if not args.user:
+        raise CommandError("--user is required when a habit is given.")
+    details = get_habit_details(db, args.habit, args.user)
+    if not details:
+        raise CommandError(f"There is no habit named '{args.habit}' for {args.user}.")
+
+    stats = summarize_habit(db, args.habit, args.user, details["period"])
+    return {
+        "user_name": args.user,
+        "habit": args.habit,
+        "period": details["period"],
+        "description": details["description"],
+        "created_at": details["created_at"],
+        **stats,
+    }
+
+
+def delete_command(db, args):
+    """
+    Delete a habit with all its events, or only its event on --date.
+    """
+    if get_habit_id(db, args.habit, args.user) is None:
+        raise CommandError(f"There is no habit named '{args.habit}' for {args.user}.")
+
+    if args.date:
+        if not delete_event(db, args.habit, args.user, str(args.date)):
+            raise CommandError(f"'{args.habit}' of {args.user} has no event on {args.date}.")
+        return {"user_name": args.user, "habit": args.habit, "deleted": "event", "date": str(args.date)}
+
+    delete_habit(db, args.habit, args.user)
+    return {"user_name": args.user, "habit": args.habit, "deleted": "habit"}
+
+
+def import_command(db, args):
+    """
+    Import events from CSV or JSON Lines with the fields date, habit, user_name, mood_before and mood_after.
+    Events of unknown habits and rows with invalid dates are counted as rejected.
+    """
+    file_format = args.format or _guess_format(args.file)
+    try:
+        fp = sys.stdin if args.file == "-" else open(args.file, newline="", encoding="utf-8")
+    except OSError as error:
+        raise CommandError(f"Could not open '{args.file}': {error.strerror}.")
+
+    with fp:
+        try:
+            return import_events(db, fp, file_format)
+        except json.JSONDecodeError as error:
+            raise CommandError(f"'{args.file}' is not valid JSON Lines: {error.msg}.")
+
+
+def export_command(db, args):
+    """
+    Export events to CSV or JSON Lines. Written to stdout, the events are the only output.
+    """
+    file_format = args.format or _guess_format(args.file)
+    if args.file == "-":
+        export_events(db, sys.stdout, file_format, args.user)
+        return None
+
+    try:
+        fp = open(args.file, "w", newline="", encoding="utf-8")
+    except OSError as error:
+        raise CommandError(f"Could not open '{args.file}': {error.strerror}.")
+    with fp:
+        return export_events(db, fp, file_format, args.user)
+
+
+def shard_command(db, args):
+    """
+    Copy a single-file database into a new shard directory; the file itself is kept.
+    """
+    if is_sharded(db):
+        raise CommandError(f"'{args.db}' is sharded already. Use rebalance to change the number of shards.")
+    from shards import migrate_to_shards
+    try:
+        users = migrate_to_shards(args.db, args.directory, args.shards)
+    except ValueError as error:
+        raise CommandError(str(error))
+    return {"users": users, "shards": args.shards, "directory": args.directory}
+
+
+def rebalance_command(db, args):
+    """
+    Spread the users of a shard directory over a new number of shards.
+    """
+    if not is_sharded(db):
+        raise CommandError(f"'{args.db}' is not a shard directory. Create one with the shard command.")
+    from shards import rebalance
+    return {"moved": rebalance(db, args.shards), "shards": args.shards}
+
+
+# Helpers for parsing arguments and printing results
+# -------------------------------------------------
+
+def _open_db(name):
+    """
+    get_db for the commands: a database that can't be opened, such as a directory that isn't a shard
+    directory, a path in a missing directory or a file that isn't SQLite, is a CommandError.
+    """
+    try:
+        return get_db(name)
+    except ValueError as error:
+        raise CommandError(str(error))
+    except sqlite3.Error as error:
+        raise CommandError(f"Can't open the database '{name}': {error}")
+
+
+def _parse_date(value):
+    """
+    argparse type for YYYY-MM-DD dates.
+    """
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date '{value}', use YYYY-MM-DD")
+
+
+def _parse_mood(value):
+    """
+    argparse type for moods given by name or emoji.
+    """
+    if value not in MOODS:
+        raise argparse.ArgumentTypeError(f"invalid mood '{value}', use good, neutral or bad")
+    return MOODS[value]
+
+
+def _parse_period(value):
+    """
+    argparse type for habit periods.
+    """
+    if not is_period(value):
+        raise argparse.ArgumentTypeError(f"invalid period '{value}', use daily, weekly, monthly, 'N per week' or 'every N days'")
+    return value
+
+
+def _parse_shards(value):
+    """
+    argparse type for a number of shards.
+    """
+    if not value.isdigit() or int(value) < 1:
+        raise argparse.ArgumentTypeError(f"invalid number of shards '{value}', use a positive whole number")
+    return int(value)
+
+
+def _guess_format(path):
+    """
+    Event file format from the file extension: jsonl for .jsonl and .json, otherwise csv.
+    """
+    return "jsonl" if path.endswith((".jsonl", ".json")) else "csv"
+
+
+def _format_text(result):
+    """
+    Plain-text rendering of a command result: one 'key: value' line per field, habits separated by blank lines.
+    """
+    if result == []:
+        return "No habits found."
+    if isinstance(result, list):
+        return "\n\n".join(_format_text(item) for item in result)
+    return "\n".join(f"{key}: {'—' if value is None else value}" for key, value in result.items())
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -1,84 +1,687 @@
+import csv
+import functools
+import json
+import os
+import re
 import sqlite3
+from contextlib import contextmanager, ExitStack
+import threading
+import time
+from collections import OrderedDict, deque
 from datetime import date
 
 
 # Database setup: connect to SQLite and initialize required tables
 # ---------------------------------------------------------------
 
-def get_db(name="main.db"):
+# Bumped whenever create_tables changes, so get_db knows when an existing file needs the DDL again
+SCHEMA_VERSION = 5
+
+# Connection tuning profiles: pragmas applied by get_db right after connecting
+PROFILES = {
+    # Safe default: WAL lets readers and a writer work side by side, every commit is fsynced
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "mmap_size": 64 * 1024 * 1024,
+        "cache_size": -16000,  # negative values are KiB, so roughly 16 MB
+        "temp_store": "MEMORY",
+    },
+    # Bulk work and benchmarks: WAL with NORMAL sync can lose the last commits on power loss, never corrupts
+    "fast": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64000,
+        "temp_store": "MEMORY",
+    },
+    # Reports and analytics: the file is opened read-only, so the journal mode is left as it is
+    "readonly": {
+        "query_only": "ON",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64000,
+        "temp_store": "MEMORY",
+    },
+}
+
+
+# How tracker dates can be stored: ISO text ('YYYY-MM-DD') or integer day ordinals (date.toordinal)
+DATE_STORAGES = ("text", "ordinal")
+
+
+class Connection(sqlite3.Connection):
+    """
+    The connection class used by get_db.
+
+    It behaves exactly like sqlite3.Connection, but can remember facts about its database
+    (such as how tracker dates are stored) so they are looked up once per connection,
+    and carries the connection's metadata cache. Plain sqlite3 connections work with all
+    functions in this module as well; they just read everything from the database.
+    Inside group_commit, commit() is deferred until the whole group is done.
     """
-    Connect to the SQLite database and initialize tables if they don't exist.
+
+    commits_deferred = False
+
+    def commit(self):
+        if not self.commits_deferred:
+            super().commit()
+
+
+def get_db(name="main.db", profile="durable", date_storage=None, check_same_thread=True, timeout=5.0, shards=None):
+    """
+    Connect to the SQLite database, apply a tuning profile and initialize tables if needed.
+
+    The schema is only (re)created when the file's stored user_version is older than
+    SCHEMA_VERSION, so opening an up-to-date database runs no DDL at all.
 
     Args:
         name (str): Database file name. Defaults to "main.db".
+        profile (str): One of the keys of PROFILES ("durable", "fast" or "readonly").
+        date_storage (str, optional): "text" or "ordinal". If the database stores dates
+            differently, it is converted once. Defaults to keeping the current storage.
+        check_same_thread (bool): Passed to sqlite3.connect. Only turn it off when access is
+            serialized otherwise, as pool.ConnectionPool does.
+        timeout (float): Seconds to wait for another connection's lock before raising
+            "database is locked" (SQLite's busy timeout).
+        shards (int, optional): Store users in this many database files inside the directory
+            `name` instead of in one file. An existing shard directory is opened as sharded
+            without it. See shards.ShardRouter.
 
     Returns:
-        sqlite3.Connection: Database connection object.
+        sqlite3.Connection or shards.ShardRouter: Database connection object, or a router over
+            one connection per shard. All functions of this module accept either.
     """
-    db = sqlite3.connect(name)
-    create_tables(db)
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown database profile '{profile}'. Choose one of: {', '.join(PROFILES)}")
+
+    if shards is not None or os.path.isdir(name):
+        from shards import ShardRouter  # imported here because shards builds on this module
+        return ShardRouter(name, shards, profile, date_storage, check_same_thread, timeout)
+
+    readonly = profile == "readonly"
+    if readonly and name != ":memory:":
+        db = sqlite3.connect(f"file:{name}?mode=ro", uri=True, factory=Connection, check_same_thread=check_same_thread, timeout=timeout)
+    else:
+        db = sqlite3.connect(name, factory=Connection, check_same_thread=check_same_thread, timeout=timeout)
+
+    apply_profile(db, profile)
+
+    if not readonly and get_schema_version(db) < SCHEMA_VERSION:
+        create_tables(db)
+    if not readonly and date_storage is not None and get_date_storage(db) != date_storage:
+        convert_date_storage(db, date_storage)
     return db
 
 
+@contextmanager
+def group_commit(db):
+    """
+    Run several writing functions of this module as one transaction, with a single commit at the end.
+
+    Inside the block the functions' own db.commit() calls are deferred, so N events cost one
+    commit (and one fsync) instead of N. Each call made through the yielded run() gets its own
+    savepoint: if it raises, only its changes are undone and the exception is passed on, the
+    rest of the group still commits. An exception escaping the block rolls back everything.
+    Functions that manage their own transaction with `with db:` (increment_habits_bulk,
+    import_events) commit on their own and shouldn't be used inside the group.
+
+    Example:
+        with group_commit(db) as run:
+            for event in events:
+                run(increment_habit, *event)
+
+    With a sharded database every shard gets a transaction of its own; they are committed
+    one after the other at the end, so the group is atomic per shard, not across shards.
+
+    Args:
+        db (Connection or shards.ShardRouter): A connection or sharded database opened by get_db.
+
+    Yields:
+        callable: run(function, *args, **kwargs) calls function(db, *args, **kwargs) and returns its result.
+    """
+    connections = db.connections if is_sharded(db) else [db]
+    if not all(isinstance(connection, Connection) for connection in connections):
+        raise TypeError("group_commit needs a connection opened by get_db.")
+
+    def run(function, *args, **kwargs):
+        for connection in connections:
+            connection.execute("SAVEPOINT grouped_write")
+        try:
+            result = function(db, *args, **kwargs)
+        except BaseException:
+            for connection in connections:
+                connection.execute("ROLLBACK TO grouped_write")
+                connection.execute("RELEASE grouped_write")
+                clear_metadata_cache(connection)  # ids cached by the undone call may be gone
+            raise
+        for connection in connections:
+            connection.execute("RELEASE grouped_write")
+        return result
+
+    for connection in connections:
+        if connection.in_transaction:
+            connection.commit()  # don't let the group swallow work that was pending before it
+        connection.execute("BEGIN")
+        connection.commits_deferred = True
+    try:
+        yield run
+    except BaseException:
+        for connection in connections:
+            connection.commits_deferred = False
+            connection.rollback()
+            clear_metadata_cache(connection)
+        raise
+    for connection in connections:
+        connection.commits_deferred = False
+        connection.commit()
+
+
+def apply_profile(db, profile):
+    """
+    Apply the pragmas of a tuning profile to an open connection.
+
+    Args:
+        db (sqlite3.Connection): Database connection object.
+        profile (str): One of the keys of PROFILES.
+    """
+    for pragma, value in PROFILES[profile].items():
+        db.execute(f"PRAGMA {pragma} = {value}")
+
+
+def get_schema_version(db):
+    """
+    Read the schema version stored in the database file.
+
+    Args:
+        db (sqlite3.Connection): Database connection object.
+
+    Returns:
+        int: The stored user_version, 0 for files created before versioning.
+    """
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+
 def create_tables(db):
     """
-    Create necessary tables for habits and tracked events if they don't already exist.
+    Create necessary tables for users, habits and tracked events if they don't already exist.
+
+    Users and habits have integer ids; tracker rows point at their habit by id instead of
+    repeating the habit and user names. Databases with the older name-keyed layout are
+    migrated automatically.
 
     Args:
         db (sqlite3.Connection): Database connection object.
     """
     cur = db.cursor()
+    previous_version = get_schema_version(db)
+
+    if previous_version < 3 and _has_name_keys(db):
+        _migrate_to_surrogate_keys(db)
+
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS user (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+    ''')
 
     cur.execute('''
         CREATE TABLE IF NOT EXISTS habit (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
             name TEXT NOT NULL,
             description TEXT,
             period TEXT,
             created_at TEXT DEFAULT (DATE('now')),
-            user_name TEXT NOT NULL,
-            PRIMARY KEY (name, user_name)
+            UNIQUE (user_id, name),
+            FOREIGN KEY (user_id) REFERENCES user(id)
         )
     ''')
 
     cur.execute('''
         CREATE TABLE IF NOT EXISTS tracker (
             date TEXT,
-            habitName TEXT,
-            user_name TEXT,
+            habit_id INTEGER NOT NULL,
             mood_before TEXT,
             mood_after TEXT,
-            FOREIGN KEY (habitName, user_name) REFERENCES habit(name, user_name)
+            FOREIGN KEY (habit_id) REFERENCES habit(id)
         )
     ''')
 
+    # One summary row per habit, kept up to date by increment_habit, delete_event and delete_habit.
+    # The streak columns are NULL for periods the table doesn't track (see STATS_PERIODS).
+    if previous_version < 5:
+        cur.execute("DROP TABLE IF EXISTS habit_stats")  # derived data: rebuilt below with nullable streaks
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS habit_stats (
+            habit_id INTEGER PRIMARY KEY,
+            total INTEGER NOT NULL DEFAULT 0,
+            last_date TEXT,
+            run_length INTEGER,
+            week_run_length INTEGER NOT NULL DEFAULT 0,
+            longest_streak INTEGER,
+            mood_improvements INTEGER NOT NULL DEFAULT 0,
+            moods_before INTEGER NOT NULL DEFAULT 0,
+            moods_after INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (habit_id) REFERENCES habit(id)
+        )
+    ''')
+
+    create_indexes(db)
+
+    # Databases from before version 3 have events but no (id-keyed) summary rows yet, version 3
+    # counted weekly streaks by rules that have since changed, and version 4 stored wrong
+    # streaks for periods other than daily and weekly
+    if previous_version < 5:
+        rebuild_stats(db)
+
+    cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     db.commit()
 
 
+def create_indexes(db):
+    """
+    Create the indexes used by the lookup and delete queries if they don't already exist.
+
+    Databases created before the indexes were introduced pick them up the next
+    time they are opened with get_db, so no separate migration step is needed.
+
+    Args:
+        db (sqlite3.Connection): Database connection object.
+    """
+    cur = db.cursor()
+
+    # Tracker lookups always filter on the habit, and the analytics read events in date order
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tracker_habit_date
+        ON tracker (habit_id, date)
+    ''')
+
+
+def _has_name_keys(db):
+    """
+    Check whether the database still uses the old layout where habits are keyed by (name, user_name).
+    """
+    columns = [row[1] for row in db.execute("PRAGMA table_info(habit)")]
+    return bool(columns) and "id" not in columns
+
+
+def _migrate_to_surrogate_keys(db):
+    """
+    Move a name-keyed database to the user/habit id layout in one transaction.
+
+    Habit ids are taken from the old rowids and tracker rows keep their order and date
+    storage. Events whose habit no longer exists can't be linked to an id and are dropped.
+    """
+    date_type = "INTEGER" if get_date_storage(db) == "ordinal" else "TEXT"
+
+    with db:
+        db.execute("BEGIN")  # sqlite3 only opens a transaction for DML; without it each CREATE commits on its own
+        db.execute("CREATE TABLE user (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)")
+        db.execute("INSERT INTO user (name) SELECT user_name FROM habit GROUP BY user_name ORDER BY MIN(rowid)")
+
+        db.execute('''
+            CREATE TABLE habit_new (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                description TEXT,
+                period TEXT,
+                created_at TEXT DEFAULT (DATE('now')),
+                UNIQUE (user_id, name),
+                FOREIGN KEY (user_id) REFERENCES user(id)
+            )
+        ''')
+        db.execute('''
+            INSERT INTO habit_new (id, user_id, name, description, period, created_at)
+            SELECT h.rowid, u.id, h.name, h.description, h.period, h.created_at
+            FROM habit h JOIN user u ON u.name = h.user_name
+        ''')
+
+        db.execute(f'''
+            CREATE TABLE tracker_new (
+                date {date_type},
+                habit_id INTEGER NOT NULL,
+                mood_before TEXT,
+                mood_after TEXT,
+                FOREIGN KEY (habit_id) REFERENCES habit(id)
+            )
+        ''')
+        db.execute('''
+            INSERT INTO tracker_new (rowid, date, habit_id, mood_before, mood_after)
+            SELECT t.rowid, t.date, h.rowid, t.mood_before, t.mood_after
+            FROM tracker t JOIN habit h ON h.name = t.habitName AND h.user_name = t.user_name
+            ORDER BY t.rowid
+        ''')
+
+        db.execute("DROP TABLE IF EXISTS habit_stats")
+        db.execute("DROP TABLE tracker")
+        db.execute("DROP TABLE habit")
+        db.execute("ALTER TABLE habit_new RENAME TO habit")
+        db.execute("ALTER TABLE tracker_new RENAME TO tracker")
+
+
+# Date storage: tracker dates as ISO text or as compact integer day ordinals
+# -----------------------------------------------------------------------
+
+def get_date_storage(db):
+    """
+    Find out how the tracker table stores dates.
+
+    Args:
+        db (sqlite3.Connection): Database connection object.
+
+    Returns:
+        str: "ordinal" if the date column is declared INTEGER, otherwise "text".
+    """
+    storage = getattr(db, "date_storage", None)
+    if storage is None:
+        declared = {row[1]: row[2] for row in db.execute("PRAGMA table_info(tracker)")}
+        storage = "ordinal" if declared.get("date", "").upper() == "INTEGER" else "text"
+        if isinstance(db, Connection):
+            db.date_storage = storage
+    return storage
+
+
+def convert_date_storage(db, date_storage, vacuum=True):
+    """
+    Rewrite the tracker table so its dates are stored as ISO text or as integer day ordinals.
+
+    The table is copied in one transaction with its row order intact; rows whose date
+    can't be parsed keep a NULL date. Afterwards the file is vacuumed to give back the space.
+    A table that already uses the requested storage is left alone.
+
+    Args:
+        db (sqlite3.Connection): Database connection object.
+        date_storage (str): "text" or "ordinal".
+        vacuum (bool): Run VACUUM after the conversion. Defaults to True.
+    """
+    if date_storage not in DATE_STORAGES:
+        raise ValueError(f"Unknown date storage '{date_storage}'. Choose one of: {', '.join(DATE_STORAGES)}")
+    if get_date_storage(db) == date_storage:
+        return  # converting again would run the date expressions on values already converted
+
+    columns = [row[1] for row in db.execute("PRAGMA table_info(tracker)")]
+    table_sql = db.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'tracker'").fetchone()[0]
+
+    # Same table definition, only the declared type of the date column changes
+    new_type = "INTEGER" if date_storage == "ordinal" else "TEXT"
+    table_sql = re.sub(r"\bdate\s+\w+", f"date {new_type}", table_sql, count=1)
+    table_sql = table_sql.replace("tracker", "tracker_converted", 1)
+
+    # julianday gives the Julian day number at noon; subtracting JDN_OFFSET turns it into date.toordinal
+    if date_storage == "ordinal":
+        date_sql = f"CAST(julianday(date) + 0.5 AS INTEGER) - {JDN_OFFSET}"
+    else:
+        date_sql = f"date(date + {JDN_OFFSET})"
+    selected = ", ".join(date_sql if column == "date" else column for column in columns)
+
+    with db:
+        db.execute("BEGIN")  # as in _migrate_to_surrogate_keys: the DDL must roll back with the copy
+        db.execute("DROP TABLE IF EXISTS tracker_converted")  # left over by an interrupted older release
+        db.execute(table_sql)
+        db.execute(
+            f"INSERT INTO tracker_converted (rowid, {', '.join(columns)}) "
+            f"SELECT rowid, {selected} FROM tracker ORDER BY rowid"
+        )
+        db.execute("DROP TABLE tracker")
+        db.execute("ALTER TABLE tracker_converted RENAME TO tracker")
+        create_indexes(db)
+
+    if isinstance(db, Connection):
+        db.date_storage = date_storage
+    if vacuum:
+        db.execute("VACUUM")
+
+
+def to_date(value):
+    """
+    Turn a date as stored in the tracker table (ISO text or day ordinal) into a date object.
+
+    Args:
+        value: ISO string, day ordinal, date object or None.
+
+    Returns:
+        date or None: The date, or None if the value isn't a valid date.
+    """
+    if isinstance(value, date):
+        return value
+    if isinstance(value, int):
+        return date.fromordinal(value)
+    try:
+        return date.fromisoformat(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _encode_date(db, value):
+    """
+    Convert a date (date object or ISO string) into the form the tracker table stores.
+    """
+    if get_date_storage(db) == "ordinal":
+        day = to_date(value)
+        return day.toordinal() if day else None
+    return value.isoformat() if isinstance(value, date) else value
+
+
+# date.toordinal() + JDN_OFFSET gives the Julian day number SQLite uses for the same date
+JDN_OFFSET = 1721425
+
+
+# Metadata cache: user lists, habit lists and habit details, kept per connection
+# -----------------------------------------------------------------------------
+
+# Upper bound on cached entries per connection (one per user list, per user's habit list and per habit)
+METADATA_CACHE_SIZE = 1024
+
+
+class MetadataCache:
+    """
+    A bounded least-recently-used cache for data that changes only when habits are added, renamed or deleted.
+
+    add_habit, rename_habit and delete_habit invalidate the entries they affect, so the
+    cache never serves data older than the writes made through the connections that share
+    it (one connection, or all connections of a pool.ConnectionPool). Other writes are not
+    seen; call clear_metadata_cache(db) after them. The cache is safe to share between threads.
+    """
+
+    def __init__(self, maxsize=METADATA_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0  # bumped by every invalidation
+
+    def get(self, key, load):
+        """
+        Return the cached value for key, or call load() to read it from the database and cache it.
+        """
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+            generation = self._generation
+
+        value = load()  # outside the lock, so a slow query doesn't hold up other threads
+
+        with self._lock:
+            # A value read before a concurrent invalidation may already be outdated, so it isn't kept
+            if generation == self._generation:
+                self._entries[key] = value
+                if len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)  # evict the least recently used entry
+        return value
+
+    def invalidate(self, *keys):
+        """
+        Drop the given keys; unknown keys are ignored.
+        """
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Drop every entry but keep the hit/miss counters.
+        """
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def info(self):
+        """
+        Counters for tuning the cache size.
+
+        Returns:
+            dict: "hits", "misses", "size" and "maxsize".
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "maxsize": self.maxsize}
+
+
+def get_metadata_cache(db):
+    """
+    Get the metadata cache of a connection opened by get_db, creating it on first use.
+
+    Args:
+        db (sqlite3.Connection): Database connection object.
+
+    Returns:
+        MetadataCache or None: None for plain sqlite3 connections, which are not cached.
+    """
+    if not isinstance(db, Connection):
+        return None
+    cache = getattr(db, "metadata_cache", None)
+    if cache is None:
+        cache = db.metadata_cache = MetadataCache()
+    return cache
+
+
+def clear_metadata_cache(db):
+    """
+    Forget all cached metadata of a connection, e.g. after another connection or process changed habits.
+
+    Args:
+        db (sqlite3.Connection): Database connection object.
+    """
+    if is_sharded(db):
+        for shard in db.connections:
+            clear_metadata_cache(shard)
+        return
+    cache = get_metadata_cache(db)
+    if cache is not None:
+        cache.clear()
+
+
+def _cached(db, key, load):
+    """
+    Read through the connection's metadata cache, or straight from the database for plain connections.
+    """
+    cache = get_metadata_cache(db)
+    return load() if cache is None else cache.get(key, load)
+
+
+def _invalidate_habit(db, name, user_name):
+    """
+    Drop the cached entries a change to one habit of a user affects.
+    """
+    cache = get_metadata_cache(db)
+    if cache is not None:
+        cache.invalidate(("users",), ("habits", user_name), ("periods", user_name), ("details", user_name, name))
+
+
+# Sharding: calls about one user go to the shard that stores the user
+# -------------------------------------------------------------------
+
+def route_to_shard(function):
+    """
+    Let a function that takes a user_name argument be called with a shards.ShardRouter.
+
+    The call is passed on to the connection of the user's shard; plain connections are
+    passed through untouched.
+    """
+    position = function.__code__.co_varnames.index("user_name")  # counting db as 0
+
+    @functools.wraps(function)
+    def wrapper(db, *args, **kwargs):
+        if not isinstance(db, sqlite3.Connection):
+            user_name = kwargs["user_name"] if "user_name" in kwargs else args[position - 1]
+            db = db.shard_for(user_name)
+        return function(db, *args, **kwargs)
+
+    return wrapper
+
+
+def is_sharded(db):
+    """
+    Whether db is a shards.ShardRouter rather than a single connection.
+    """
+    return not isinstance(db, sqlite3.Connection)
+
+
 # Manage habit data: create new habits, log events, and remove habits or specific entries
 # ---------------------------------------------------------------------------------------
 
+@route_to_shard
 def add_habit(db, name, description, period, user_name):
     """
-    Add a new habit for a user to the database.
+    Add a new habit for a user to the database. The user is registered on their first habit.
 
     Args:
         db (sqlite3.Connection): Database connection object.
         name (str): Name of the habit.
         description (str): Description of the habit.
-        period (str): 'daily' or 'weekly'.
+        period (str): 'daily', 'weekly' or another period understood by periods.get_period.
         user_name (str): User's name.
+
+    Returns:
+        int or None: The id of the new habit, or None if the user already has a habit with that name.
     """
     cur = db.cursor()
     try:
+        cur.execute("INSERT OR IGNORE INTO user (name) VALUES (?)", (user_name,))
         cur.execute('''
-            INSERT INTO habit (name, description, period, user_name)
-            VALUES (?, ?, ?, ?)
+            INSERT INTO habit (user_id, name, description, period)
+            SELECT id, ?, ?, ? FROM user WHERE name = ?
         ''', (name, description, period, user_name))
+        habit_id = cur.lastrowid
+        _save_stats(db, habit_id, _empty_stats())
         db.commit()
+        _invalidate_habit(db, name, user_name)
+        return habit_id
     except sqlite3.IntegrityError:
         print(f"\n⚠️  You already have a habit named '{name}'. Please choose a different name.\n")
 
 
+@route_to_shard
+def rename_habit(db, name, user_name, new_name):
+    """
+    Rename a habit. Events refer to the habit by id, so none of them need to be rewritten.
+
+    Args:
+        db (sqlite3.Connection): Database connection object.
+        name (str): Current name of the habit.
+        user_name (str): Name of the user.
+        new_name (str): New name of the habit.
+    """
+    habit_id = get_habit_id(db, name, user_name)
+    if habit_id is None:
+        print(f"\n⚠️  There is no habit named '{name}'.\n")
+        return
+    try:
+        db.execute("UPDATE habit SET name = ? WHERE id = ?", (new_name, habit_id))
+        db.commit()
+        _invalidate_habit(db, name, user_name)
+        _invalidate_habit(db, new_name, user_name)
+    except sqlite3.IntegrityError:
+        print(f"\n⚠️  You already have a habit named '{new_name}'. Please choose a different name.\n")
+
+
+@route_to_shard
 def increment_habit(db, name, user_name, event_date, mood_before, mood_after):
     """
     Log a habit completion event.
@@ -94,29 +697,168 @@ def increment_habit(db, name, user_name, event_date, mood_before, mood_after):
     if not event_date:
         event_date = str(date.today())
 
+    habit_id = get_habit_id(db, name, user_name)
+    if habit_id is None:
+        print(f"\n⚠️  There is no habit named '{name}'. Please create it first.\n")
+        return
+
     cur = db.cursor()
     cur.execute(
-        "INSERT INTO tracker (date, habitName, user_name, mood_before, mood_after) VALUES (?, ?, ?, ?, ?)",
-        (event_date, name, user_name, mood_before, mood_after)
+        "INSERT INTO tracker (date, habit_id, mood_before, mood_after) VALUES (?, ?, ?, ?)",
+        (_encode_date(db, event_date), habit_id, mood_before, mood_after)
     )
+    _update_stats(db, habit_id, event_date, mood_before, mood_after)
     db.commit()
 
 
+def increment_habits_bulk(db, events, chunk_size=1000):
+    """
+    Log many habit completion events at once, e.g. when backfilling from an export.
+
+    Rows are streamed from the iterable into executemany in chunks and written in
+    a single transaction, so the whole batch costs one commit instead of one per event.
+    Rows with the wrong shape, an invalid date or an unknown habit are skipped.
+    The summary statistics of every habit that received events are recomputed once at the end.
+    With a sharded database each event goes to its user's shard, with one transaction per shard.
+
+    Args:
+        db (sqlite3.Connection): Database connection object.
+        events (iterable): (date, name, user_name, mood_before, mood_after) tuples.
+            Any iterable or generator works; an empty date means today.
+        chunk_size (int): Number of rows handed to executemany at a time.
+
+    Returns:
+        tuple: (inserted, rejected) row counts.
+    """
+    sharded = is_sharded(db)
+    connections = db.connections if sharded else [db]
+    habit_ids = {}
+    touched = {connection: set() for connection in connections}
+    chunks = {connection: [] for connection in connections}
+    inserted = rejected = 0
+
+    with ExitStack() as transactions:
+        for connection in connections:
+            transactions.enter_context(connection)
+
+        for event in events:
+            row = _normalize_event(event)
+            if row is None:
+                rejected += 1
+                continue
+
+            event_date, name, user_name, mood_before, mood_after = row
+            shard = db.shard_for(user_name) if sharded else db
+            if (name, user_name) not in habit_ids:
+                habit_ids[(name, user_name)] = get_habit_id(shard, name, user_name)
+            habit_id = habit_ids[(name, user_name)]
+            if habit_id is None:
+                rejected += 1
+                continue
+
+            touched[shard].add(habit_id)
+            chunk = chunks[shard]
+            chunk.append((event_date, habit_id, mood_before, mood_after))
+            if len(chunk) >= chunk_size:
+                inserted += _insert_events(shard, chunk)
+                chunk.clear()
+
+        for connection in connections:
+            if chunks[connection]:
+                inserted += _insert_events(connection, chunks[connection])
+            for habit_id in touched[connection]:
+                _refresh_stats(connection, habit_id)
+
+    return inserted, rejected
+
+
+def _normalize_event(event):
+    """
+    Validate one bulk event and return it with a date object, or None if it is unusable.
+    """
+    try:
+        event_date, name, user_name, mood_before, mood_after = event
+    except (TypeError, ValueError):
+        return None
+
+    if not name or not user_name:
+        return None
+
+    if not event_date:
+        event_date = date.today()
+    elif not isinstance(event_date, date):
+        try:
+            event_date = date.fromisoformat(str(event_date))
+        except ValueError:
+            return None
+
+    return (event_date, name, user_name, mood_before, mood_after)
+
+
+def _insert_events(db, rows):
+    """
+    Insert a chunk of validated (date, habit_id, mood_before, mood_after) rows and return how many were written.
+    """
+    encode = date.toordinal if get_date_storage(db) == "ordinal" else date.isoformat
+    db.executemany(
+        "INSERT INTO tracker (date, habit_id, mood_before, mood_after) VALUES (?, ?, ?, ?)",
+        ((encode(event_date), *rest) for event_date, *rest in rows)
+    )
+    return len(rows)
+
+
+@route_to_shard
 def delete_habit(db, name, user_name):
     """
     Delete a habit and all its associated tracking events.
 
+    A user whose last habit is deleted is removed as well, just as users only appeared
+    in the user list as long as they had habits.
+
     Args:
         db (sqlite3.Connection): Database connection object.
         name (str): Name of the habit.
         user_name (str): Name of the user.
     """
+    habit_id = get_habit_id(db, name, user_name)
+    if habit_id is None:
+        return
+
+    cur = db.cursor()
+    cur.execute("DELETE FROM tracker WHERE habit_id = ?", (habit_id,))
+    cur.execute("DELETE FROM habit_stats WHERE habit_id = ?", (habit_id,))
+    cur.execute("DELETE FROM habit WHERE id = ?", (habit_id,))
+    cur.execute('''
+        DELETE FROM user
+        WHERE name = ? AND NOT EXISTS (SELECT 1 FROM habit WHERE habit.user_id = user.id)
+    ''', (user_name,))
+    db.commit()
+    _invalidate_habit(db, name, user_name)
+
+
+@route_to_shard
+def delete_user(db, user_name):
+    """
+    Delete a user with all their habits and tracking events.
+
+    Args:
+        db (sqlite3.Connection): Database connection object.
+        user_name (str): Name of the user.
+    """
+    habits = get_habits_for_user(db, user_name)
+    user_habits = "SELECT habit.id FROM habit JOIN user ON user.id = habit.user_id WHERE user.name = ?"
+
     cur = db.cursor()
-    cur.execute("DELETE FROM tracker WHERE habitName = ? AND user_name = ?", (name, user_name))
-    cur.execute("DELETE FROM habit WHERE name = ? AND user_name = ?", (name, user_name))
+    cur.execute(f"DELETE FROM tracker WHERE habit_id IN ({user_habits})", (user_name,))
+    cur.execute(f"DELETE FROM habit_stats WHERE habit_id IN ({user_habits})", (user_name,))
+    cur.execute(f"DELETE FROM habit WHERE id IN ({user_habits})", (user_name,))
+    cur.execute("DELETE FROM user WHERE name = ?", (user_name,))
     db.commit()
+    for name in habits:
+        _invalidate_habit(db, name, user_name)
 
 
+@route_to_shard
 def delete_event(db, name, user_name, date):
     """
     Delete a specific event (by date) for a given habit and user.
@@ -126,18 +868,90 @@ def delete_event(db, name, user_name, date):
         name (str): Name of the habit.
         user_name (str): Name of the user.
         date (str): Date of the event to delete.
+
+    Returns:
+        int: Number of events deleted, 0 if nothing was logged on that date.
     """
+    habit_id = get_habit_id(db, name, user_name)
+    if habit_id is None:
+        return 0
+
     cur = db.cursor()
-    cur.execute("DELETE FROM tracker WHERE habitName = ? AND user_name = ? AND date = ?", (name, user_name, date))
+    cur.execute(
+        "DELETE FROM tracker WHERE habit_id = ? AND date = ?",
+        (habit_id, _encode_date(db, date))
+    )
+    if cur.rowcount:
+        _refresh_stats(db, habit_id)  # removing a day can split a streak, so recount this habit
     db.commit()
+    return cur.rowcount
 
 
 # Functions to retrieve habit data, user lists, and tracking history from the database
 # -------------------------------------------------------------------------------------
 
+@route_to_shard
+def get_habit_id(db, name, user_name):
+    """
+    Look up the id of a user's habit.
+
+    Args:
+        db (sqlite3.Connection): Database connection object.
+        name (str): Name of the habit.
+        user_name (str): Name of the user.
+
+    Returns:
+        int or None: The habit id, or None if the habit doesn't exist.
+    """
+    details = get_habit_details(db, name, user_name)
+    return details["id"] if details else None
+
+
+@route_to_shard
+def get_habit_details(db, name, user_name):
+    """
+    Get the stored metadata of a habit.
+
+    Args:
+        db (sqlite3.Connection): Database connection object.
+        name (str): Name of the habit.
+        user_name (str): Name of the user.
+
+    Returns:
+        dict or None: Keys "id", "name", "user_name", "description", "period" and "created_at",
+            or None if the habit doesn't exist.
+    """
+    details = _cached(db, ("details", user_name, name), lambda: _load_habit_details(db, name, user_name))
+    return dict(details) if details else None  # a copy, so callers can't change the cached entry
+
+
+def _load_habit_details(db, name, user_name):
+    """
+    Read a habit's metadata from the database for get_habit_details.
+    """
+    cursor = db.execute('''
+        SELECT habit.id, habit.description, habit.period, habit.created_at
+        FROM habit JOIN user ON user.id = habit.user_id
+        WHERE user.name = ? AND habit.name = ?
+    ''', (user_name, name))
+    result = cursor.fetchone()
+    if result is None:
+        return None
+    habit_id, description, period, created_at = result
+    return {
+        "id": habit_id,
+        "name": name,
+        "user_name": user_name,
+        "description": description,
+        "period": period,
+        "created_at": created_at,
+    }
+
+
+@route_to_shard
 def get_habit_data(db, name, user_name):
     """
-    Retrieve all tracker entries for a specific habit and user.
+    Retrieve all tracker entries for a specific habit and user, oldest first.
 
     Args:
         db (sqlite3.Connection): Database connection object.
@@ -145,13 +959,68 @@ def get_habit_data(db, name, user_name):
         user_name (str): Name of the user.
 
     Returns:
-        list: List of rows containing event data.
+        list: List of (date, habit name, user name, mood_before, mood_after) rows. The date
+            is a date object whatever the date storage (None if unparseable), as in iter_habit_events.
     """
+    habit_id = get_habit_id(db, name, user_name)
+    if habit_id is None:
+        return []
+
     cur = db.cursor()
-    cur.execute("SELECT * FROM tracker WHERE habitName=? AND user_name=?", (name, user_name))
-    return cur.fetchall()
+    cur.execute(
+        "SELECT date, ?, ?, mood_before, mood_after FROM tracker WHERE habit_id = ? ORDER BY date",
+        (name, user_name, habit_id)
+    )
+    return [(to_date(row[0]), *row[1:]) for row in cur.fetchall()]
+
+
+# Columns iter_habit_events can return
+EVENT_COLUMNS = ("date", "mood_before", "mood_after")
+
+
+@route_to_shard
+def iter_habit_events(db, name, user_name, columns=EVENT_COLUMNS, batch_size=500):
+    """
+    Stream the tracker entries of a habit, oldest first, without loading the whole history.
+
+    Rows are fetched from the cursor batch_size at a time, so only one batch is held in
+    memory. Dates are returned as date objects whatever the date storage (None if unparseable).
+    Entries on the same day keep the order in which they were logged.
+
+    Args:
+        db (sqlite3.Connection): Database connection object.
+        name (str): Name of the habit.
+        user_name (str): Name of the user.
+        columns (tuple): Columns to return, a selection from EVENT_COLUMNS.
+        batch_size (int): Number of rows fetched at a time.
 
+    Yields:
+        tuple: One value per requested column.
+    """
+    unknown = [column for column in columns if column not in EVENT_COLUMNS]
+    if unknown or not columns:
+        raise ValueError(f"Unknown event columns {unknown}. Choose from: {', '.join(EVENT_COLUMNS)}")
+
+    habit_id = get_habit_id(db, name, user_name)
+    if habit_id is None:
+        return
+
+    cursor = db.execute(
+        f"SELECT {', '.join(columns)} FROM tracker WHERE habit_id = ? ORDER BY date, rowid",
+        (habit_id,)
+    )
+    position = columns.index("date") if "date" in columns else None
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            if position is not None:
+                row = (*row[:position], to_date(row[position]), *row[position + 1:])
+            yield row
 
+
+@route_to_shard
 def get_habits_for_user(db, user_name):
     """
     Get a list of all habit names belonging to a user.
@@ -163,26 +1032,58 @@ def get_habits_for_user(db, user_name):
     Returns:
         list: List of habit names.
     """
-    cur = db.cursor()
-    cur.execute("SELECT name FROM habit WHERE user_name=?", (user_name,))
-    return [row[0] for row in cur.fetchall()]
+    def load():
+        cur = db.execute(
+            "SELECT habit.name FROM habit JOIN user ON user.id = habit.user_id WHERE user.name = ? ORDER BY habit.id",
+            (user_name,)
+        )
+        return tuple(row[0] for row in cur)
+
+    return list(_cached(db, ("habits", user_name), load))
+
+
+@route_to_shard
+def get_habit_periods(db, user_name):
+    """
+    Get the name and period of every habit belonging to a user.
+
+    Args:
+        db (sqlite3.Connection): Database connection object.
+        user_name (str): Name of the user.
+
+    Returns:
+        list: List of (name, period) tuples.
+    """
+    def load():
+        cur = db.execute(
+            "SELECT habit.name, habit.period FROM habit JOIN user ON user.id = habit.user_id WHERE user.name = ? ORDER BY habit.id",
+            (user_name,)
+        )
+        return tuple(cur)
+
+    return list(_cached(db, ("periods", user_name), load))
 
 
 def get_all_users(db):
     """
-    Get a list of all distinct users in the database.
+    Get a list of all users in the database.
 
     Args:
         db (sqlite3.Connection): Database connection object.
 
     Returns:
-        list: List of unique user names.
+        list: List of unique user names, sorted. A sharded database asks every shard.
     """
-    cur = db.cursor()
-    cur.execute("SELECT DISTINCT user_name FROM habit")
-    return [row[0] for row in cur.fetchall()]
+    if is_sharded(db):
+        return sorted(user for shard in db.connections for user in get_all_users(shard))
+
+    def load():
+        return tuple(row[0] for row in db.execute("SELECT name FROM user ORDER BY name"))
 
+    return list(_cached(db, ("users",), load))
 
+
+@route_to_shard
 def get_period_for_habit(db, habit_name, user_name):
     """
     Get the period ('daily' or 'weekly') for a specific habit.
@@ -195,13 +1096,496 @@ def get_period_for_habit(db, habit_name, user_name):
     Returns:
         str or None: The period string, or None if not found.
     """
-    cursor = db.cursor()
-    cursor.execute(
-        "SELECT period FROM habit WHERE name = ? AND user_name = ?",
-        (habit_name, user_name)
+    details = get_habit_details(db, habit_name, user_name)
+    return details["period"] if details else None
+
+
+@route_to_shard
+def get_habit_stats(db, name, user_name):
+    """
+    Get the stored summary statistics of a habit without reading its events.
+
+    Args:
+        db (sqlite3.Connection): Database connection object.
+        name (str): Name of the habit.
+        user_name (str): Name of the user.
+
+    Returns:
+        dict or None: The habit_stats row as a dict, or None if there is none. run_length and
+            longest_streak are None for periods other than those in STATS_PERIODS.
+    """
+    try:
+        cursor = db.execute('''
+            SELECT habit_stats.*
+            FROM habit_stats
+            JOIN habit ON habit.id = habit_stats.habit_id
+            JOIN user ON user.id = habit.user_id
+            WHERE user.name = ? AND habit.name = ?
+        ''', (user_name, name))
+    except sqlite3.OperationalError:
+        return None  # a read-only connection to a database from before the table existed
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return dict(zip([column[0] for column in cursor.description], row))
+
+
+@route_to_shard
+def get_habit_report(db, name, user_name, events=True):
+    """
+    Get what an analytics view shows about a habit: its metadata, stored statistics and events.
+
+    One query reads the metadata together with the habit_stats row and a second one the
+    events, so a view needs no further lookups.
+
+    Args:
+        db (sqlite3.Connection): Database connection object.
+        name (str): Name of the habit.
+        user_name (str): Name of the user.
+        events (bool): Also load the events. Without them the report takes a single query.
+
+    Returns:
+        dict or None: The keys of get_habit_details plus "stats" (the habit_stats row as
+            returned by get_habit_stats, or None) and "events" (a list of (date, mood_before,
+            mood_after) tuples in the order of iter_habit_events, or None if not requested).
+            None if the habit doesn't exist.
+    """
+    cursor = db.execute('''
+        SELECT habit.id, habit.description, habit.period, habit.created_at, habit_stats.*
+        FROM habit
+        JOIN user ON user.id = habit.user_id
+        LEFT JOIN habit_stats ON habit_stats.habit_id = habit.id
+        WHERE user.name = ? AND habit.name = ?
+    ''', (user_name, name))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+
+    habit_id, description, period, created_at, *stats = row
+    report = {
+        "id": habit_id,
+        "name": name,
+        "user_name": user_name,
+        "description": description,
+        "period": period,
+        "created_at": created_at,
+        "stats": dict(zip([column[0] for column in cursor.description[4:]], stats)) if stats[0] is not None else None,
+        "events": None,
+    }
+    if events:
+        report["events"] = [
+            (to_date(event_date), mood_before, mood_after)
+            for event_date, mood_before, mood_after in db.execute(
+                "SELECT date, mood_before, mood_after FROM tracker WHERE habit_id = ? ORDER BY date, rowid",
+                (habit_id,)
+            )
+        ]
+    return report
+
+
+# Import and export: tracker history as CSV or JSON Lines, streamed in constant memory
+# -----------------------------------------------------------------------------------
+
+# Fields of an exported event, in column order; imports expect the same names
+EVENT_FIELDS = ("date", "habit", "user_name", "mood_before", "mood_after")
+
+EVENT_FORMATS = ("csv", "jsonl")
+
+
+def export_events(db, fp, format="csv", user_name=None, progress=None, progress_every=100_000):
+    """
+    Write the tracker history to a text file, one event per row, grouped by habit and sorted by date.
+
+    Rows are read by iterating the cursor and written one at a time, so memory use does
+    not grow with the size of the history. A sharded database is exported shard by shard.
+
+    Args:
+        db (sqlite3.Connection): Database connection object.
+        fp: Text file object opened for writing (for CSV with newline="").
+        format (str): "csv" (with a header row) or "jsonl".
+        user_name (str, optional): Only export this user's events. Defaults to all users.
+        progress (callable, optional): Called as progress(rows, seconds) every progress_every rows and at the end.
+        progress_every (int): Rows between progress calls.
+
+    Returns:
+        dict: "rows", "seconds" and "rows_per_second".
+    """
+    _check_event_format(format)
+    query = '''
+        SELECT tracker.date, habit.name, user.name, tracker.mood_before, tracker.mood_after
+        FROM tracker
+        JOIN habit ON habit.id = tracker.habit_id
+        JOIN user ON user.id = habit.user_id
+    '''
+    params = ()
+    if user_name is not None:
+        query += " WHERE user.name = ?"
+        params = (user_name,)
+    query += " ORDER BY tracker.habit_id, tracker.date, tracker.rowid"
+
+    if not is_sharded(db):
+        shards = [db]
+    elif user_name is not None:
+        shards = [db.shard_for(user_name)]
+    else:
+        shards = db.connections
+
+    if format == "csv":
+        writer = csv.writer(fp)
+        writer.writerow(EVENT_FIELDS)
+        write = writer.writerow
+    else:
+        write = lambda row: fp.write(json.dumps(dict(zip(EVENT_FIELDS, row)), ensure_ascii=False) + "\n")
+
+    rows = _ProgressCounter(
+        (row for shard in shards for row in _exported_rows(shard, query, params)), progress, progress_every
+    )
+    for row in rows:
+        write(row)
+    return rows.report()
+
+
+def _exported_rows(db, query, params):
+    """
+    Run the export query on one connection, yielding rows with ISO dates.
+    """
+    ordinal = get_date_storage(db) == "ordinal"
+    for row in db.execute(query, params):
+        if ordinal:
+            day = to_date(row[0])
+            row = (day.isoformat() if day else None, *row[1:])
+        yield row
+
+
+def import_events(db, fp, format="csv", chunk_size=5000, progress=None, progress_every=100_000):
+    """
+    Read events from a CSV (with a header row) or JSON Lines file and log them in one transaction.
+
+    The file is read lazily and handed to increment_habits_bulk, which inserts in batches,
+    so memory use does not grow with the file size. Rows for habits missing from the habit
+    table, rows with an invalid date and JSON lines that are not objects are rejected.
+    Malformed JSON raises ValueError and nothing is imported.
+
+    Args:
+        db (sqlite3.Connection): Database connection object.
+        fp: Text file object opened for reading (for CSV with newline="").
+        format (str): "csv" or "jsonl". Fields as in EVENT_FIELDS; missing moods are stored as NULL.
+        chunk_size (int): Number of rows inserted at a time.
+        progress (callable, optional): Called as progress(rows, seconds) every progress_every rows read and at the end.
+        progress_every (int): Rows between progress calls.
+
+    Returns:
+        dict: "inserted", "rejected", "rows", "seconds" and "rows_per_second".
+    """
+    _check_event_format(format)
+    records = _ProgressCounter(_read_event_records(fp, format), progress, progress_every)
+    inserted, rejected = increment_habits_bulk(db, (_record_to_event(record) for record in records), chunk_size)
+    return {"inserted": inserted, "rejected": rejected, **records.report()}
+
+
+def _check_event_format(format):
+    """
+    Raise ValueError for formats other than those in EVENT_FORMATS.
+    """
+    if format not in EVENT_FORMATS:
+        raise ValueError(f"Unknown event format '{format}'. Choose one of: {', '.join(EVENT_FORMATS)}")
+
+
+def _read_event_records(fp, format):
+    """
+    Yield the records of a CSV or JSON Lines file one at a time; blank JSON lines are skipped.
+    """
+    if format == "csv":
+        yield from csv.DictReader(fp)
+    else:
+        for line in fp:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _record_to_event(record):
+    """
+    Turn an imported record into a bulk event tuple; anything that is not a record becomes None and is rejected.
+    """
+    if not isinstance(record, dict):
+        return None
+    return (
+        record.get("date"),
+        record.get("habit"),
+        record.get("user_name"),
+        record.get("mood_before") or None,
+        record.get("mood_after") or None,
     )
-    result = cursor.fetchone()
+
+
+class _ProgressCounter:
+    """
+    Iterate over rows while counting them, reporting throughput to an optional callback.
+    """
+
+    def __init__(self, rows, progress, every):
+        self._rows = rows
+        self._progress = progress
+        self._every = every
+        self.count = 0
+        self.start = time.perf_counter()
+
+    def __iter__(self):
+        for row in self._rows:
+            yield row
+            self.count += 1
+            if self._progress and self.count % self._every == 0:
+                self._progress(self.count, time.perf_counter() - self.start)
+        if self._progress:
+            self._progress(self.count, time.perf_counter() - self.start)
+
+    def report(self):
+        """
+        Rows seen so far, elapsed seconds and the resulting rate.
+        """
+        seconds = time.perf_counter() - self.start
+        return {"rows": self.count, "seconds": seconds, "rows_per_second": self.count / seconds if seconds else 0.0}
+
+
+# Copying users between databases, e.g. from one shard to another
+# ----------------------------------------------------------------
+
+def copy_user(source, target, user_name):
+    """
+    Copy a user's habits, events and statistics from one database into another.
+
+    Whatever the target already stores of the user is replaced. Events keep their order
+    and are converted to the target's date storage. The copy is one transaction on the target.
+
+    Args:
+        source (sqlite3.Connection): Connection to read the user from.
+        target (Connection): Connection opened by get_db to write the user to.
+        user_name (str): Name of the user.
+
+    Returns:
+        int: Number of habits copied.
+    """
+    habits = source.execute('''
+        SELECT habit.id, habit.name, habit.description, habit.period, habit.created_at
+        FROM habit
+        JOIN user ON user.id = habit.user_id
+        WHERE user.name = ?
+        ORDER BY habit.id
+    ''', (user_name,)).fetchall()
+
+    with group_commit(target) as run:
+        run(delete_user, user_name)
+        for habit_id, name, description, period, created_at in habits:
+            new_id = run(add_habit, name, description, period, user_name)
+            target.execute("UPDATE habit SET created_at = ? WHERE id = ?", (created_at, new_id))
+            events = source.execute(
+                "SELECT date, mood_before, mood_after FROM tracker WHERE habit_id = ? ORDER BY rowid",
+                (habit_id,)
+            )
+            target.executemany(
+                "INSERT INTO tracker (date, habit_id, mood_before, mood_after) VALUES (?, ?, ?, ?)",
+                ((_encode_date(target, to_date(event_date) or event_date), new_id, mood_before, mood_after)
+                 for event_date, mood_before, mood_after in events)
+            )
+            _refresh_stats(target, new_id, period)
+    return len(habits)
+
+
+# Habit statistics: a summary row per habit, maintained incrementally by the functions above
+# -----------------------------------------------------------------------------------------
+
+# Periods whose streaks habit_stats maintains; other periods store NULL streaks and are computed from the events
+STATS_PERIODS = ("daily", "weekly")
+
+# Same scores as analysis.count_mood_improvements
+MOOD_SCORES = {"😞": 0, "😐": 1, "😄": 2}
+
+_STATS_FIELDS = (
+    "total", "last_date", "run_length", "week_run_length",
+    "longest_streak", "mood_improvements", "moods_before", "moods_after",
+)
+
+
+def rebuild_stats(db):
+    """
+    Recompute the summary statistics of every habit from its full event history.
+
+    Useful to verify the incrementally maintained habit_stats table: the return value
+    is the number of habits whose stored statistics did not match a full recount.
+
+    Args:
+        db (sqlite3.Connection): Database connection object.
+
+    Returns:
+        int: Number of habits whose statistics were corrected.
+    """
+    if is_sharded(db):
+        return sum(rebuild_stats(shard) for shard in db.connections)
+
+    cur = db.cursor()
+    cur.execute("SELECT id, period FROM habit")
+    corrected = 0
+    for habit_id, period in cur.fetchall():
+        if _refresh_stats(db, habit_id, period):
+            corrected += 1
+    cur.execute("DELETE FROM habit_stats WHERE habit_id NOT IN (SELECT id FROM habit)")
+    db.commit()
+    return corrected
+
+
+def _empty_stats():
+    """
+    Statistics of a habit without any events.
+    """
+    stats = dict.fromkeys(_STATS_FIELDS, 0)
+    stats["last_date"] = None
+    return stats
+
+
+def _load_stats(db, habit_id):
+    """
+    Load the stored statistics of a habit as a dict, or None if there is no row.
+    """
+    row = db.execute(
+        f"SELECT {', '.join(_STATS_FIELDS)} FROM habit_stats WHERE habit_id = ?",
+        (habit_id,)
+    ).fetchone()
+    return dict(zip(_STATS_FIELDS, row)) if row else None
+
+
+def _save_stats(db, habit_id, stats):
+    """
+    Write the statistics of a habit, replacing any previous row.
+    """
+    db.execute(
+        f"INSERT OR REPLACE INTO habit_stats (habit_id, {', '.join(_STATS_FIELDS)}) "
+        f"VALUES (?, {', '.join('?' for _ in _STATS_FIELDS)})",
+        (habit_id, *(stats[field] for field in _STATS_FIELDS))
+    )
+
+
+def _refresh_stats(db, habit_id, period=None):
+    """
+    Recount the statistics of one habit from its events; returns True if the stored row changed.
+    """
+    if period is None:
+        period = _period_of(db, habit_id)
+
+    cur = db.execute(
+        "SELECT date, mood_before, mood_after FROM tracker WHERE habit_id = ? ORDER BY date",
+        (habit_id,)
+    )
+    stats = _empty_stats()
+    unpaired_before, unpaired_after = deque(), deque()
+    for event_date, mood_before, mood_after in cur:
+        stats["total"] += 1
+        _advance_streaks(stats, period, _to_day(event_date))
+
+        # Moods are paired like extract_mood_stats + zip: the n-th mood before with the n-th mood after
+        if mood_before:
+            stats["moods_before"] += 1
+            if unpaired_after:
+                _count_pair(stats, mood_before, unpaired_after.popleft())
+            else:
+                unpaired_before.append(mood_before)
+        if mood_after:
+            stats["moods_after"] += 1
+            if unpaired_before:
+                _count_pair(stats, unpaired_before.popleft(), mood_after)
+            else:
+                unpaired_after.append(mood_after)
+
+    if stats == _load_stats(db, habit_id):
+        return False
+    _save_stats(db, habit_id, stats)
+    return True
+
+
+def _period_of(db, habit_id):
+    """
+    Get the period of a habit by id.
+    """
+    result = db.execute("SELECT period FROM habit WHERE id = ?", (habit_id,)).fetchone()
     return result[0] if result else None
 
 
+def _update_stats(db, habit_id, event_date, mood_before, mood_after):
+    """
+    Fold one newly logged event into the stored statistics of its habit.
+
+    The shortcut only holds for events that sort after all existing ones and keep the
+    mood pairing intact; anything else (a backdated entry, a half-recorded mood after an
+    uneven history) falls back to recounting this one habit.
+    """
+    stats = _load_stats(db, habit_id)
+    period = _period_of(db, habit_id)
+    day = _to_day(event_date)
+
+    in_order = stats is not None and day is not None and (
+        stats["last_date"] is None or day >= date.fromisoformat(stats["last_date"]).toordinal()
+    )
+    pairs_cleanly = (not mood_before and not mood_after) or (
+        mood_before and mood_after and stats is not None and stats["moods_before"] == stats["moods_after"]
+    )
+    if not in_order or not pairs_cleanly:
+        _refresh_stats(db, habit_id, period)
+        return
+
+    stats["total"] += 1
+    _advance_streaks(stats, period, day)
+    if mood_before and mood_after:
+        stats["moods_before"] += 1
+        stats["moods_after"] += 1
+        _count_pair(stats, mood_before, mood_after)
+    _save_stats(db, habit_id, stats)
+
+
+def _advance_streaks(stats, period, day):
+    """
+    Extend the streak counters with an event on `day` (a day ordinal), which is not older than last_date.
+
+    run_length is the streak ending at last_date: consecutive days for daily habits and
+    consecutive weeks (week ordinals as in analysis.to_week_ordinals) for weekly ones.
+    week_run_length counts the consecutive weeks for any period. Habits of other periods
+    get NULL run_length and longest_streak.
+    """
+    if day is None:
+        return
+
+    if stats["last_date"] is None:
+        stats["run_length"] = stats["week_run_length"] = stats["longest_streak"] = 1
+    else:
+        last = date.fromisoformat(stats["last_date"]).toordinal()
+        if day == last:
+            return  # a second entry on the same day doesn't extend any streak
+
+        week, last_week = (day - 1) // 7, (last - 1) // 7
+        if week != last_week:
+            stats["week_run_length"] = stats["week_run_length"] + 1 if week - last_week == 1 else 1
+
+        if period == "daily":
+            stats["run_length"] = stats["run_length"] + 1 if day - last == 1 else 1
+            stats["longest_streak"] = max(stats["longest_streak"], stats["run_length"])
+        elif period == "weekly":
+            stats["run_length"] = stats["week_run_length"]
+            stats["longest_streak"] = max(stats["longest_streak"], stats["run_length"])
+
+    if period not in STATS_PERIODS:
+        stats["run_length"] = stats["longest_streak"] = None
+    stats["last_date"] = date.fromordinal(day).isoformat()
 
+
+def _count_pair(stats, mood_before, mood_after):
+    """
+    Add one to the mood improvements if the mood after scores higher than the mood before.
+    """
+    if MOOD_SCORES.get(mood_after, 0) > MOOD_SCORES.get(mood_before, 0):
+        stats["mood_improvements"] += 1
+
+
+def _to_day(event_date):
+    """
+    Convert a stored event date to a day ordinal, or None if it isn't a valid date.
+    """
+    day = to_date(event_date)
+    return day.toordinal() if day else None
@@ -1,29 +1,32 @@
-from db import add_habit, increment_habit, delete_habit, delete_event
+from db import add_habit, increment_habit, increment_habits_bulk, delete_habit, delete_event
 
 class Habit:
     """
     A class representing a habit tracked by a user.
 
-    Each habit has a name, description, tracking period (e.g., daily or weekly), 
+    Each habit has a name, description, tracking period (e.g., daily, weekly or 3 per week), 
     and is associated with a specific user. This class provides methods to store 
     the habit in a database and to log or remove tracking events.
     """
 
-    def __init__(self, name: str, description: str, period: str, user_name: str):
+    def __init__(self, name: str, description: str, period: str, user_name: str, id: int = None):
         """
         Initialize a new Habit instance.
 
         Args:
             name (str): The name of the habit.
             description (str): A short description of the habit.
-            period (str): The periodicity of the habit ('daily' or 'weekly').
+            period (str): The periodicity of the habit, e.g. 'daily', 'weekly', 'monthly',
+                '3 per week' or 'every 2 days' (see periods.get_period).
             user_name (str): The name of the user who owns the habit.
+            id (int, optional): The habit's id in the database, set by store() for new habits.
             created_at(str): date of creation (format 'YYYY-MM-DD')
         """
         self.name = name
         self.description = description
         self.period = period
         self.user_name = user_name
+        self.id = id
 
 
     def add_event(self, db, date: str = None, mood_before: str = None, mood_after: str = None):
@@ -45,14 +48,37 @@ class Habit:
             mood_after=mood_after
         )
 
+    def add_events(self, db, events, chunk_size: int = 1000):
+        """
+        Record many completion events for this habit in one transaction.
+
+        Args:
+            db: The SQLite database connection.
+            events (iterable): (date, mood_before, mood_after) tuples; any iterable or generator works.
+            chunk_size (int, optional): Number of rows written per batch.
+
+        Returns:
+            tuple: (inserted, rejected) row counts.
+        """
+        def rows():
+            for event in events:
+                try:
+                    event_date, mood_before, mood_after = event
+                except (TypeError, ValueError):
+                    yield None  # malformed rows are counted as rejected by increment_habits_bulk
+                    continue
+                yield (event_date, self.name, self.user_name, mood_before, mood_after)
+
+        return increment_habits_bulk(db, rows(), chunk_size=chunk_size)
+
     def store(self, db):
         """
-        Save the habit to the database.
+        Save the habit to the database and remember the id it was given.
 
         Args:
             db: The SQLite database connection.
         """
-        add_habit(db, self.name, self.description, self.period, self.user_name)
+        self.id = add_habit(db, self.name, self.description, self.period, self.user_name)
         
     def delete(self, db):
         """
@@ -70,5 +96,8 @@ class Habit:
         Args:
             db: The SQLite database connection.
             date (str): The date of the event to delete (format 'YYYY-MM-DD').
+
+        Returns:
+            int: Number of events deleted.
         """
-        delete_event(db, self.name, self.user_name, date)
+        return delete_event(db, self.name, self.user_name, date)
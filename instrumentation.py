@@ -0,0 +1,563 @@
+import functools
+import inspect
+import json
+import logging
+import sqlite3
+import sys
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from collections import Counter, deque
+from contextlib import contextmanager
+
+import analysis
+import db as db_module
+
+
+# Instrumentation: call counts, latencies, rows and commits of the db and analysis functions
+# -----------------------------------------------------------------------------------------
+
+# Upper bounds (seconds) of the latency histogram buckets, Prometheus style; a last +Inf bucket is implied
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Statements that take at least this many seconds are logged as slow queries
+SLOW_QUERY_SECONDS = 0.1
+
+# Slow queries kept for the snapshot; older ones are only in the log
+SLOW_QUERY_LIMIT = 100
+
+# SQLite virtual machine instructions between two calls of the progress handler
+PROGRESS_STEPS = 1000
+
+# Functions called once per row or only while importing; wrapping them would cost more than it tells
+_NOT_WRAPPED = {"db.to_date", "db.route_to_shard", "db.is_sharded", "db.get_metadata_cache", "analysis.week_ordinal"}
+
+# Statement kinds whose row count is the number of rows written
+_WRITES = {"INSERT", "UPDATE", "DELETE", "REPLACE"}
+
+log = logging.getLogger("habitly.slow_queries")
+
+
+class Histogram:
+    """
+    Latencies counted into the buckets of LATENCY_BUCKETS, plus their count and sum.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: count, sum and cumulative bucket counts as [upper bound, count] pairs, the last bound "+Inf".
+        """
+        buckets, total = [], 0
+        for bound, count in zip((*LATENCY_BUCKETS, "+Inf"), self.counts):
+            total += count
+            buckets.append([bound, total])
+        return {"count": self.count, "sum": self.sum, "buckets": buckets}
+
+
+class Metrics:
+    """
+    Everything the instrumentation records, shared by all threads.
+
+    Function calls are timed by the wrappers enable installs, statements by the cursors of
+    instrumented connections. Statement and commit counts come from SQLite's trace callback,
+    so they include what sqlite3 runs on its own (BEGIN, COMMIT) and the statements of
+    executescript. Query latencies cover executing a statement up to its first row; fetching
+    further rows is part of the calling function's latency.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Forget everything recorded so far.
+        """
+        with self._lock:
+            self.functions = {}
+            self.queries = {}
+            self.statements = Counter()
+            self.rows_read = 0
+            self.rows_written = 0
+            self.vm_steps = 0
+            self.slow_queries = deque(maxlen=SLOW_QUERY_LIMIT)
+            self.slow_query_count = 0
+
+    def record_call(self, label, seconds, failed=False):
+        with self._lock:
+            entry = self.functions.get(label)
+            if entry is None:
+                entry = self.functions[label] = {"calls": 0, "errors": 0, "seconds": Histogram()}
+            entry["calls"] += 1
+            entry["errors"] += failed
+            entry["seconds"].observe(seconds)
+
+    def record_query(self, sql, seconds, rows_written):
+        with self._lock:
+            entry = self.queries.get(sql)
+            if entry is None:
+                entry = self.queries[sql] = {"kind": _statement_kind(sql), "calls": 0, "rows_written": 0, "seconds": Histogram()}
+            entry["calls"] += 1
+            entry["rows_written"] += rows_written
+            entry["seconds"].observe(seconds)
+            self.rows_written += rows_written
+            if seconds >= _settings["slow_query_seconds"]:
+                self.slow_query_count += 1
+                self.slow_queries.append({"sql": sql, "seconds": seconds, "at": time.time()})
+                log.warning("Slow query (%.1f ms): %s", seconds * 1000, sql)
+
+    def record_rows_read(self, rows):
+        with self._lock:
+            self.rows_read += rows
+
+    def record_statement(self, sql):
+        with self._lock:
+            self.statements[_statement_kind(sql)] += 1
+
+    def record_vm_steps(self):
+        with self._lock:
+            self.vm_steps += PROGRESS_STEPS
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: A JSON-serializable copy of everything recorded, see instrumentation.snapshot.
+        """
+        with self._lock:
+            return {
+                "enabled": is_enabled(),
+                "functions": {
+                    label: {"calls": entry["calls"], "errors": entry["errors"], "seconds": entry["seconds"].to_dict()}
+                    for label, entry in sorted(self.functions.items())
+                },
+                "queries": {
+                    sql: {
+                        "kind": entry["kind"],
+                        "calls": entry["calls"],
+                        "rows_written": entry["rows_written"],
+                        "seconds": entry["seconds"].to_dict(),
+                    }
+                    for sql, entry in sorted(self.queries.items())
+                },
+                "statements": dict(sorted(self.statements.items())),
+                "commits": self.statements["COMMIT"] + self.statements["END"],
+                "rows_read": self.rows_read,
+                "rows_written": self.rows_written,
+                "vm_steps": self.vm_steps,
+                "slow_query_count": self.slow_query_count,
+                "slow_queries": list(self.slow_queries),
+            }
+
+
+# What the instrumentation has recorded since it was first enabled or last reset
+metrics = Metrics()
+
+_settings = {"slow_query_seconds": SLOW_QUERY_SECONDS}
+
+# While enabled: (module dict, attribute, original function) for every patched name, to undo on disable
+_patched = []
+
+# Connections of type db.Connection that instrument switched to InstrumentedConnection
+_connections = weakref.WeakSet()
+
+_state_lock = threading.Lock()
+
+
+# Instrumented connections: statements timed by their cursors, rows and VM steps counted
+# -------------------------------------------------------------------------------------
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Cursor of an instrumented connection: times execute and executemany, counts rows read and written.
+    """
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_query(self, sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_query(self, sql, time.perf_counter() - start)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            metrics.record_rows_read(1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        metrics.record_rows_read(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        metrics.record_rows_read(len(rows))
+        return rows
+
+    def __next__(self):
+        row = super().__next__()
+        metrics.record_rows_read(1)
+        return row
+
+
+class InstrumentedConnection(db_module.Connection):
+    """
+    The class instrument gives a db.Connection: its statements run on InstrumentedCursor.
+
+    sqlite3 creates the cursor of Connection.execute without looking up cursor(), so the
+    shortcut methods are routed through cursor() here.
+    """
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+def instrument(db):
+    """
+    Record the statements, rows and commits of an open connection or sharded database.
+
+    Connections opened by db.get_db while instrumentation is enabled are instrumented
+    automatically; this is for connections that were open before. Plain sqlite3 connections
+    only report statement counts and VM steps, and keep them after disable.
+
+    Args:
+        db (sqlite3.Connection or shards.ShardRouter): The database to instrument.
+
+    Returns:
+        The same db.
+    """
+    if db_module.is_sharded(db):
+        for connection in db.connections:
+            instrument(connection)
+        return db
+
+    if type(db) is db_module.Connection:
+        db.__class__ = InstrumentedConnection  # same memory layout, so the class can be swapped in place
+        _connections.add(db)
+    db.set_trace_callback(metrics.record_statement)
+    db.set_progress_handler(metrics.record_vm_steps, PROGRESS_STEPS)
+    return db
+
+
+def _uninstrument(db):
+    """
+    Give an instrumented connection its callbacks and class back.
+    """
+    try:
+        db.set_trace_callback(None)
+        db.set_progress_handler(None, PROGRESS_STEPS)
+    except sqlite3.ProgrammingError:
+        pass  # closed already
+    db.__class__ = db_module.Connection
+
+
+def _record_query(cursor, sql, seconds):
+    kind = _statement_kind(sql)
+    rows_written = max(cursor.rowcount, 0) if kind in _WRITES else 0
+    metrics.record_query(" ".join(sql.split()), seconds, rows_written)
+
+
+@functools.lru_cache(maxsize=1024)
+def _statement_kind(sql):
+    """
+    First keyword of a statement in upper case, e.g. "SELECT" or "COMMIT".
+    """
+    words = sql.split(None, 1)
+    return words[0].upper() if words else ""
+
+
+# Switching the instrumentation on and off
+# ----------------------------------------
+
+def enable(slow_query_seconds=SLOW_QUERY_SECONDS):
+    """
+    Start recording: wrap the public functions of db and analysis and instrument new connections.
+
+    The wrappers replace the functions wherever a loaded module refers to them, so code that
+    did `from db import increment_habit` is measured as well. Nothing is wrapped while the
+    instrumentation is disabled, so it costs nothing then. Enabling twice only updates the
+    slow-query threshold.
+
+    Args:
+        slow_query_seconds (float): Statements taking at least this long are logged to the
+            "habitly.slow_queries" logger and kept in the snapshot.
+    """
+    with _state_lock:
+        _settings["slow_query_seconds"] = slow_query_seconds
+        if _patched:
+            return
+
+        replacements = {}
+        for module in (db_module, analysis):
+            for name, function in vars(module).items():
+                label = f"{module.__name__}.{name}"
+                if name.startswith("_") or label in _NOT_WRAPPED or not inspect.isfunction(function):
+                    continue
+                if function.__module__ != module.__name__:
+                    continue  # imported from elsewhere, e.g. analysis' copy of db.iter_habit_events
+                replacements[id(function)] = (function, _timed(label, function))
+
+        for module in list(sys.modules.values()):
+            namespace = getattr(module, "__dict__", None)
+            if not isinstance(namespace, dict):
+                continue
+            for name, value in list(namespace.items()):
+                replacement = replacements.get(id(value))
+                if replacement is not None and replacement[0] is value:
+                    namespace[name] = replacement[1]
+                    _patched.append((namespace, name, value))
+
+
+def disable():
+    """
+    Stop recording: put the original functions back and restore instrumented connections.
+
+    What was recorded is kept for snapshot until reset.
+    """
+    with _state_lock:
+        for namespace, name, original in _patched:
+            if getattr(namespace.get(name), "__wrapped__", None) is original:
+                namespace[name] = original
+        _patched.clear()
+        for connection in list(_connections):
+            _uninstrument(connection)
+        _connections.clear()
+
+
+def is_enabled():
+    """
+    Whether the instrumentation is recording.
+    """
+    return bool(_patched)
+
+
+def reset():
+    """
+    Forget everything recorded so far.
+    """
+    metrics.reset()
+
+
+@contextmanager
+def instrumented(slow_query_seconds=SLOW_QUERY_SECONDS):
+    """
+    Record everything inside a with block.
+
+    Example:
+        with instrumented() as recorded:
+            show_habit_analytics(db)
+        print(to_prometheus(recorded.snapshot()))
+
+    Yields:
+        Metrics: The recorded metrics.
+    """
+    enable(slow_query_seconds)
+    try:
+        yield metrics
+    finally:
+        disable()
+
+
+def _timed(label, function):
+    """
+    Wrapper recording calls and latency of function under label. Generators are timed while they run.
+    """
+    if label == "db.get_db":
+        @functools.wraps(function)
+        def open_instrumented(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                connection = function(*args, **kwargs)
+            except BaseException:
+                metrics.record_call(label, time.perf_counter() - start, failed=True)
+                raise
+            metrics.record_call(label, time.perf_counter() - start)
+            return instrument(connection)
+        return open_instrumented
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except BaseException:
+            metrics.record_call(label, time.perf_counter() - start, failed=True)
+            raise
+        if inspect.isgenerator(result):
+            return _timed_iteration(label, result, time.perf_counter() - start)
+        metrics.record_call(label, time.perf_counter() - start)
+        return result
+
+    return wrapper
+
+
+def _timed_iteration(label, generator, elapsed):
+    """
+    Pass on the items of generator, recording one call of label with the time spent producing them.
+    """
+    failed = False
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(generator)
+            except StopIteration:
+                return
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                elapsed += time.perf_counter() - start
+            yield item
+    finally:
+        generator.close()
+        metrics.record_call(label, elapsed, failed)
+
+
+# Snapshots: JSON for tools and tests, Prometheus text format for scraping
+# -----------------------------------------------------------------------
+
+def snapshot():
+    """
+    Everything recorded so far.
+
+    Returns:
+        dict: functions (calls, errors and latency histogram per "module.function"), queries
+            (kind, calls, rows_written and latency histogram per statement, whitespace
+            collapsed), statements (count per first keyword, including BEGIN and COMMIT),
+            commits, rows_read, rows_written, vm_steps (approximate, in steps of
+            PROGRESS_STEPS), slow_query_count and the latest slow_queries.
+    """
+    return metrics.snapshot()
+
+
+def to_json(recorded=None):
+    """
+    A snapshot as JSON text.
+
+    Args:
+        recorded (dict, optional): A snapshot; defaults to taking one now.
+
+    Returns:
+        str: The snapshot as indented JSON.
+    """
+    return json.dumps(snapshot() if recorded is None else recorded, ensure_ascii=False, indent=2)
+
+
+def to_prometheus(recorded=None):
+    """
+    A snapshot in the Prometheus text exposition format.
+
+    Query latencies are summed up per statement kind (select, insert, ...), since whole
+    statements make poor label values; the JSON snapshot has them per statement.
+
+    Args:
+        recorded (dict, optional): A snapshot; defaults to taking one now.
+
+    Returns:
+        str: The metrics, one sample per line, ending with a newline.
+    """
+    recorded = snapshot() if recorded is None else recorded
+    lines = []
+
+    def family(name, kind, help_text):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    family("habitly_function_calls_total", "counter", "Calls of db and analysis functions.")
+    for label, entry in recorded["functions"].items():
+        lines.append(f'habitly_function_calls_total{{function="{_escape(label)}"}} {entry["calls"]}')
+    family("habitly_function_errors_total", "counter", "Calls of db and analysis functions that raised.")
+    for label, entry in recorded["functions"].items():
+        lines.append(f'habitly_function_errors_total{{function="{_escape(label)}"}} {entry["errors"]}')
+    family("habitly_function_duration_seconds", "histogram", "Latency of db and analysis functions.")
+    for label, entry in recorded["functions"].items():
+        _histogram_lines(lines, "habitly_function_duration_seconds", f'function="{_escape(label)}"', entry["seconds"])
+
+    by_kind = {}
+    for entry in recorded["queries"].values():
+        by_kind.setdefault(entry["kind"].lower(), []).append(entry["seconds"])
+    family("habitly_query_duration_seconds", "histogram", "Latency of SQL statements up to their first row.")
+    for kind, histograms in sorted(by_kind.items()):
+        _histogram_lines(lines, "habitly_query_duration_seconds", f'statement="{_escape(kind)}"', _merge(histograms))
+
+    family("habitly_statements_total", "counter", "SQL statements run by SQLite, by first keyword.")
+    for kind, count in recorded["statements"].items():
+        lines.append(f'habitly_statements_total{{statement="{_escape(kind.lower())}"}} {count}')
+
+    for name, key, help_text in (
+        ("habitly_commits_total", "commits", "Committed transactions."),
+        ("habitly_rows_read_total", "rows_read", "Rows fetched from SQL statements."),
+        ("habitly_rows_written_total", "rows_written", "Rows inserted, updated or deleted."),
+        ("habitly_vm_steps_total", "vm_steps", "SQLite virtual machine instructions, approximately."),
+        ("habitly_slow_queries_total", "slow_query_count", "Statements slower than the slow-query threshold."),
+    ):
+        family(name, "counter", help_text)
+        lines.append(f"{name} {recorded[key]}")
+    return "\n".join(lines) + "\n"
+
+
+def write_snapshot(path, format=None):
+    """
+    Save a snapshot to a file.
+
+    Args:
+        path (str): File to write.
+        format (str, optional): "json" or "prometheus". Defaults to prometheus for .prom and .txt files, otherwise json.
+    """
+    format = format or ("prometheus" if path.endswith((".prom", ".txt")) else "json")
+    if format not in ("json", "prometheus"):
+        raise ValueError(f"Unknown snapshot format '{format}'. Choose json or prometheus.")
+    text = to_prometheus() if format == "prometheus" else to_json() + "\n"
+    with open(path, "w", encoding="utf-8") as fp:
+        fp.write(text)
+
+
+def _histogram_lines(lines, name, labels, histogram):
+    for bound, count in histogram["buckets"]:
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram['sum']}")
+    lines.append(f"{name}_count{{{labels}}} {histogram['count']}")
+
+
+def _merge(histograms):
+    """
+    Sum of histogram snapshots with the same buckets.
+    """
+    buckets = [[bound, sum(h["buckets"][i][1] for h in histograms)] for i, (bound, _) in enumerate(histograms[0]["buckets"])]
+    return {"count": sum(h["count"] for h in histograms), "sum": sum(h["sum"] for h in histograms), "buckets": buckets}
+
+
+def _escape(value):
+    """
+    Escape a Prometheus label value.
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -1,23 +1,49 @@
 import sys
 import time
+import importlib
 from datetime import datetime, date
-import questionary
 
 from db import (
     get_db,
     get_habits_for_user,
     get_habit_data,
+    get_habit_details,
+    get_habit_periods,
+    get_habit_report,
     get_all_users
 )
 
 from habit import Habit
+import cli
 
-from analysis import (
-    calculate_count,
-    calculate_streak_by_period,
-    longest_streak_by_period,
-    count_mood_improvements
-)
+from analysis import summarize_events, completion_rate
+from periods import get_period, is_period
+from profiling import profile_if_enabled
+
+
+# Loading the prompt library only when the interactive menu actually asks something
+# --------------------------------------------
+
+class LazyModule:
+
+    """
+    Stand-in for a module that is imported on first attribute access.
+
+    questionary pulls in prompt_toolkit, which takes longer to import than the rest of Habitly;
+    the non-interactive commands never show a prompt and so never pay for it.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+
+questionary = LazyModule("questionary")
 
 
 # Adding a typewriter effect and greeting the user when the app starts
@@ -117,7 +143,20 @@ def create_new_habit(db):
     
     #Prompting user to insert a description of the new habit 
     description = questionary.text("Write a short description:").ask()
-    period = questionary.select("How often do you want to track this habit?", choices=["daily", "weekly"]).ask()
+    period = questionary.select(
+        "How often do you want to track this habit?",
+        choices=["daily", "weekly", "monthly", "N per week", "every N days"]
+    ).ask()
+    if period in ("N per week", "every N days"):
+        #asking for the N of the custom cadences, e.g. "3 per week" or "every 2 days"
+        #the number is written without leading zeros ("007" -> "7"), which is the only spelling periods accept
+        limit = 7 if period == "N per week" else 999
+        cadence = period
+        number = questionary.text(
+            f"How many? (1-{limit})",
+            validate=lambda text: text.isdigit() and is_period(cadence.replace("N", str(int(text))))
+        ).ask()
+        period = cadence.replace("N", str(int(number)))
 
     #storing user input in database 
     habit = Habit(name, description, period, user_name)
@@ -169,16 +208,10 @@ def increment_existing_habit(db):
     mood_after = questionary.select(f"How did you feel after doing '{chosen}'?", choices=["😄", "😐", "😞"]).ask()
 
     #retrieving metadata from choosen habit 
-    cur = db.cursor()
-    cur.execute(
-        "SELECT description, period FROM habit WHERE name = ? AND user_name = ?",
-        (chosen, user_name)
-    )
-    result = cur.fetchone()
+    details = get_habit_details(db, chosen, user_name)
 
     #incrementing the habit 
-    description, period = result
-    habit = Habit(name=chosen, description=description, period=period, user_name=user_name)
+    habit = Habit(name=chosen, description=details["description"], period=details["period"], user_name=user_name, id=details["id"])
     habit.add_event(db, date=event_date, mood_before=mood_before, mood_after=mood_after)
 
     # reassuring user that input worked 
@@ -190,7 +223,7 @@ def increment_existing_habit(db):
 def show_habit_analytics(db):
     
     """
-    Display analytics for a selected habit: streaks, completion count, mood improvement.
+    Display analytics for a selected habit: streaks, completion count, completion rate, mood improvement.
 
     Args:
         db: SQLite database connection.
@@ -202,56 +235,46 @@ def show_habit_analytics(db):
         choices=all_users
     ).ask()
     
+    #retrieving name and period of the user's habits for summary statement: User X has Y habits 
+    rows = get_habit_periods(db, selected_user)
+
     #Exception handling if user has no habits 
-    habits = get_habits_for_user(db, selected_user)
-    if not habits:
+    if not rows:
         print("\n  ⚠️  No habits found.\n")
         return
 
-    #retrieving name and period of choosen user for summary statement: User X has Y habits 
-    cur = db.cursor()
-    cur.execute("SELECT name, period FROM habit WHERE user_name = ?", (selected_user,))
-    rows = cur.fetchall()
-    if rows:
-        summary = f"{selected_user} has {len(rows)} habit(s): "
-        summary += ", ".join([f"{name} ({period})" for name, period in rows])
-        print(f"\n🗞️  {summary}\n")
+    summary = f"{selected_user} has {len(rows)} habit(s): "
+    summary += ", ".join([f"{name} ({period})" for name, period in rows])
+    print(f"\n🗞️  {summary}\n")
         
     #choosing habit of user to analyse  
-    chosen = questionary.select("Which habit would you like to analyze?", choices=habits).ask()
+    chosen = questionary.select("Which habit would you like to analyze?", choices=[name for name, _ in rows]).ask()
     
-    #retrieving habit data for chosen habit  
-    data = get_habit_data(db, chosen, selected_user)
-
-    #exception handling if no events tracked   
-    if not data:
-        print("\n📬 No events tracked yet.\n")
-        return
-   
-    #retrieving period, description, creation date from choosen habit and selected user   
-    cur.execute(
-        "SELECT period, description, created_at FROM habit WHERE name = ? AND user_name = ?",
-        (chosen, selected_user)
-    )
-    result = cur.fetchone()
+    #retrieving metadata and the ordered events of the choosen habit in one report (two queries)
+    report = get_habit_report(db, chosen, selected_user)
    
-    #exception handling if no events tracked  
-    if not result:
+    #exception handling if the habit can't be found  
+    if not report:
         print("\n⚠️ Could not retrieve habit information.\n")
         return
 
     #unpacking result 
-    period, description, created_at = result
-
-    #all variables for habit analysis summary 
-    dates = [datetime.strptime(row[0], "%Y-%m-%d").date() for row in data if row[0]]
-    moods_before = [row[3] for row in data if len(row) > 3 and row[3]]
-    moods_after = [row[4] for row in data if len(row) > 4 and row[4]]
-    mood_improved = count_mood_improvements(moods_before, moods_after)
-    total = calculate_count(db, chosen, selected_user)
-    current = calculate_streak_by_period(dates, period)
-    longest = longest_streak_by_period(dates, period)
-    unit = "day(s)" if period == "daily" else "week(s)"
+    period, description, created_at, events = report["period"], report["description"], report["created_at"], report["events"]
+
+    #exception handling if no events tracked   
+    if not events:
+        print("\n📬 No events tracked yet.\n")
+        return
+
+    #all variables for habit analysis summary, computed from the events already loaded
+    stats = summarize_events(events, period)
+    mood_improved = stats["mood_improvements"]
+    total = stats["count"]
+    current = stats["current_streak"]
+    longest = stats["longest_streak"]
+    rate = completion_rate((event_date for event_date, _, _ in events), period)
+    spec = get_period(period)
+    unit = spec.unit if spec else "period(s)"
     
     #displaying analytics summary  
     print(f"\n  📈  Analytics for '{chosen}' ({period} habit):\n")
@@ -260,15 +283,14 @@ def show_habit_analytics(db):
     print(f" ✅  Total completions: {total}")
     print(f" 🔥  Current streak: {current} {unit}")
     print(f" 🏆  Longest streak: {longest} {unit}")
+    print(f" 📊  Completion rate: {rate:.0%}")
     print(f" 😄  {mood_improved} time(s) {selected_user}'s mood improved after '{chosen}'\n")
     
     #offering the possibility to see the full log 
     if questionary.confirm("Would you like to see the full log?").ask():
         print(f"\n🗓️  Habit log for '{chosen}':")
-        for row in data:
-            mood_b = row[3] or "—"
-            mood_a = row[4] if len(row) > 4 and row[4] else "—"
-            print(f"  - {row[0]} | Before: {mood_b} | After: {mood_a}")
+        for event_date, mood_b, mood_a in events:
+            print(f"  - {event_date} | Before: {mood_b or '—'} | After: {mood_a or '—'}")
         print()
 
 
@@ -289,15 +311,12 @@ def delete_existing_habit(db):
     chosen = questionary.select("Which habit do you want to delete?", choices=habits).ask()
 
     # Retrieve metadata to fully initialize the Habit object
-    cur = db.cursor()
-    cur.execute("SELECT description, period FROM habit WHERE name = ? AND user_name = ?", (chosen, user_name))
-    result = cur.fetchone()
-    if not result:
+    details = get_habit_details(db, chosen, user_name)
+    if not details:
         print("\n⚠️ Could not find that habit in the database.\n")
         return
 
-    description, period = result
-    habit = Habit(chosen, description, period, user_name)
+    habit = Habit(chosen, details["description"], details["period"], user_name, id=details["id"])
 
     #Prompting user to confirm deletion of habit 
     confirm = questionary.confirm(f"Are you sure you want to delete '{chosen}' and all its data?").ask()
@@ -329,18 +348,15 @@ def delete_specific_event(db):
         return
 
     #retriving metadata for habit/event to delete 
-    cur = db.cursor()
-    cur.execute("SELECT description, period FROM habit WHERE name = ? AND user_name = ?", (chosen, user_name))
-    result = cur.fetchone()
-    if not result:
+    details = get_habit_details(db, chosen, user_name)
+    if not details:
         print("\n⚠️ Could not retrieve habit metadata.\n")
         return
 
-    description, period = result
-    habit = Habit(chosen, description, period, user_name)
+    habit = Habit(chosen, details["description"], details["period"], user_name, id=details["id"])
 
     #letting user choose which event to delete 
-    dates = [row[0] for row in data]
+    dates = [str(row[0]) for row in data]
     date_to_delete = questionary.select("Which event date do you want to delete?", choices=dates).ask()
 
     #asking user for confirmation + letting user know that event deletion actually worked out  
@@ -354,12 +370,24 @@ def delete_specific_event(db):
 # Main application loop for Habitly: Welcomes the user, guides them through the main menu options, and ends with a friendly farewell.
 # --------------------------------------------
 
-def main():
+def main(argv=None):
     
     """
     Launch the Habitly application and display the main menu loop.
+    With command-line arguments (e.g. `python main.py log Yoga --user Selma`) the matching
+    non-interactive command runs instead, without prompts or animations.
+
+    Args:
+        argv (list, optional): Command-line arguments. Defaults to sys.argv[1:].
+
+    Returns:
+        int or None: Exit code of a non-interactive command.
     """
 
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        return cli.run(argv)
+
     db = get_db()
     greet_user()
 
@@ -378,19 +406,25 @@ def main():
         ).ask()
 
         if choice == "➕   Create new habit":
-            create_new_habit(db)
+            action = create_new_habit
         elif choice == "✅   Mark habit as completed":
-            increment_existing_habit(db)
+            action = increment_existing_habit
         elif choice == "📊   View habit analytics":
-            show_habit_analytics(db)
+            action = show_habit_analytics
         elif choice == "🗑️   Delete a habit":
-            delete_existing_habit(db)
+            action = delete_existing_habit
         elif choice == "❌   Delete a specific event":
-            delete_specific_event(db)
+            action = delete_specific_event
         elif choice == "🚪   Exit":
             type_writer("\n  🚪  Goodbye and keep up the good habits!\n")
             break
+        else:
+            continue
+
+        #with HABITLY_PROFILE set, every action is profiled under its name, e.g. show_habit_analytics
+        with profile_if_enabled(action.__name__):
+            action(db)
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
 
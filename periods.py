@@ -0,0 +1,144 @@
+import re
+from datetime import date
+
+
+# Periods: how often a habit is due, as numbered buckets of days and a rule for completing one
+# --------------------------------------------------------------------------------------------
+
+# numpy day numbers count from 1970-01-01, date.toordinal from 0001-01-01
+_EPOCH_ORDINAL = 719163
+
+
+class Period:
+    """
+    A habit's cadence.
+
+    Every day ordinal (date.toordinal) falls into one bucket: the day itself for daily habits,
+    its Monday-to-Sunday week for weekly ones, its calendar month for monthly ones. Buckets are
+    numbered so that consecutive buckets differ by exactly 1, which makes a streak a run of
+    consecutive completed bucket numbers. A bucket is completed by entries on at least
+    `required` different days. The streak calculations in analysis work on any Period.
+    """
+
+    def __init__(self, name, bucket, unit, required=1, grace=True, np_bucket=None):
+        """
+        Args:
+            name (str): The name stored as the habit's period, e.g. "weekly" or "3 per week".
+            bucket (callable): Maps a day ordinal to its bucket number; must not decrease as days increase.
+            unit (str): What one bucket is called in streak lengths, e.g. "week(s)".
+            required (int): Days with an entry needed to complete a bucket.
+            grace (bool): Whether the current streak still counts while the current bucket is
+                incomplete and only the previous one is done. Daily streaks must include today.
+            np_bucket (callable, optional): bucket for a NumPy array of day ordinals, used by the
+                batch analytics. Defaults to calling bucket on every element.
+        """
+        self.name = name
+        self.bucket = bucket
+        self.unit = unit
+        self.required = required
+        self.grace = grace
+        self._np_bucket = np_bucket
+
+    def np_bucket(self, days):
+        """
+        Bucket numbers of a NumPy int64 array of day ordinals.
+        """
+        if self._np_bucket is not None:
+            return self._np_bucket(days)
+        import numpy as np
+        return np.fromiter(map(self.bucket, days.tolist()), dtype=np.int64, count=len(days))
+
+    def __repr__(self):
+        return f"Period({self.name!r})"
+
+
+# Registered periods by name; get_period adds the parameterized ones on first use
+PERIODS = {}
+
+# Parameterized period names: "3 per week" and "every 2 days"
+_PER_WEEK = re.compile(r"^([1-7]) per week$")
+_EVERY_N_DAYS = re.compile(r"^every ([1-9][0-9]{0,2}) days$")
+
+
+def register_period(period):
+    """
+    Make a period available under its name, e.g. for a custom cadence.
+
+    Args:
+        period (Period): The period to register; replaces a registered period of the same name.
+
+    Returns:
+        Period: The registered period.
+    """
+    PERIODS[period.name] = period
+    return period
+
+
+def get_period(name):
+    """
+    Look up a period by the name stored with a habit.
+
+    Besides the registered names ("daily", "weekly", "monthly") this understands
+    "N per week" (N from 1 to 7) and "every N days".
+
+    Args:
+        name (str): Name of the period.
+
+    Returns:
+        Period or None: The period, or None for names that aren't periods.
+    """
+    period = PERIODS.get(name)
+    if period is not None or not isinstance(name, str):
+        return period
+
+    match = _PER_WEEK.match(name)
+    if match:
+        return register_period(Period(name, _week, "week(s)", required=int(match.group(1)), np_bucket=_np_week))
+
+    match = _EVERY_N_DAYS.match(name)
+    if match:
+        length = int(match.group(1))
+        return register_period(Period(
+            name,
+            lambda day: (day - 1) // length,
+            f"{length}-day period(s)",
+            np_bucket=lambda days: (days - 1) // length,
+        ))
+    return None
+
+
+def is_period(name):
+    """
+    Whether name is a period get_period understands.
+    """
+    return get_period(name) is not None
+
+
+def _week(day):
+    """
+    Week number: day ordinal 1 (0001-01-01) is a Monday, so weeks run Monday to Sunday across every year boundary.
+    """
+    return (day - 1) // 7
+
+
+def _np_week(days):
+    return (days - 1) // 7
+
+
+def _month(day):
+    """
+    Month number, year * 12 + month - 1.
+    """
+    calendar_day = date.fromordinal(day)
+    return calendar_day.year * 12 + calendar_day.month - 1
+
+
+def _np_month(days):
+    import numpy as np
+    months = (days - _EPOCH_ORDINAL).astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    return months + 1970 * 12
+
+
+DAILY = register_period(Period("daily", lambda day: day, "day(s)", grace=False, np_bucket=lambda days: days))
+WEEKLY = register_period(Period("weekly", _week, "week(s)", np_bucket=_np_week))
+MONTHLY = register_period(Period("monthly", _month, "month(s)", np_bucket=_np_month))
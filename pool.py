@@ -0,0 +1,203 @@
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from db import get_db, MetadataCache
+
+
+# Connection pool: one database file shared by many threads
+# ---------------------------------------------------------
+
+# Errors SQLite raises when another connection holds the lock longer than the busy timeout
+BUSY_MESSAGES = ("database is locked", "database is busy")
+
+
+class ConnectionPool:
+    """
+    Hand out connections to one database file to many threads.
+
+    All writes go through a single writer connection guarded by a lock, since SQLite only
+    lets one connection write at a time anyway. Reads use up to max_readers read-only
+    connections, so in WAL mode they run in parallel with each other and with the writer.
+    A connection is used by one thread at a time; nested use in the same thread gets the
+    same connection back. Every connection comes from db.get_db, so all db and analysis
+    functions work on them unchanged, and they share one metadata cache, so readers see
+    habits added or deleted through the writer.
+
+    Example:
+        pool = ConnectionPool("main.db")
+        pool.write(increment_habit, "Yoga", "Selma", None, "😐", "😄")
+        with pool.reader() as db:
+            data = get_habit_data(db, "Yoga", "Selma")
+    """
+
+    def __init__(self, name="main.db", max_readers=4, busy_timeout=5.0, retries=3, profile="durable"):
+        """
+        Open the writer connection (creating the schema if needed); readers are opened on demand.
+
+        Args:
+            name (str): Database file name. In-memory databases can't be shared, so they are refused.
+            max_readers (int): Upper bound on open reader connections.
+            busy_timeout (float): Seconds a connection waits for a lock held by another process.
+            retries (int): Extra attempts of write() and read() after a "database is locked" error.
+            profile (str): Tuning profile of the writer, "durable" or "fast". Readers use "readonly".
+        """
+        if name == ":memory:":
+            raise ValueError("An in-memory database can't be shared between connections. Use a file.")
+        if max_readers < 1:
+            raise ValueError("A pool needs at least one reader connection.")
+
+        self.name = name
+        self.max_readers = max_readers
+        self.busy_timeout = busy_timeout
+        self.retries = retries
+        self.metadata_cache = MetadataCache()
+
+        self._writer = get_db(name, profile=profile, check_same_thread=False, timeout=busy_timeout)
+        self._writer.metadata_cache = self.metadata_cache
+        self._writer_lock = threading.RLock()
+
+        self._idle_readers = queue.LifoQueue()  # most recently used first, its pages are likely still cached
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        self._local = threading.local()
+        self._closed = False
+
+    @contextmanager
+    def writer(self):
+        """
+        Use the writer connection exclusively for the duration of the block.
+
+        Yields:
+            sqlite3.Connection: The writer connection.
+        """
+        self._check_open()
+        with self._writer_lock:
+            yield self._writer
+
+    @contextmanager
+    def reader(self, timeout=None):
+        """
+        Use a read-only connection for the duration of the block.
+
+        Args:
+            timeout (float, optional): Seconds to wait when all max_readers connections are in use.
+                Defaults to waiting as long as it takes.
+
+        Yields:
+            sqlite3.Connection: A read-only connection.
+
+        Raises:
+            TimeoutError: No reader became free within the timeout.
+        """
+        self._check_open()
+        held = getattr(self._local, "reader", None)
+        if held is not None:
+            yield held  # nested use in the same thread
+            return
+
+        connection = self._acquire_reader(timeout)
+        self._local.reader = connection
+        try:
+            yield connection
+        finally:
+            self._local.reader = None
+            self._idle_readers.put(connection)
+
+    def write(self, function, *args, **kwargs):
+        """
+        Call function(writer_connection, *args, **kwargs), retrying if the file is locked by another process.
+
+        Returns:
+            The function's return value.
+        """
+        with self.writer() as db:
+            return self._with_retries(db, function, args, kwargs)
+
+    def read(self, function, *args, **kwargs):
+        """
+        Call function(reader_connection, *args, **kwargs), retrying if the file is locked by another process.
+
+        Returns:
+            The function's return value.
+        """
+        with self.reader() as db:
+            return self._with_retries(db, function, args, kwargs)
+
+    def close(self):
+        """
+        Close the writer and every reader. Readers still in use are closed when the pool is, so close it last.
+        """
+        with self._writer_lock, self._readers_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._writer.close()
+            for connection in self._readers:
+                connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def stats(self):
+        """
+        Pool usage for tuning max_readers.
+
+        Returns:
+            dict: "readers" (opened), "idle_readers", "max_readers" and the metadata cache counters.
+        """
+        return {
+            "readers": len(self._readers),
+            "idle_readers": self._idle_readers.qsize(),
+            "max_readers": self.max_readers,
+            **self.metadata_cache.info(),
+        }
+
+    def _acquire_reader(self, timeout):
+        """
+        Take an idle reader, open a new one while below max_readers, or wait for one to be returned.
+        """
+        try:
+            return self._idle_readers.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._readers_lock:
+            if len(self._readers) < self.max_readers:
+                connection = get_db(self.name, profile="readonly", check_same_thread=False, timeout=self.busy_timeout)
+                connection.metadata_cache = self.metadata_cache
+                self._readers.append(connection)
+                return connection
+
+        try:
+            return self._idle_readers.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No reader connection became free within {timeout} seconds.")
+
+    def _with_retries(self, db, function, args, kwargs):
+        """
+        Run function on db, retrying with exponential backoff while SQLite reports the file as locked.
+        """
+        delay = 0.05
+        for attempt in range(self.retries + 1):
+            try:
+                return function(db, *args, **kwargs)
+            except sqlite3.OperationalError as error:
+                if attempt == self.retries or not str(error).startswith(BUSY_MESSAGES):
+                    raise
+                if db.in_transaction:
+                    db.rollback()  # start the retry from a clean state
+                time.sleep(delay)
+                delay *= 2
+
+    def _check_open(self):
+        """
+        Refuse to hand out connections of a closed pool.
+        """
+        if self._closed:
+            raise RuntimeError("The connection pool is closed.")
@@ -0,0 +1,174 @@
+import os
+from contextlib import contextmanager, nullcontext
+
+
+# Profiling: cProfile (and optionally tracemalloc) around a CLI command, menu action or benchmark scenario
+# ------------------------------------------------------------------------------------------------------
+
+# Directory for profiles when no --profile option is given; unset means no profiling
+PROFILE_VARIABLE = "HABITLY_PROFILE"
+
+# Any value but "" or "0" adds an allocation report to every profile
+MEMORY_VARIABLE = "HABITLY_PROFILE_MEMORY"
+
+# Source lines listed in an allocation report
+TOP_ALLOCATIONS = 25
+
+# Frames tracemalloc records per allocation; one is enough for a per-line report
+TRACEBACK_LIMIT = 1
+
+
+def profile_settings(directory=None, memory=False):
+    """
+    Resolve the profiling options of a run, falling back to HABITLY_PROFILE and HABITLY_PROFILE_MEMORY.
+
+    Args:
+        directory (str, optional): Directory given on the command line.
+        memory (bool): Whether an allocation report was asked for on the command line.
+
+    Returns:
+        tuple: (directory or None if profiling is off, whether to trace allocations).
+    """
+    directory = directory or os.environ.get(PROFILE_VARIABLE) or None
+    memory = memory or os.environ.get(MEMORY_VARIABLE, "") not in ("", "0")
+    return directory, memory
+
+
+@contextmanager
+def profiled(name, directory, memory=False, top=TOP_ALLOCATIONS):
+    """
+    Profile a with block into name.pstats in directory, plus name.allocations.txt with memory=True.
+
+    Every run gets files of its own: if name.pstats exists already, -2, -3, ... is added to the
+    name. Name runs after what they measure, e.g. the benchmark scenario ("show_habit_analytics")
+    or the CLI command ("import"), so profiles of different releases can be paired by file name.
+    Load the .pstats file with `python -m pstats` or pstats.Stats.
+
+    Example:
+        with profiled("show_habit_analytics", "profiles", memory=True) as files:
+            show_habit_analytics(db)
+        pstats.Stats(files["pstats"]).sort_stats("cumulative").print_stats(20)
+
+    Args:
+        name (str): Name of what is profiled; used for the file names.
+        directory (str): Directory for the files; created if needed.
+        memory (bool): Also trace allocations with tracemalloc and report the top lines.
+            Tracing makes the code several times slower, which shows in the cProfile timings.
+        top (int): Source lines listed in the allocation report.
+
+    Yields:
+        dict: Paths of the files written when the block ends, "pstats" and "allocations" (None without memory).
+    """
+    # Imported here: tracemalloc takes longer to import than all of Habitly, and profiling is rare
+    import cProfile
+    import tracemalloc
+
+    os.makedirs(directory, exist_ok=True)
+    base = _unused_name(directory, name)
+    files = {"pstats": base + ".pstats", "allocations": base + ".allocations.txt" if memory else None}
+
+    started_tracing = memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(TRACEBACK_LIMIT)
+    if memory:
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield files
+    finally:
+        profiler.disable()
+        if memory:
+            after = tracemalloc.take_snapshot()  # before writing the profile, which allocates too
+            peak = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+        profiler.dump_stats(files["pstats"])
+        if memory:
+            with open(files["allocations"], "w", encoding="utf-8") as fp:
+                fp.write(allocation_report(name, before, after, peak, top))
+
+
+def profile_if_enabled(name, directory=None, memory=False):
+    """
+    profiled(name, ...) if profiling is switched on by the arguments or the environment, otherwise a no-op.
+
+    Args:
+        name (str): Name of what is profiled.
+        directory (str, optional): Directory from a --profile option; HABITLY_PROFILE otherwise.
+        memory (bool): Whether --profile-memory was given; HABITLY_PROFILE_MEMORY otherwise.
+
+    Returns:
+        A context manager yielding the file paths, or None when profiling is off.
+    """
+    directory, memory = profile_settings(directory, memory)
+    if directory is None:
+        return nullcontext()
+    return profiled(name, directory, memory)
+
+
+def allocation_report(name, before, after, peak, top=TOP_ALLOCATIONS):
+    """
+    The source lines that allocated the most memory still held at the end of a run.
+
+    Args:
+        name (str): Name of the run, for the heading.
+        before (tracemalloc.Snapshot): Snapshot taken when the run started.
+        after (tracemalloc.Snapshot): Snapshot taken when it ended.
+        peak (int): Peak traced memory during the run, in bytes.
+        top (int): Number of lines to list.
+
+    Returns:
+        str: The report, one line per source line, largest growth first.
+    """
+    import cProfile
+    import tracemalloc
+
+    ignored = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, cProfile.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ]
+    differences = after.filter_traces(ignored).compare_to(before.filter_traces(ignored), "lineno")
+    grown = [difference for difference in differences if difference.size_diff > 0][:top]
+
+    lines = [
+        f"Allocations of {name}: top {top} source lines by memory allocated and still held at the end",
+        f"Peak traced memory: {_format_size(peak)}, growth over the run: {_format_size(sum(d.size_diff for d in differences))}",
+        "",
+    ]
+    for rank, difference in enumerate(grown, 1):
+        frame = difference.traceback[0]
+        lines.append(
+            f"{rank:>3}. {_format_size(difference.size_diff):>10}  {difference.count_diff:>8} blocks  {frame.filename}:{frame.lineno}"
+        )
+    if not grown:
+        lines.append("No memory was allocated and kept.")
+    return "\n".join(lines) + "\n"
+
+
+def _unused_name(directory, name):
+    """
+    directory/name, or directory/name-2, -3, ... if a profile of that name exists already.
+    """
+    base = os.path.join(directory, name)
+    number = 1
+    while os.path.exists(base + ".pstats"):
+        number += 1
+        base = os.path.join(directory, f"{name}-{number}")
+    return base
+
+
+def _format_size(size):
+    """
+    Bytes as B, or KiB or MiB with one decimal.
+    """
+    if abs(size) < 1024:
+        return f"{size} B"
+    if abs(size) < 1024 * 1024:
+        return f"{size / 1024:.1f} KiB"
+    return f"{size / (1024 * 1024):.1f} MiB"
@@ -0,0 +1,75 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from db import get_db, get_all_users
+from analysis import analyze_all_habits
+
+
+# Parallel reports: analytics for every habit of every user, spread over worker processes
+# ---------------------------------------------------------------------------------------
+
+# Users analyzed by one task; larger chunks mean fewer queries, smaller ones spread the work more evenly
+DEFAULT_CHUNK_SIZE = 25
+
+# The read-only connection of a worker process, opened once by _open_worker_db
+_worker_db = None
+
+
+def run_report(name="main.db", workers=None, chunk_size=DEFAULT_CHUNK_SIZE, use_numpy=None, mp_context=None):
+    """
+    Compute count, streaks and mood improvements for all habits, in parallel over chunks of users.
+
+    The users are split into chunks of chunk_size. Each worker process opens its own
+    read-only connection and runs analysis.analyze_all_habits on one chunk at a time; the
+    results are merged into one list. The numbers are the same as a single analyze_all_habits call.
+
+    Args:
+        name (str): Database file name.
+        workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+            With 1 worker, or a single chunk, everything runs in this process.
+        chunk_size (int): Users per task.
+        use_numpy (bool, optional): Passed to analyze_all_habits.
+        mp_context (optional): multiprocessing context for the workers, e.g. get_context("spawn").
+
+    Returns:
+        list of tuple: One row per habit, columns as in analysis.BATCH_COLUMNS, sorted by user and habit.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1.")
+    workers = workers or os.cpu_count() or 1
+
+    db = get_db(name, profile="readonly")
+    try:
+        users = get_all_users(db)
+        chunks = [users[i:i + chunk_size] for i in range(0, len(users), chunk_size)]
+        if workers == 1 or len(chunks) <= 1:
+            return analyze_all_habits(db, use_numpy=use_numpy)
+    finally:
+        db.close()
+
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(chunks)),
+        mp_context=mp_context,
+        initializer=_open_worker_db,
+        initargs=(name,),
+    ) as pool:
+        results = pool.map(_analyze_chunk, chunks, repeat(use_numpy))
+        rows = [row for chunk in results for row in chunk]
+
+    return sorted(rows, key=lambda row: (row[0], row[1]))
+
+
+def _open_worker_db(name):
+    """
+    Worker initializer: open the process's read-only connection.
+    """
+    global _worker_db
+    _worker_db = get_db(name, profile="readonly")
+
+
+def _analyze_chunk(user_names, use_numpy):
+    """
+    Worker task: analyze the habits of a chunk of users.
+    """
+    return analyze_all_habits(_worker_db, user_names, use_numpy=use_numpy)
@@ -0,0 +1,244 @@
+import glob
+import os
+import sqlite3
+import zlib
+
+from db import get_db, get_all_users, copy_user, delete_user
+
+
+# Sharding: users spread over several database files, so their writes don't share one lock
+# ----------------------------------------------------------------------------------------
+
+# File names inside a shard directory
+DIRECTORY_FILE = "directory.db"
+SHARD_FILE = "shard_{:03}.db"
+
+
+class ShardRouter:
+    """
+    A sharded Habitly database: a directory with one SQLite file per shard.
+
+    Every user lives on exactly one shard, chosen by a hash of the user name unless the
+    directory file records another place for them (see move_user). Each shard is a
+    complete database of its own, so writes for users on different shards never wait for
+    each other. db.get_db returns a router for shard directories; all functions of db and
+    analysis accept it in place of a connection and pass calls about one user on to that
+    user's shard, while get_all_users, analyze_all_habits, export_events and the like ask
+    every shard. The placement of moved users is read when the router is opened, so other
+    open routers don't see a move until they are reopened.
+
+    Example:
+        db = get_db("habits", shards=4)  # creates the directory on first use
+        increment_habit(db, "Yoga", "Selma", None, "😐", "😄")
+        users = get_all_users(db)
+    """
+
+    def __init__(self, path, shards=None, profile="durable", date_storage=None, check_same_thread=True, timeout=5.0):
+        """
+        Open (or create) the shard directory and a connection to every shard.
+
+        Args:
+            path (str): The shard directory.
+            shards (int, optional): Number of shards. Required to create a directory; when opening
+                an existing one it must match the stored number (use rebalance to change it).
+            profile, date_storage, check_same_thread, timeout: Passed to db.get_db for every shard.
+        """
+        if shards is not None and shards < 1:
+            raise ValueError("A sharded database needs at least one shard.")
+
+        readonly = profile == "readonly"
+        directory_file = os.path.join(path, DIRECTORY_FILE)
+        if not os.path.exists(directory_file) and (shards is None or readonly):
+            raise ValueError(f"'{path}' is not a shard directory. Pass shards to create one.")
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        if readonly:
+            self._directory = sqlite3.connect(f"file:{directory_file}?mode=ro", uri=True, check_same_thread=check_same_thread, timeout=timeout)
+        else:
+            self._directory = sqlite3.connect(directory_file, check_same_thread=check_same_thread, timeout=timeout)
+            with self._directory:
+                self._directory.execute("CREATE TABLE IF NOT EXISTS config (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+                self._directory.execute("CREATE TABLE IF NOT EXISTS user_shard (name TEXT PRIMARY KEY, shard INTEGER NOT NULL)")
+                if shards is not None:
+                    self._directory.execute("INSERT OR IGNORE INTO config (key, value) VALUES ('shards', ?)", (shards,))
+
+        stored = self._directory.execute("SELECT value FROM config WHERE key = 'shards'").fetchone()[0]
+        if shards is not None and shards != stored:
+            self._directory.close()
+            raise ValueError(f"'{path}' has {stored} shards, not {shards}. Use shards.rebalance to change the number.")
+
+        self.shards = stored
+        self._open_args = (profile, date_storage, check_same_thread, timeout)
+        self._placement = dict(self._directory.execute("SELECT name, shard FROM user_shard"))
+        self.connections = [get_db(self.shard_path(index), *self._open_args) for index in range(stored)]
+
+    def shard_path(self, index):
+        """
+        File name of shard number index.
+        """
+        return os.path.join(self.path, SHARD_FILE.format(index))
+
+    def shard_index(self, user_name):
+        """
+        Number of the shard that stores a user (also for users that don't exist yet).
+        """
+        if user_name in self._placement:
+            return self._placement[user_name]
+        return _hash_placement(user_name, self.shards)
+
+    def shard_for(self, user_name):
+        """
+        Connection to the shard that stores a user.
+        """
+        return self.connections[self.shard_index(user_name)]
+
+    def commit(self):
+        for connection in self.connections:
+            connection.commit()
+
+    def rollback(self):
+        for connection in self.connections:
+            connection.rollback()
+
+    @property
+    def in_transaction(self):
+        return any(connection.in_transaction for connection in self.connections)
+
+    def execute(self, *args, **kwargs):
+        raise TypeError("A sharded database has no single connection to run SQL on. Use shard_for(user_name) or connections.")
+
+    def close(self):
+        """
+        Close every shard and the directory file.
+        """
+        for connection in self.connections:
+            connection.close()
+        self._directory.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _place(self, user_name, index):
+        """
+        Record that a user is stored on shard index; the hash placement needs no directory entry.
+        """
+        with self._directory:
+            if index == _hash_placement(user_name, self.shards):
+                self._directory.execute("DELETE FROM user_shard WHERE name = ?", (user_name,))
+                self._placement.pop(user_name, None)
+            else:
+                self._directory.execute("INSERT OR REPLACE INTO user_shard (name, shard) VALUES (?, ?)", (user_name, index))
+                self._placement[user_name] = index
+
+
+def _hash_placement(user_name, shards):
+    """
+    Default shard of a user: CRC-32 of the name, which unlike hash() is the same in every process.
+    """
+    return zlib.crc32(user_name.encode("utf-8")) % shards
+
+
+# Helpers for moving users: between shards, into a new number of shards, or out of a single file
+# ----------------------------------------------------------------------------------------------
+
+def move_user(router, user_name, shard):
+    """
+    Move a user with all their habits and events to another shard, e.g. to relieve a busy one.
+
+    The user is copied first and the move recorded in the directory before the old copy is
+    deleted, so the user is never missing.
+
+    Args:
+        router (ShardRouter): The sharded database.
+        user_name (str): Name of the user.
+        shard (int): Number of the shard to move to.
+
+    Returns:
+        bool: False if the user already was on that shard.
+    """
+    if not 0 <= shard < router.shards:
+        raise ValueError(f"There is no shard {shard}; '{router.path}' has {router.shards} shards.")
+    source = router.shard_index(user_name)
+    if source == shard:
+        return False
+
+    copy_user(router.connections[source], router.connections[shard], user_name)
+    router._place(user_name, shard)
+    delete_user(router.connections[source], user_name)
+    return True
+
+
+def rebalance(router, shards):
+    """
+    Change the number of shards, moving every user whose hash placement changes.
+
+    Users moved with move_user go back to their hash placement as well. Shard files that
+    are no longer needed are deleted.
+
+    Args:
+        router (ShardRouter): The sharded database, opened with a writable profile.
+        shards (int): New number of shards.
+
+    Returns:
+        int: Number of users moved.
+    """
+    if shards < 1:
+        raise ValueError("A sharded database needs at least one shard.")
+
+    old_count = router.shards
+    for index in range(old_count, shards):
+        router.connections.append(get_db(router.shard_path(index), *router._open_args))
+
+    moved = 0
+    for index in range(old_count):
+        source = router.connections[index]
+        for user_name in get_all_users(source):
+            target = _hash_placement(user_name, shards)
+            if target != index:
+                copy_user(source, router.connections[target], user_name)
+                delete_user(source, user_name)
+                moved += 1
+
+    with router._directory:
+        router._directory.execute("UPDATE config SET value = ? WHERE key = 'shards'", (shards,))
+        router._directory.execute("DELETE FROM user_shard")
+    router._placement.clear()
+    router.shards = shards
+
+    for index in range(shards, old_count):
+        router.connections[index].close()
+        for file_name in glob.glob(router.shard_path(index) + "*"):  # the database and its -wal and -shm files
+            os.remove(file_name)
+    del router.connections[shards:]
+    return moved
+
+
+def migrate_to_shards(source_name, path, shards, profile="durable"):
+    """
+    Copy a single-file database into a new shard directory. The source file is left as it is.
+
+    Args:
+        source_name (str): The single database file, e.g. "main.db".
+        path (str): The shard directory to create.
+        shards (int): Number of shards.
+        profile (str): Tuning profile for writing the shards.
+
+    Returns:
+        int: Number of users copied.
+    """
+    if os.path.exists(os.path.join(path, DIRECTORY_FILE)):
+        raise ValueError(f"'{path}' already is a shard directory.")
+
+    source = get_db(source_name, profile="readonly")
+    try:
+        with ShardRouter(path, shards, profile) as router:
+            users = get_all_users(source)
+            for user_name in users:
+                copy_user(source, router.shard_for(user_name), user_name)
+        return len(users)
+    finally:
+        source.close()
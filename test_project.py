@@ -2,9 +2,28 @@ import pytest
 import random
 from datetime import date, datetime, timedelta
 from habit import Habit
-from db import create_tables, get_db, add_habit, increment_habit, delete_habit, delete_event, get_all_users, get_habits_for_user, get_habit_data, get_period_for_habit
-from analysis import calculate_count, calculate_streak_by_period, longest_streak_by_period, extract_mood_stats, count_mood_improvements
+from db import create_tables, get_db, add_habit, increment_habit, increment_habits_bulk, delete_habit, delete_event, get_all_users, get_habits_for_user, get_habit_data, get_period_for_habit, get_habit_stats, rebuild_stats, convert_date_storage, get_date_storage, get_habit_id, get_habit_details, get_habit_periods, rename_habit, export_events, import_events, iter_habit_events, to_date, get_habit_report, copy_user, delete_user, clear_metadata_cache, get_metadata_cache, MetadataCache
+from analysis import calculate_count, calculate_streak_by_period, longest_streak_by_period, extract_mood_stats, count_mood_improvements, summarize_habit, to_day_ordinals, analyze_all_habits, BATCH_COLUMNS
 import sqlite3
+import analysis
+import cli
+import main
+from pool import ConnectionPool
+from aiohabitly import AsyncHabitly
+from writequeue import WriteQueue
+from reports import run_report
+from periods import Period, get_period, register_period, PERIODS
+from shards import ShardRouter, move_user, rebalance, migrate_to_shards
+import instrumentation
+import profiling
+import pstats
+import asyncio
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
 
 
 today = date.today()
@@ -216,17 +235,17 @@ def test_increment_habit_adds_event(db):
         mood_before="😐",
         mood_after="😄") # a new habit for Jaakko "Running" 
         data = get_habit_data(db, "Running", "Jaakko")#retrieving all events of Jaakko Running 
-        assert any(row[0] == "2025-03-18" for row in data) #making sure that new date is in Jaakko Running 
+        assert any(row[0] == date(2025, 3, 18) for row in data) #making sure that new date is in Jaakko Running 
 
 def test_delete_event_removes_one_event(db):
     
     test_date = "2025-05-14" # Select a known event date that already exists in habit "Stretching" (Selma) 
     before = get_habit_data(db, "Stretching", "Selma")# Get the habit data for "Stretching" and "Selma" before deletion
-    assert any(event[0] == test_date for event in before) # Ensure the event is in the database before deletion
+    assert any(str(event[0]) == test_date for event in before) # Ensure the event is in the database before deletion
     delete_event(db, "Stretching", "Selma", test_date)# Delete the event using the delete_event function
     after = get_habit_data(db, "Stretching", "Selma") # Get the habit data for "Stretching" and "Selma" after deletion
     assert len(before) - 1 == len(after)# Assert that the event count decreased by 1
-    assert all(event[0] != test_date for event in after) # Assert that the event is no longer in the database
+    assert all(str(event[0]) != test_date for event in after) # Assert that the event is no longer in the database
 
 def test_delete_habit_removes_habit_and_events(db):
     habits_before = get_habits_for_user(db, "Jaakko")#all habits before delition 
@@ -279,25 +298,32 @@ def test_calculate_count(db):
     assert count == 20  # Ensure that the correct number of "Stretching" events is counted
 
 
+def test_calculate_count_counts_in_sql(db):
+    calculate_count(db, "Reading", "Jaakko") # caches the habit id
+    queries = capture_queries(db, lambda: calculate_count(db, "Reading", "Jaakko"))
+    assert len(queries) == 1 and "COUNT(*)" in queries[0] # no event rows are fetched
+    assert calculate_count(db, "Unknown", "Jaakko") == 0
+
+
 def test_calculate_streak_by_period(db):
     
-    reading_dates = [date.fromisoformat(event[0]) for event in get_habit_data(db, "Reading", "Jaakko")]
+    reading_dates = [event[0] for event in get_habit_data(db, "Reading", "Jaakko")]
     streak = calculate_streak_by_period(reading_dates, "daily")
     assert streak == 5 # Making sure that Jaakko's latest streak matches the fixture data 
 
-    journaling_dates = [date.fromisoformat(event[0]) for event in get_habit_data(db, "Journaling", "Selma")]
+    journaling_dates = [event[0] for event in get_habit_data(db, "Journaling", "Selma")]
     streak = calculate_streak_by_period(journaling_dates, "weekly")
     assert streak == 3  # Making sure that Selma's latest streak matches the fixture data 
     
 
 
 def longest_streak_by_period (db):
-    meditation_dates = [date.fromisoformat(event[0]) for event in get_habit_data(db, "Meditation", "Jaakko")] # Retrieve Jaakko's "Meditation" habit data
+    meditation_dates = [event[0] for event in get_habit_data(db, "Meditation", "Jaakko")] # Retrieve Jaakko's "Meditation" habit data
     streak = longest_streak_by_period(meditation_dates, "daily") 
     assert streak == 7 # making sure outcome is in line with fixture data longest streak "Meditation" (7) 
 
 
-    running_dates = [date.fromisoformat(event[0]) for event in get_habit_data(db, "Running", "Jaakko")] # Retrieve Jaakko's "Running" habit data
+    running_dates = [event[0] for event in get_habit_data(db, "Running", "Jaakko")] # Retrieve Jaakko's "Running" habit data
     streak = running_streak_by_period(running_dates, "weekly")
     assert streak == 4 # making sure outcome is in line with fixture data longest streak "Running" (4) 
 
@@ -319,3 +345,1611 @@ def test_count_mood_improvements(db):
     mood_count = count_mood_improvements(moods_before, moodes_after) 
     
     assert mood_count == 4
+
+
+# Testing query plans: the hot queries in db.py must be served by an index
+# -------------------------------
+
+def capture_queries(db, action):
+    """
+    Run an action and collect every SELECT/DELETE statement it sends to SQLite.
+    """
+    statements = []
+    db.set_trace_callback(statements.append)
+    try:
+        action()
+    finally:
+        db.set_trace_callback(None)
+    return [sql for sql in statements if sql.lstrip().upper().startswith(("SELECT", "DELETE", "UPDATE"))]
+
+
+def full_scans(db, sql):
+    """
+    Return the query plan lines of a statement that read a table without an index.
+    """
+    plan = db.execute("EXPLAIN QUERY PLAN " + sql, [None] * sql.count("?")).fetchall()
+    return [row[-1] for row in plan if row[-1].startswith("SCAN") and "INDEX" not in row[-1]]
+
+
+@pytest.mark.parametrize("action", [
+    lambda db: get_habit_data(db, "Reading", "Jaakko"),
+    lambda db: get_habits_for_user(db, "Jaakko"),
+    lambda db: get_period_for_habit(db, "Reading", "Jaakko"),
+    lambda db: get_all_users(db),
+    lambda db: calculate_count(db, "Reading", "Jaakko"),
+    lambda db: increment_habit(db, "Reading", "Jaakko", "2020-01-01", "😐", "😄"), # backdated, so the habit is recounted
+    lambda db: delete_event(db, "Stretching", "Selma", "2025-05-14"),
+    lambda db: delete_habit(db, "Running", "Jaakko"),
+])
+def test_hot_queries_use_indexes(db, action):
+    clear_metadata_cache(db) # the cached lookups must reach SQLite to have their plans checked
+    queries = capture_queries(db, lambda: action(db))
+    assert queries # making sure the action actually reached the database
+    for sql in queries:
+        assert full_scans(db, sql) == [], sql # any plain SCAN means the query walks the whole table
+
+
+def test_indexes_are_added_to_existing_databases(tmp_path):
+    path = str(tmp_path / "old.db")
+    old = sqlite3.connect(path)
+    old.execute("CREATE TABLE habit (name TEXT NOT NULL, description TEXT, period TEXT, created_at TEXT DEFAULT (DATE('now')), user_name TEXT NOT NULL, PRIMARY KEY (name, user_name))")
+    old.execute("CREATE TABLE tracker (date TEXT, habitName TEXT, user_name TEXT, mood_before TEXT, mood_after TEXT)")
+    old.commit()
+    old.close() # simulating a database created before the indexes existed
+
+    db = get_db(path)
+    names = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert "idx_tracker_habit_date" in names
+
+
+# Testing bulk ingest
+# -------------------------------
+
+def test_increment_habits_bulk_inserts_in_chunks(db):
+    events = (
+        (date(2024, 1, 1) + timedelta(days=i), "Meditation", "Jaakko", "😐", "😄")
+        for i in range(250)
+    ) # a generator, so the rows are streamed rather than held in a list
+    inserted, rejected = increment_habits_bulk(db, events, chunk_size=100)
+    assert (inserted, rejected) == (250, 0)
+    assert calculate_count(db, "Meditation", "Jaakko") == 20 + 250
+
+
+def test_increment_habits_bulk_rejects_invalid_rows(db):
+    events = [
+        ("2024-02-01", "Meditation", "Jaakko", "😐", "😄"), # valid
+        ("not a date", "Meditation", "Jaakko", "😐", "😄"), # invalid date
+        ("2024-02-02", "Flying", "Jaakko", "😐", "😄"),     # unknown habit
+        ("2024-02-03", "Meditation"),                       # wrong shape
+    ]
+    assert increment_habits_bulk(db, events) == (1, 3)
+    assert any(row[0] == date(2024, 2, 1) for row in get_habit_data(db, "Meditation", "Jaakko"))
+
+
+def test_increment_habits_bulk_rolls_back_on_error(db):
+    def events():
+        yield ("2024-03-01", "Meditation", "Jaakko", "😐", "😄")
+        raise RuntimeError("export broke off")
+
+    with pytest.raises(RuntimeError):
+        increment_habits_bulk(db, events(), chunk_size=1) # the first row is already written when the error hits
+    assert calculate_count(db, "Meditation", "Jaakko") == 20 # nothing from the failed batch was kept
+
+
+def test_habit_add_events(db):
+    habit = Habit("Running", "Go for a jog", "weekly", "Jaakko")
+    inserted, rejected = habit.add_events(db, [("2024-04-01", "😐", "😄"), ("2024-04-08", "😞", "😐"), ("oops",)])
+    assert (inserted, rejected) == (2, 1)
+    assert calculate_count(db, "Running", "Jaakko") == 6 + 2
+
+
+# Testing connection profiles
+# -------------------------------
+
+def test_get_db_applies_profile(tmp_path):
+    db = get_db(str(tmp_path / "fast.db"), profile="fast")
+    assert db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert db.execute("PRAGMA synchronous").fetchone()[0] == 1 # 1 == NORMAL
+    assert db.execute("PRAGMA temp_store").fetchone()[0] == 2 # 2 == MEMORY
+
+    durable = get_db(str(tmp_path / "durable.db"))
+    assert durable.execute("PRAGMA synchronous").fetchone()[0] == 2 # 2 == FULL is the default
+
+
+def test_get_db_skips_schema_when_current(tmp_path, monkeypatch):
+    path = str(tmp_path / "habits.db")
+    get_db(path).close() # first open creates the schema and stores the version
+
+    statements = []
+    original_connect = sqlite3.connect
+
+    def traced_connect(*args, **kwargs):
+        conn = original_connect(*args, **kwargs)
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    monkeypatch.setattr(sqlite3, "connect", traced_connect)
+    get_db(path)
+    assert not any("CREATE" in sql for sql in statements) # second open runs no DDL
+
+
+def test_readonly_profile_rejects_writes(tmp_path):
+    path = str(tmp_path / "habits.db")
+    writer = get_db(path)
+    add_habit(writer, "Yoga", "Stretch it out", "daily", "Selma")
+    writer.close()
+
+    reader = get_db(path, profile="readonly")
+    assert get_habits_for_user(reader, "Selma") == ["Yoga"]
+    with pytest.raises(sqlite3.OperationalError):
+        increment_habit(reader, "Yoga", "Selma", "2025-01-01", "😐", "😄")
+
+
+def test_get_db_rejects_unknown_profile():
+    with pytest.raises(ValueError):
+        get_db(":memory:", profile="turbo")
+
+
+# Testing the SQL analytics backend against the Python functions
+# -------------------------------
+
+FIXTURE_HABITS = [
+    ("Meditation", "Jaakko"),
+    ("Reading", "Jaakko"),
+    ("Running", "Jaakko"),
+    ("Stretching", "Selma"),
+    ("Journaling", "Selma"),
+]
+
+@pytest.mark.parametrize("habit, user_name", FIXTURE_HABITS)
+def test_summarize_habit_backends_agree_on_fixture(db, habit, user_name):
+    expected = summarize_habit(db, habit, user_name, backend="python")
+    assert summarize_habit(db, habit, user_name, backend="sql") == expected
+    assert summarize_habit(db, habit, user_name, backend="stats") == expected
+
+
+def test_summarize_habit_matches_fixture_numbers(db):
+    reading = summarize_habit(db, "Reading", "Jaakko", backend="sql")
+    assert reading == {"count": 20, "current_streak": 5, "longest_streak": 15, "mood_improvements": 14}
+    journaling = summarize_habit(db, "Journaling", "Selma", backend="sql")
+    assert journaling["current_streak"] == 3 # same as test_calculate_streak_by_period
+
+
+def random_history(rng, period):
+    """
+    Build a random event history around today and across a few year boundaries.
+    """
+    moods = ["😞", "😐", "😄", None]
+    start = today - timedelta(days=rng.randint(0, 5 * 365))
+    events = []
+    day = start
+    while day <= today + timedelta(days=3): # a few entries in the future, like a mistyped date
+        if rng.random() < (0.8 if period == "daily" else 0.25):
+            for _ in range(rng.choice([1, 1, 1, 2])): # occasional duplicate entries on the same day
+                events.append((day, rng.choice(moods), rng.choice(moods)))
+        day += timedelta(days=rng.choice([1, 1, 1, 2, 9]) if rng.random() < 0.3 else 1)
+    return events
+
+
+@pytest.mark.parametrize("seed", range(40))
+@pytest.mark.parametrize("period", ["daily", "weekly"])
+def test_summarize_habit_backends_agree_on_random_histories(seed, period):
+    rng = random.Random(seed)
+    db = get_db(":memory:")
+    add_habit(db, "Habit", "", period, "Tester")
+    Habit("Habit", "", period, "Tester").add_events(db, random_history(rng, period))
+
+    expected = summarize_habit(db, "Habit", "Tester", backend="python")
+    assert summarize_habit(db, "Habit", "Tester", backend="sql") == expected
+    assert summarize_habit(db, "Habit", "Tester", backend="stats") == expected
+
+
+def test_summarize_habit_without_events():
+    db = get_db(":memory:")
+    add_habit(db, "Habit", "", "daily", "Tester")
+    expected = {"count": 0, "current_streak": 0, "longest_streak": 0, "mood_improvements": 0}
+    assert summarize_habit(db, "Habit", "Tester", backend="sql") == expected
+    assert summarize_habit(db, "Habit", "Tester", backend="python") == expected
+    assert summarize_habit(db, "Habit", "Tester", backend="stats") == expected
+
+
+# Testing the ordinal streak engine against straightforward reference implementations
+# -------------------------------
+
+def reference_current_daily(dates):
+    streak, current, done = 0, today, set(dates)
+    while current in done:
+        streak += 1
+        current -= timedelta(days=1)
+    return streak
+
+
+def reference_longest_daily(dates):
+    done, longest = set(dates), 0
+    for start in done:
+        if start - timedelta(days=1) in done:
+            continue # only count runs from their first day
+        length = 1
+        while start + timedelta(days=length) in done:
+            length += 1
+        longest = max(longest, length)
+    return longest
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_daily_streaks_match_reference(seed):
+    rng = random.Random(seed)
+    dates = [date_ for date_, _, _ in random_history(rng, "daily")]
+    rng.shuffle(dates) # the engine must not depend on input order
+    assert calculate_streak_by_period(dates, "daily") == reference_current_daily(dates)
+    assert analysis.longest_streak_by_period(dates, "daily") == reference_longest_daily(dates) # the bare name is shadowed by a helper further up
+
+
+def test_to_day_ordinals_sorts_and_deduplicates():
+    dates = [date(2025, 1, 3), date(2025, 1, 1), date(2025, 1, 3)]
+    assert list(to_day_ordinals(dates)) == [date(2025, 1, 1).toordinal(), date(2025, 1, 3).toordinal()]
+
+
+def test_current_daily_streak_over_long_history():
+    dates = [today - timedelta(days=i) for i in range(20 * 365)] # twenty years without a break
+    assert calculate_streak_by_period(dates, "daily") == 20 * 365
+
+
+def iso_week(day):
+    return day.isocalendar()[:2]
+
+
+def next_iso_week(week):
+    return iso_week(date.fromisocalendar(*week, 1) + timedelta(days=7))
+
+
+def reference_current_weekly(dates):
+    done, week = {iso_week(d) for d in dates}, iso_week(today)
+    if week not in done:
+        week = iso_week(today - timedelta(days=7)) # this week is still open
+    streak = 0
+    while week in done:
+        streak += 1
+        week = iso_week(date.fromisocalendar(*week, 1) - timedelta(days=7))
+    return streak
+
+
+def reference_longest_weekly(dates):
+    done, longest = {iso_week(d) for d in dates}, 0
+    for week in done:
+        length = 1
+        while next_iso_week(week) in done:
+            week = next_iso_week(week)
+            length += 1
+        longest = max(longest, length)
+    return longest
+
+
+def random_weekly_dates(rng):
+    """
+    Weekly-ish dates in a random stretch of 1900-2100, or ending around today.
+    """
+    end = today + timedelta(days=rng.randint(-20, 10)) if rng.random() < 0.5 else date(rng.randint(1900, 2100), 1, 1)
+    day, dates = end - timedelta(days=rng.randint(30, 4 * 365)), []
+    while day <= end:
+        dates.append(day)
+        day += timedelta(days=rng.choice([1, 3, 6, 7, 7, 8, 13, 20]))
+    return dates
+
+
+@pytest.mark.parametrize("seed", range(60))
+def test_weekly_streaks_match_iso_calendar_reference(seed):
+    rng = random.Random(seed)
+    dates = random_weekly_dates(rng)
+    rng.shuffle(dates)
+    assert calculate_streak_by_period(dates, "weekly") == reference_current_weekly(dates)
+    assert analysis.longest_streak_by_period(dates, "weekly") == reference_longest_weekly(dates)
+
+
+def test_weekly_streak_crosses_53_week_years():
+    dates = [date(2020, 12, 21), date(2020, 12, 28), date(2021, 1, 4), date(2021, 1, 11)] # 2020 has an ISO week 53
+    assert analysis.longest_streak_by_period(dates, "weekly") == 4
+
+
+def test_week_ordinals_are_consecutive():
+    days = to_day_ordinals(date(1999, 12, 27) + timedelta(days=7 * i) for i in range(60 * 52))
+    assert list(analysis.to_week_ordinals(days)) == list(range(analysis.week_ordinal(days[0]), analysis.week_ordinal(days[0]) + 60 * 52))
+
+
+@pytest.mark.parametrize("seed", range(15))
+def test_weekly_backends_agree_across_years(seed):
+    rng = random.Random(seed)
+    db = get_db(":memory:")
+    add_habit(db, "Habit", "", "weekly", "Tester")
+    dates = random_weekly_dates(rng)
+    Habit("Habit", "", "weekly", "Tester").add_events(db, [(day, "😐", "😄") for day in dates])
+
+    expected = summarize_habit(db, "Habit", "Tester", backend="python")
+    assert expected["longest_streak"] == reference_longest_weekly(dates)
+    assert summarize_habit(db, "Habit", "Tester", backend="sql") == expected
+    assert summarize_habit(db, "Habit", "Tester", backend="stats") == expected
+    if analysis.HAS_NUMPY:
+        assert batch_as_dict(analyze_all_habits(db, use_numpy=True))[("Tester", "Habit")] == expected
+
+
+# Testing the period registry and the generic streak engine
+# -------------------------------
+
+def reference_buckets(period):
+    """
+    Bucket of a date and the bucket before a bucket, from the calendar, for the reference functions below.
+    """
+    if period == "monthly":
+        return (lambda d: (d.year, d.month)), (lambda b: (b[0] - 1, 12) if b[1] == 1 else (b[0], b[1] - 1))
+    if period.endswith("per week"):
+        return iso_week, (lambda b: iso_week(date.fromisocalendar(*b, 1) - timedelta(days=7)))
+    length = int(period.split()[1])
+    return (lambda d: (d - date(1, 1, 1)).days // length), (lambda b: b - 1)
+
+
+def reference_completed(dates, period):
+    bucket_of, _ = reference_buckets(period)
+    required = int(period[0]) if period.endswith("per week") else 1
+    days_in = {}
+    for d in set(dates):
+        days_in[bucket_of(d)] = days_in.get(bucket_of(d), 0) + 1
+    return {bucket for bucket, days in days_in.items() if days >= required}
+
+
+def reference_current(dates, period):
+    done, (bucket_of, previous) = reference_completed(dates, period), reference_buckets(period)
+    bucket = bucket_of(today)
+    if bucket not in done:
+        bucket = previous(bucket) # the current bucket is still open
+    streak = 0
+    while bucket in done:
+        streak += 1
+        bucket = previous(bucket)
+    return streak
+
+
+def reference_longest(dates, period):
+    done, (_, previous) = reference_completed(dates, period), reference_buckets(period)
+    longest = 0
+    for bucket in done:
+        length = 1
+        while previous(bucket) in done:
+            bucket = previous(bucket)
+            length += 1
+        longest = max(longest, length)
+    return longest
+
+
+def reference_completion_rate(dates, period):
+    done, (bucket_of, previous) = reference_completed(dates, period), reference_buckets(period)
+    first, bucket = bucket_of(min(dates)), bucket_of(today)
+    completed = elapsed = 0
+    if bucket in done:
+        completed = elapsed = 1
+    while bucket != first and bucket > first:
+        bucket = previous(bucket)
+        elapsed += 1
+        completed += bucket in done
+    return completed / elapsed if elapsed else 0.0
+
+
+CADENCES = ["monthly", "3 per week", "1 per week", "every 2 days", "every 10 days"]
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("period", CADENCES)
+def test_cadence_streaks_match_calendar_reference(seed, period):
+    rng = random.Random(seed)
+    start = today - timedelta(days=rng.randint(10, 3 * 365))
+    dates = [start + timedelta(days=i) for i in range((today - start).days + 3) if rng.random() < 0.6]
+    if not dates:
+        return
+    assert calculate_streak_by_period(dates, period) == reference_current(dates, period)
+    assert analysis.longest_streak_by_period(dates, period) == reference_longest(dates, period)
+    assert analysis.completion_rate(dates, period) == pytest.approx(reference_completion_rate(dates, period))
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("period", CADENCES)
+def test_cadence_backends_agree(seed, period):
+    rng = random.Random(seed)
+    db = get_db(":memory:")
+    add_habit(db, "Habit", "", period, "Tester")
+    add_habit(db, "Daily", "", "daily", "Tester")
+    history = random_history(rng, "daily")
+    Habit("Habit", "", period, "Tester").add_events(db, history)
+    Habit("Daily", "", "daily", "Tester").add_events(db, history)
+
+    expected = summarize_habit(db, "Habit", "Tester", backend="python")
+    assert summarize_habit(db, "Habit", "Tester", backend="sql") == expected
+    assert summarize_habit(db, "Habit", "Tester", backend="stats") == expected
+    rows = analyze_all_habits(db, use_numpy=False)
+    assert batch_as_dict(rows)[("Tester", "Habit")] == expected
+    assert rows[1][-1] == analysis.completion_rate([day for day, _, _ in history], period)
+    if analysis.HAS_NUMPY:
+        assert analyze_all_habits(db, use_numpy=True) == rows
+
+
+def test_period_registry():
+    assert get_period("weekly").unit == "week(s)"
+    assert get_period("3 per week").required == 3
+    assert get_period("every 2 days").bucket(3) == 1
+    assert get_period("8 per week") is None and get_period("fortnightly") is None and get_period(None) is None
+    assert get_period("monthly").bucket(date(2025, 1, 1).toordinal()) == get_period("monthly").bucket(date(2024, 12, 31).toordinal()) + 1
+
+
+def test_registered_custom_period():
+    register_period(Period("weekends", lambda day: (day - 1) // 7 if (day - 1) % 7 >= 5 else -1, "weekend(s)"))
+    try:
+        saturday = date(2025, 6, 7)
+        dates = [saturday, saturday + timedelta(days=7), saturday + timedelta(days=14)]
+        assert analysis.longest_streak_by_period(dates, "weekends") == 3
+    finally:
+        del PERIODS["weekends"]
+
+
+def test_unknown_period_has_no_streaks():
+    assert calculate_streak_by_period([today], "hourly") == 0
+    assert analysis.longest_streak_by_period([today], "hourly") == 0
+    assert analysis.completion_rate([today], "hourly") == 0.0
+
+
+def test_cli_accepts_cadences(tmp_path, capsys):
+    path = str(tmp_path / "cli.db")
+    assert run_cli(capsys, "--db", path, "log", "Gym", "--user", "Selma", "--period", "3 per week")[0] == 0
+    assert get_period_for_habit(get_db(path), "Gym", "Selma") == "3 per week"
+    with pytest.raises(SystemExit):
+        cli.run(["--db", path, "log", "Gym", "--user", "Selma", "--period", "hourly"])
+
+
+# Testing batch analytics over all habits
+# -------------------------------
+
+def batch_as_dict(rows):
+    return {(row[0], row[1]): dict(zip(BATCH_COLUMNS[3:-1], row[3:-1])) for row in rows} # without the completion rate, which summarize_habit leaves out
+
+
+def test_analyze_all_habits_matches_summarize_habit(db):
+    add_habit(db, "Painting", "No events yet", "weekly", "Selma") # habits without events must show up too
+    expected = {
+        (user_name, habit): summarize_habit(db, habit, user_name, backend="python")
+        for habit, user_name in FIXTURE_HABITS + [("Painting", "Selma")]
+    }
+    assert batch_as_dict(analyze_all_habits(db, use_numpy=False)) == expected
+    if analysis.HAS_NUMPY:
+        assert batch_as_dict(analyze_all_habits(db, use_numpy=True)) == expected
+
+
+def test_analyze_all_habits_for_one_user(db):
+    rows = analyze_all_habits(db, user_name="Selma")
+    assert [(row[0], row[1]) for row in rows] == [("Selma", "Journaling"), ("Selma", "Stretching")]
+
+
+@pytest.mark.skipif(not analysis.HAS_NUMPY, reason="NumPy is not installed")
+@pytest.mark.parametrize("seed", range(10))
+def test_analyze_all_habits_numpy_matches_python(seed):
+    rng = random.Random(seed)
+    db = get_db(":memory:")
+    for user_name in ("Ada", "Bo", "Cy"):
+        for number in range(4):
+            period = rng.choice(["daily", "weekly"])
+            habit = Habit(f"Habit {number}", "", period, user_name)
+            habit.store(db)
+            habit.add_events(db, random_history(rng, period))
+
+    assert analyze_all_habits(db, use_numpy=True) == analyze_all_habits(db, use_numpy=False)
+
+
+# Testing the incrementally maintained habit_stats table
+# -------------------------------
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("period", ["daily", "weekly"])
+def test_habit_stats_follow_single_increments_and_deletes(seed, period):
+    rng = random.Random(seed)
+    db = get_db(":memory:")
+    add_habit(db, "Habit", "", period, "Tester")
+
+    events = random_history(rng, period)[-150:] # recounts are O(n) each, so keep the history short
+    if rng.random() < 0.5:
+        rng.shuffle(events) # mostly backdated inserts, which must trigger a recount
+    for event_date, mood_before, mood_after in events:
+        increment_habit(db, "Habit", "Tester", event_date, mood_before, mood_after)
+    for event_date, _, _ in rng.sample(events, min(3, len(events))):
+        delete_event(db, "Habit", "Tester", event_date)
+
+    assert summarize_habit(db, "Habit", "Tester", backend="stats") == summarize_habit(db, "Habit", "Tester", backend="python")
+    assert rebuild_stats(db) == 0 # the incremental updates left nothing to correct
+
+
+def test_rebuild_stats_repairs_drift(db):
+    db.execute("UPDATE habit_stats SET total = 999 WHERE habit_id = ?", (get_habit_id(db, "Reading", "Jaakko"),)) # simulate a stale summary row
+    assert rebuild_stats(db) == 1
+    assert get_habit_stats(db, "Reading", "Jaakko")["total"] == 20
+
+
+def test_delete_habit_removes_stats(db):
+    delete_habit(db, "Running", "Jaakko")
+    assert get_habit_stats(db, "Running", "Jaakko") is None
+
+
+def test_stats_are_built_for_databases_from_before_the_table(tmp_path):
+    path = str(tmp_path / "old.db")
+    old = sqlite3.connect(path)
+    old.execute("CREATE TABLE habit (name TEXT NOT NULL, description TEXT, period TEXT, created_at TEXT DEFAULT (DATE('now')), user_name TEXT NOT NULL, PRIMARY KEY (name, user_name))")
+    old.execute("CREATE TABLE tracker (date TEXT, habitName TEXT, user_name TEXT, mood_before TEXT, mood_after TEXT)")
+    old.execute("INSERT INTO habit (name, description, period, user_name) VALUES ('Yoga', '', 'daily', 'Selma')")
+    old.executemany("INSERT INTO tracker VALUES (?, 'Yoga', 'Selma', '😐', '😄')", [("2025-01-01",), ("2025-01-02",)])
+    old.execute("PRAGMA user_version = 1")
+    old.commit()
+    old.close()
+
+    stats = get_habit_stats(get_db(path), "Yoga", "Selma")
+    assert (stats["total"], stats["longest_streak"], stats["mood_improvements"]) == (2, 2, 2)
+
+
+
+@pytest.mark.parametrize("period", ["monthly", "3 per week", "every 2 days"])
+def test_habit_stats_leave_other_periods_to_the_events(period):
+    db = get_db(":memory:")
+    add_habit(db, "Habit", "", period, "Tester")
+    for event_date in ("2025-01-01", "2025-02-01", "2025-03-01"):
+        increment_habit(db, "Habit", "Tester", event_date, None, None)
+
+    stats = get_habit_stats(db, "Habit", "Tester")
+    assert stats["total"] == 3
+    assert stats["run_length"] is None and stats["longest_streak"] is None # not tracked, rather than wrong
+    assert get_habit_report(db, "Habit", "Tester")["stats"]["longest_streak"] is None
+    assert summarize_habit(db, "Habit", "Tester", backend="stats") == summarize_habit(db, "Habit", "Tester", backend="python")
+    assert rebuild_stats(db) == 0
+
+
+def test_schema_4_stats_are_rebuilt(tmp_path):
+    path = str(tmp_path / "v4.db")
+    db = get_db(path)
+    add_habit(db, "Habit", "", "monthly", "Tester")
+    db.execute("DROP TABLE habit_stats")
+    db.execute("CREATE TABLE habit_stats (habit_id INTEGER PRIMARY KEY, total INTEGER NOT NULL DEFAULT 0, last_date TEXT, run_length INTEGER NOT NULL DEFAULT 0, week_run_length INTEGER NOT NULL DEFAULT 0, longest_streak INTEGER NOT NULL DEFAULT 0, mood_improvements INTEGER NOT NULL DEFAULT 0, moods_before INTEGER NOT NULL DEFAULT 0, moods_after INTEGER NOT NULL DEFAULT 0)")
+    db.execute("INSERT INTO habit_stats (habit_id, total, run_length, longest_streak) VALUES (1, 0, 1, 1)")
+    db.execute("PRAGMA user_version = 4")
+    db.commit()
+    db.close()
+
+    db = get_db(path)
+    increment_habit(db, "Habit", "Tester", "2025-01-01", None, None) # the NOT NULL columns are gone
+    assert get_habit_stats(db, "Habit", "Tester")["longest_streak"] is None
+
+# Testing compact date storage (integer day ordinals)
+# -------------------------------
+
+@pytest.fixture
+def ordinal_db(db):
+    """
+    The fixture database converted to store tracker dates as day ordinals.
+    """
+    convert_date_storage(db, "ordinal", vacuum=False)
+    return db
+
+
+def test_convert_date_storage_keeps_events(db):
+    before = get_habit_data(db, "Meditation", "Jaakko")
+    convert_date_storage(db, "ordinal")
+    assert get_date_storage(db) == "ordinal"
+
+    after = get_habit_data(db, "Meditation", "Jaakko")
+    assert all(isinstance(row[0], date) for row in after) # date objects, no strptime needed
+    assert after == before
+
+    convert_date_storage(db, "text")
+    assert get_habit_data(db, "Meditation", "Jaakko") == before # and back again
+
+
+@pytest.mark.parametrize("habit, user_name", FIXTURE_HABITS)
+def test_summarize_habit_with_ordinal_dates(db, ordinal_db, habit, user_name):
+    expected = summarize_habit(ordinal_db, habit, user_name, backend="python")
+    assert summarize_habit(ordinal_db, habit, user_name, backend="sql") == expected
+    assert summarize_habit(ordinal_db, habit, user_name, backend="stats") == expected
+    assert batch_as_dict(analyze_all_habits(ordinal_db, use_numpy=False))[(user_name, habit)] == expected
+
+
+def test_writes_with_ordinal_dates(ordinal_db):
+    increment_habit(ordinal_db, "Running", "Jaakko", "2025-03-18", "😐", "😄")
+    increment_habits_bulk(ordinal_db, [(date(2025, 3, 25), "Running", "Jaakko", "😐", "😄")])
+    delete_event(ordinal_db, "Running", "Jaakko", "2025-06-17")
+
+    dates = [row[0] for row in get_habit_data(ordinal_db, "Running", "Jaakko")]
+    assert date(2025, 3, 18) in dates and date(2025, 3, 25) in dates
+    assert date(2025, 6, 17) not in dates
+    assert rebuild_stats(ordinal_db) == 0
+
+
+def test_get_db_migrates_file_to_ordinal_dates(tmp_path):
+    path = str(tmp_path / "habits.db")
+    db = get_db(path)
+    add_habit(db, "Yoga", "", "daily", "Selma")
+    increment_habit(db, "Yoga", "Selma", "2025-01-01", "😐", "😄")
+    db.close()
+
+    db = get_db(path, date_storage="ordinal")
+    assert db.execute("SELECT date FROM tracker").fetchone()[0] == date(2025, 1, 1).toordinal()
+    assert get_date_storage(get_db(path)) == "ordinal" # the storage choice sticks to the file
+    indexes = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert "idx_tracker_habit_date" in indexes # the rebuilt table gets its index back
+
+
+def interrupt_at(db, statement):
+    # abort the first statement that starts with `statement`, as a crash halfway through would
+    def trace(sql):
+        if sql.lstrip().startswith(statement):
+            db.set_progress_handler(lambda: 1, 1)
+    db.set_trace_callback(trace)
+
+
+def test_interrupted_date_conversion_can_be_retried(tmp_path):
+    path = str(tmp_path / "habits.db")
+    db = get_db(path, date_storage="text")
+    add_habit(db, "Yoga", "Stretch", "daily", "Selma")
+    increment_habit(db, "Yoga", "Selma", "2025-01-01", "😐", "😄")
+    db.close()
+
+    import db as db_module
+    crashing = sqlite3.connect(path, factory=db_module.Connection)
+    interrupt_at(crashing, "INSERT INTO tracker_converted")
+    with pytest.raises(sqlite3.OperationalError, match="interrupted"):
+        convert_date_storage(crashing, "ordinal", vacuum=False)
+    crashing.close()
+
+    db = get_db(path)
+    assert get_date_storage(db) == "text"
+    assert "tracker_converted" not in {row[0] for row in db.execute("SELECT name FROM sqlite_master")}
+    convert_date_storage(db, "ordinal", vacuum=False)
+    assert get_date_storage(db) == "ordinal"
+    assert len(get_habit_data(db, "Yoga", "Selma")) == 1
+
+
+# Testing the user/habit id schema
+# -------------------------------
+
+def test_old_name_keyed_database_is_migrated(tmp_path):
+    path = str(tmp_path / "old.db")
+    old = sqlite3.connect(path)
+    old.execute("CREATE TABLE habit (name TEXT NOT NULL, description TEXT, period TEXT, created_at TEXT DEFAULT (DATE('now')), user_name TEXT NOT NULL, PRIMARY KEY (name, user_name))")
+    old.execute("CREATE TABLE tracker (date TEXT, habitName TEXT, user_name TEXT, mood_before TEXT, mood_after TEXT)")
+    old.executemany("INSERT INTO habit (name, description, period, user_name) VALUES (?, ?, ?, ?)", [
+        ("Yoga", "Stretch", "daily", "Selma"),
+        ("Yoga", "Also stretch", "weekly", "Jaakko"), # same habit name for another user
+    ])
+    old.executemany("INSERT INTO tracker VALUES (?, ?, ?, ?, ?)", [
+        ("2025-01-01", "Yoga", "Selma", "😐", "😄"),
+        ("2025-01-02", "Yoga", "Selma", "😞", "😐"),
+        ("2025-01-01", "Yoga", "Jaakko", "😄", "😄"),
+    ])
+    old.commit()
+    old.close()
+
+    db = get_db(path)
+    assert set(get_all_users(db)) == {"Selma", "Jaakko"}
+    assert get_habit_details(db, "Yoga", "Jaakko")["description"] == "Also stretch"
+    assert [row[0] for row in get_habit_data(db, "Yoga", "Selma")] == [date(2025, 1, 1), date(2025, 1, 2)]
+    assert [row[1] for row in db.execute("PRAGMA table_info(tracker)")] == ["date", "habit_id", "mood_before", "mood_after"]
+    assert get_habit_stats(db, "Yoga", "Selma")["longest_streak"] == 2
+
+
+def test_interrupted_migration_leaves_the_old_layout(tmp_path):
+    path = str(tmp_path / "old.db")
+    old = sqlite3.connect(path)
+    old.execute("CREATE TABLE habit (name TEXT NOT NULL, description TEXT, period TEXT, created_at TEXT DEFAULT (DATE('now')), user_name TEXT NOT NULL, PRIMARY KEY (name, user_name))")
+    old.execute("CREATE TABLE tracker (date TEXT, habitName TEXT, user_name TEXT, mood_before TEXT, mood_after TEXT)")
+    old.execute("INSERT INTO habit (name, description, period, user_name) VALUES ('Yoga', 'Stretch', 'daily', 'Selma')")
+    old.execute("INSERT INTO tracker VALUES ('2025-01-01', 'Yoga', 'Selma', '😐', '😄')")
+    old.commit()
+    old.close()
+
+    import db as db_module
+    crashing = sqlite3.connect(path, factory=db_module.Connection)
+    interrupt_at(crashing, "CREATE TABLE tracker_new")
+    with pytest.raises(sqlite3.OperationalError, match="interrupted"):
+        create_tables(crashing)
+    crashing.close()
+
+    db = get_db(path) # no half-built user table left behind to trip over
+    assert get_all_users(db) == ["Selma"]
+    assert get_habit_stats(db, "Yoga", "Selma")["longest_streak"] == 1
+
+
+def test_store_gives_habit_its_id(db):
+    habit = Habit("Sketching", "Draw for fun", "weekly", "Selma")
+    habit.store(db)
+    assert habit.id == get_habit_id(db, "Sketching", "Selma")
+
+
+def test_rename_habit_keeps_events(db):
+    rename_habit(db, "Reading", "Jaakko", "Reading fiction")
+    assert "Reading fiction" in get_habits_for_user(db, "Jaakko")
+    assert len(get_habit_data(db, "Reading fiction", "Jaakko")) == 20
+
+
+def test_deleting_last_habit_removes_user(db):
+    delete_habit(db, "Stretching", "Selma")
+    assert "Selma" in get_all_users(db) # Journaling is left
+    delete_habit(db, "Journaling", "Selma")
+    assert "Selma" not in get_all_users(db)
+
+
+def test_increment_unknown_habit_is_ignored(db):
+    increment_habit(db, "Flying", "Jaakko", "2025-01-01", "😐", "😄")
+    assert db.execute("SELECT COUNT(*) FROM tracker").fetchone()[0] == 20 + 20 + 6 + 20 + 5
+
+
+# Testing the benchmark suite
+# --------------------------
+
+def test_synthetic_data_is_reproducible(tmp_path):
+    from benchmarks.synthetic import generate
+    first, second = get_db(str(tmp_path / "a.db")), get_db(str(tmp_path / "b.db"))
+    end = date(2025, 6, 30)
+    assert generate(first, 2, 3, 1, seed=7, end=end) == generate(second, 2, 3, 1, seed=7, end=end)
+    query = "SELECT user.name, habit.name, date, mood_before, mood_after FROM tracker JOIN habit ON habit.id = tracker.habit_id JOIN user ON user.id = habit.user_id ORDER BY 1, 2, 3"
+    assert first.execute(query).fetchall() == second.execute(query).fetchall()
+
+
+def test_benchmark_runner_covers_all_scenarios():
+    from benchmarks.run import run, compare, SCENARIOS
+    report = run(["tiny"], repeat=1)
+    assert {row["scenario"] for row in report["results"]} == set(SCENARIOS)
+    assert all(row["min"] <= row["median"] <= row["max"] for row in report["results"])
+    assert all(ratio == 1 for *_, ratio in compare(report, report))
+
+
+def test_benchmark_writes_leave_the_read_data_alone(tmp_path):
+    import asyncio
+    from benchmarks.run import prepare, SCENARIOS
+    context = prepare("tiny", str(tmp_path / "tiny.db"))
+    events = get_habit_data(context["db"], context["daily_habit"], context["user_name"])
+    for name in ["increment_habit", "increment_habit_burst", "aiohabitly_increment_burst", "writequeue_increment_burst", "increment_habits_bulk"]:
+        SCENARIOS[name](context)
+    assert get_habit_data(context["db"], context["daily_habit"], context["user_name"]) == events
+    assert len(get_habit_data(context["write_db"], context["daily_habit"], context["user_name"])) == len(events) + 3 * 200 + 1 + 1000
+    asyncio.run(context["async_habitly"].close())
+    context["write_queue"].close()
+
+
+# Testing the non-interactive command line
+# ---------------------------------------
+
+def run_cli(capsys, *argv):
+    code = cli.run(list(argv))
+    out = capsys.readouterr().out
+    return code, json.loads(out) if "--json" in argv and code == 0 else out
+
+
+def test_cli_log_creates_and_logs(tmp_path, capsys):
+    path = str(tmp_path / "cli.db")
+    code, result = run_cli(capsys, "--db", path, "log", "Yoga", "--user", "Selma", "--period", "daily", "--date", "2025-01-01", "--before", "bad", "--after", "good", "--json")
+    assert code == 0
+    assert result == {"user_name": "Selma", "habit": "Yoga", "date": "2025-01-01", "mood_before": "😞", "mood_after": "😄"}
+    assert [row[0] for row in get_habit_data(get_db(path), "Yoga", "Selma")] == [date(2025, 1, 1)]
+
+
+def test_cli_stats_workers_need_all_users(tmp_path, capsys):
+    assert cli.run(["--db", str(tmp_path / "cli.db"), "stats", "--workers", "2", "--user", "Selma"]) == 1
+    assert "--workers" in capsys.readouterr().err
+
+
+def test_cli_rejects_a_plain_directory(tmp_path, capsys):
+    assert cli.run(["--db", str(tmp_path), "stats"]) == 1
+    assert "is not a shard directory" in capsys.readouterr().err
+
+
+def test_cli_reports_databases_that_cannot_be_opened(tmp_path, capsys):
+    assert cli.run(["--db", str(tmp_path / "missing" / "cli.db"), "stats"]) == 1
+    assert "unable to open database file" in capsys.readouterr().err
+    (tmp_path / "notes.db").write_text("not a database " * 100)
+    assert cli.run(["--db", str(tmp_path / "notes.db"), "stats"]) == 1
+    assert "Can't open the database" in capsys.readouterr().err
+
+
+def test_cli_log_unknown_habit_fails(tmp_path, capsys):
+    assert cli.run(["--db", str(tmp_path / "cli.db"), "log", "Yoga", "--user", "Selma"]) == 1
+    assert "Pass --period" in capsys.readouterr().err
+
+
+def test_cli_stats_matches_summary(tmp_path, capsys):
+    path = str(tmp_path / "cli.db")
+    db = get_db(path)
+    add_habit(db, "Yoga", "Stretch", "daily", "Selma")
+    for day in ("2025-01-01", "2025-01-02", "2025-01-04"):
+        increment_habit(db, "Yoga", "Selma", day, "😐", "😄")
+
+    code, result = run_cli(capsys, "stats", "Yoga", "--user", "Selma", "--db", path, "--json")
+    assert code == 0
+    assert result["description"] == "Stretch"
+    assert {key: result[key] for key in ("count", "current_streak", "longest_streak", "mood_improvements")} == summarize_habit(db, "Yoga", "Selma")
+
+    code, rows = run_cli(capsys, "--json", "--db", path, "stats")
+    assert rows == [dict(zip(BATCH_COLUMNS, row)) for row in analyze_all_habits(db)]
+
+
+def test_cli_import_and_delete(tmp_path, capsys):
+    path = str(tmp_path / "cli.db")
+    add_habit(get_db(path), "Yoga", "Stretch", "daily", "Selma")
+    events = tmp_path / "events.csv"
+    events.write_text("date,habit,user_name,mood_before,mood_after\n2025-01-01,Yoga,Selma,😐,😄\n2025-01-02,Yoga,Selma,,\nnot a date,Yoga,Selma,,\n2025-01-03,Running,Selma,,\n", encoding="utf-8")
+    jsonl = tmp_path / "events.jsonl"
+    jsonl.write_text('{"date": "2025-01-03", "habit": "Yoga", "user_name": "Selma"}\n\n[1, 2]\n', encoding="utf-8")
+
+    code, result = run_cli(capsys, "--db", path, "--json", "import", str(events))
+    assert (code, result["inserted"], result["rejected"]) == (0, 2, 2)
+    code, result = run_cli(capsys, "--db", path, "--json", "import", str(jsonl))
+    assert (code, result["inserted"], result["rejected"], result["rows"]) == (0, 1, 1, 2)
+    assert get_habit_stats(get_db(path), "Yoga", "Selma")["longest_streak"] == 3
+
+    run_cli(capsys, "--db", path, "delete", "Yoga", "--user", "Selma", "--date", "2025-01-02")
+    assert [row[0] for row in get_habit_data(get_db(path), "Yoga", "Selma")] == [date(2025, 1, 1), date(2025, 1, 3)]
+    assert cli.run(["--db", path, "delete", "Yoga", "--user", "Selma", "--date", "2025-01-02"]) == 1
+    assert "no event on 2025-01-02" in capsys.readouterr().err # nothing left to delete
+    run_cli(capsys, "--db", path, "delete", "Yoga", "--user", "Selma")
+    assert get_all_users(get_db(path)) == []
+
+
+# Testing the cold start of a non-interactive command
+# --------------------------------------------------
+
+# Generous budget for importing main, in microseconds; without questionary and NumPy it takes a few dozen ms
+IMPORT_BUDGET_US = 250_000
+
+
+def test_cold_start_skips_heavy_imports(tmp_path):
+    script = f"import main, sys; sys.exit(main.main(['--db', {str(tmp_path / 'cold.db')!r}, 'log', 'Yoga', '--user', 'Selma', '--period', 'daily']))"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    assert result.returncode == 0, result.stderr
+
+    # stderr lines look like "import time:  self [us] | cumulative | imported package"
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "cumulative" not in line:
+            _, total, module = line.split("|")
+            cumulative[module.strip()] = int(total)
+
+    assert not {"questionary", "prompt_toolkit", "numpy"} & set(cumulative)
+    assert cumulative["main"] < IMPORT_BUDGET_US
+
+
+# Testing the metadata cache
+# -------------------------
+
+def test_metadata_is_read_once(db):
+    cache = get_metadata_cache(db)
+    cache.clear()
+    before = cache.info()
+    for _ in range(3):
+        get_all_users(db)
+        get_habits_for_user(db, "Jaakko")
+        get_habit_details(db, "Reading", "Jaakko")
+    info = cache.info()
+    assert info["misses"] - before["misses"] == 3
+    assert info["hits"] - before["hits"] == 6
+    assert not capture_queries(db, lambda: get_period_for_habit(db, "Reading", "Jaakko"))
+
+
+def test_metadata_cache_follows_writes(db):
+    assert "Sketching" not in get_habits_for_user(db, "Nora")
+    assert get_habit_details(db, "Sketching", "Nora") is None
+
+    add_habit(db, "Sketching", "Draw for fun", "weekly", "Nora")
+    assert "Nora" in get_all_users(db)
+    assert get_habits_for_user(db, "Nora") == ["Sketching"]
+    assert get_habit_periods(db, "Nora") == [("Sketching", "weekly")]
+    assert get_period_for_habit(db, "Sketching", "Nora") == "weekly"
+
+    rename_habit(db, "Sketching", "Nora", "Drawing")
+    assert get_habits_for_user(db, "Nora") == ["Drawing"]
+    assert get_habit_details(db, "Sketching", "Nora") is None
+
+    delete_habit(db, "Drawing", "Nora")
+    assert "Nora" not in get_all_users(db)
+    assert get_habit_id(db, "Drawing", "Nora") is None
+
+
+def test_metadata_cache_returns_copies(db):
+    get_habits_for_user(db, "Jaakko").append("Flying")
+    get_habit_details(db, "Reading", "Jaakko")["period"] = "weekly"
+    assert "Flying" not in get_habits_for_user(db, "Jaakko")
+    assert get_habit_details(db, "Reading", "Jaakko")["period"] == "daily"
+
+
+def test_metadata_cache_evicts_least_recently_used():
+    cache = MetadataCache(maxsize=2)
+    cache.get("a", lambda: 1)
+    cache.get("b", lambda: 2)
+    cache.get("a", lambda: 1) # "a" is now the most recently used
+    cache.get("c", lambda: 3) # evicts "b"
+    assert cache.get("b", lambda: "reloaded") == "reloaded"
+    assert cache.info() == {"hits": 1, "misses": 4, "size": 2, "maxsize": 2}
+
+
+def test_plain_connections_are_not_cached():
+    db = sqlite3.connect(":memory:")
+    create_tables(db)
+    add_habit(db, "Yoga", "Stretch", "daily", "Selma")
+    assert get_metadata_cache(db) is None
+    assert get_habits_for_user(db, "Selma") == ["Yoga"]
+    db.execute("UPDATE habit SET name = 'Pilates'")
+    assert get_habits_for_user(db, "Selma") == ["Pilates"]
+
+
+# Testing streaming import and export
+# ----------------------------------
+
+@pytest.mark.parametrize("file_format", ["csv", "jsonl"])
+@pytest.mark.parametrize("date_storage", ["text", "ordinal"])
+def test_export_import_round_trip(db, file_format, date_storage):
+    import io
+    convert_date_storage(db, date_storage, vacuum=False)
+    exported = io.StringIO(newline="")
+    report = export_events(db, exported, file_format)
+    assert report["rows"] == db.execute("SELECT COUNT(*) FROM tracker").fetchone()[0]
+
+    copy = get_db(":memory:")
+    for user_name in get_all_users(db):
+        for name, period in get_habit_periods(db, user_name):
+            add_habit(copy, name, "", period, user_name)
+    exported.seek(0)
+    result = import_events(copy, exported, file_format, chunk_size=7)
+    assert (result["inserted"], result["rejected"]) == (report["rows"], 0)
+
+    for user_name in get_all_users(db):
+        for name in get_habits_for_user(db, user_name):
+            assert [row[:1] + row[3:] for row in get_habit_data(copy, name, user_name)] == [row[:1] + row[3:] for row in get_habit_data(db, name, user_name)]
+            assert get_habit_stats(copy, name, user_name)["longest_streak"] == get_habit_stats(db, name, user_name)["longest_streak"]
+
+
+def test_export_streams_rows_and_reports_progress(db):
+    import io
+    calls = []
+    report = export_events(db, io.StringIO(), "jsonl", user_name="Selma", progress=lambda rows, seconds: calls.append(rows), progress_every=10)
+    assert report["rows"] == 25 # Stretching and Journaling
+    assert calls == [10, 20, 25]
+    assert report["rows_per_second"] > 0
+
+
+def test_import_rejects_unknown_habits_and_bad_rows(db):
+    import io
+    lines = io.StringIO('{"date": "2020-01-01", "habit": "Reading", "user_name": "Jaakko"}\n'
+                        '{"date": "2020-01-02", "habit": "Flying", "user_name": "Jaakko"}\n'
+                        '{"date": "2020-13-01", "habit": "Reading", "user_name": "Jaakko"}\n'
+                        '"just a string"\n')
+    result = import_events(db, lines, "jsonl")
+    assert (result["inserted"], result["rejected"], result["rows"]) == (1, 3, 4)
+    with pytest.raises(ValueError):
+        import_events(db, io.StringIO('{"date": '), "jsonl")
+    with pytest.raises(ValueError):
+        import_events(db, io.StringIO(""), "xml")
+
+
+# Testing streamed habit events
+# ----------------------------
+
+@pytest.mark.parametrize("date_storage", ["text", "ordinal"])
+def test_iter_habit_events_matches_get_habit_data(db, date_storage):
+    convert_date_storage(db, date_storage, vacuum=False)
+    expected = [(to_date(row[0]), row[3], row[4]) for row in get_habit_data(db, "Meditation", "Jaakko")]
+    assert list(iter_habit_events(db, "Meditation", "Jaakko", batch_size=3)) == expected
+    assert list(iter_habit_events(db, "Meditation", "Jaakko", ("mood_after", "date"))) == [(after, day) for day, _, after in expected]
+    assert list(iter_habit_events(db, "Flying", "Jaakko")) == []
+    with pytest.raises(ValueError):
+        list(iter_habit_events(db, "Meditation", "Jaakko", ("habitName",)))
+
+
+def test_iter_habit_events_fetches_in_batches(db):
+    events = iter_habit_events(db, "Meditation", "Jaakko", ("date",), batch_size=4)
+    next(events)
+    queries = capture_queries(db, lambda: [next(events) for _ in range(3)]) # the rest of the first batch
+    assert queries == []
+
+
+def test_analysis_accepts_iterators(db):
+    for name, user_name in [("Meditation", "Jaakko"), ("Running", "Jaakko"), ("Journaling", "Selma")]:
+        period = get_period_for_habit(db, name, user_name)
+        data = get_habit_data(db, name, user_name)
+        dates = [to_date(row[0]) for row in data]
+        stream = lambda: (row[0] for row in iter_habit_events(db, name, user_name, ("date",)))
+        assert calculate_streak_by_period(stream(), period) == calculate_streak_by_period(dates, period)
+        assert analysis.longest_streak_by_period(stream(), period) == analysis.longest_streak_by_period(dates, period)
+        assert extract_mood_stats(iter_habit_events(db, name, user_name), before=1, after=2) == extract_mood_stats(data)
+        assert count_mood_improvements(*extract_mood_stats(iter(data))) == count_mood_improvements(*extract_mood_stats(data))
+    assert analysis.longest_streak_by_period(iter([]), "daily") == 0
+
+
+def test_to_day_ordinals_handles_unsorted_input():
+    days = [date(2025, 1, 3), date(2025, 1, 1), None, date(2025, 1, 3), date(2025, 1, 2)]
+    assert list(to_day_ordinals(iter(days))) == [date(2025, 1, d).toordinal() for d in (1, 2, 3)]
+
+
+# Testing the connection pool
+# --------------------------
+
+def test_pool_serves_many_threads(tmp_path):
+    with ConnectionPool(str(tmp_path / "pool.db"), max_readers=3, profile="fast") as pool:
+        for i in range(6):
+            pool.write(add_habit, f"Habit {i}", "", "daily", "Selma")
+
+        errors = []
+        def log_and_read(i):
+            try:
+                for day in range(30):
+                    pool.write(increment_habit, f"Habit {i}", "Selma", str(date(2025, 1, 1) + timedelta(days=day)), "😐", "😄")
+                    pool.read(get_habit_data, f"Habit {i}", "Selma")
+            except Exception as error: # collected, since pytest doesn't see exceptions in threads
+                errors.append(error)
+
+        threads = [threading.Thread(target=log_and_read, args=(i,)) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        with pool.reader() as db:
+            assert all(get_habit_stats(db, f"Habit {i}", "Selma")["longest_streak"] == 30 for i in range(6))
+        assert pool.stats()["readers"] <= 3
+
+
+def test_pool_readers_see_new_habits(tmp_path):
+    with ConnectionPool(str(tmp_path / "pool.db")) as pool:
+        assert pool.read(get_habits_for_user, "Selma") == []
+        pool.write(add_habit, "Yoga", "", "daily", "Selma")
+        assert pool.read(get_habits_for_user, "Selma") == ["Yoga"] # the cache is shared with the writer
+        with pool.reader() as db:
+            with pytest.raises(sqlite3.OperationalError):
+                add_habit(db, "Running", "", "weekly", "Selma") # readers are read-only
+
+
+def test_pool_is_bounded(tmp_path):
+    with ConnectionPool(str(tmp_path / "pool.db"), max_readers=1) as pool:
+        with pool.reader() as first:
+            with pool.reader() as nested:
+                assert nested is first # the same thread gets its connection back
+            outcome = []
+            def try_reader():
+                try:
+                    with pool.reader(timeout=0.05):
+                        outcome.append("got a reader")
+                except TimeoutError:
+                    outcome.append("timed out")
+            thread = threading.Thread(target=try_reader)
+            thread.start()
+            thread.join()
+            assert outcome == ["timed out"]
+        with pool.reader() as again:
+            assert again is first # returned connections are reused
+
+
+def test_pool_retries_locked_database(tmp_path):
+    calls = []
+    def flaky(db):
+        calls.append(1)
+        if len(calls) < 3:
+            raise sqlite3.OperationalError("database is locked")
+        return "done"
+
+    with ConnectionPool(str(tmp_path / "pool.db"), retries=2) as pool:
+        assert pool.write(flaky) == "done"
+        calls.clear()
+        pool.retries = 1
+        with pytest.raises(sqlite3.OperationalError):
+            pool.write(flaky)
+        assert len(calls) == 2
+
+
+def test_pool_refuses_memory_database():
+    with pytest.raises(ValueError):
+        ConnectionPool(":memory:")
+
+
+# Testing the asyncio API
+# ----------------------
+
+def test_async_api_matches_sync(tmp_path):
+    async def scenario():
+        async with AsyncHabitly(str(tmp_path / "async.db")) as habitly:
+            assert await habitly.add_habit("Yoga", "Stretch", "daily", "Selma") == 1
+            await asyncio.gather(*(
+                habitly.increment_habit("Yoga", "Selma", str(date(2025, 1, 1) + timedelta(days=i)), "😐", "😄")
+                for i in range(50)
+            ))
+            assert await habitly.get_all_users() == ["Selma"]
+            assert await habitly.calculate_count("Yoga", "Selma") == 50
+            await habitly.delete_event("Yoga", "Selma", "2025-01-26")
+            return await habitly.summarize_habit("Yoga", "Selma"), len(await habitly.get_habit_data("Yoga", "Selma"))
+
+    summary, events = asyncio.run(scenario())
+    assert events == 49
+    assert summary == summarize_habit(get_db(str(tmp_path / "async.db")), "Yoga", "Selma", backend="python")
+    assert summary["longest_streak"] == 25
+
+
+def test_async_increments_share_transactions(tmp_path):
+    commits = []
+
+    async def scenario():
+        async with AsyncHabitly(str(tmp_path / "async.db")) as habitly:
+            await habitly.add_habit("Yoga", "Stretch", "daily", "Selma")
+            await habitly.run(lambda db: db.set_trace_callback(lambda sql: sql.startswith("COMMIT") and commits.append(sql)))
+            outcomes = await asyncio.gather(
+                *(habitly.increment_habit("Yoga", "Selma", "2025-01-01") for _ in range(100)),
+                habitly.increment_habit("Yoga", "Selma", "2025-01-01", mood_before=object()), # can't be stored, fails alone
+                return_exceptions=True,
+            )
+            return outcomes
+
+    outcomes = asyncio.run(scenario())
+    assert outcomes[:100] == [None] * 100
+    assert isinstance(outcomes[100], sqlite3.Error)
+    assert 0 < len(commits) < 10 # one commit per batch instead of one per event
+    assert calculate_count(get_db(str(tmp_path / "async.db")), "Yoga", "Selma") == 100
+
+
+
+def test_async_calls_keep_their_order(tmp_path):
+    async def scenario():
+        async with AsyncHabitly(str(tmp_path / "async.db")) as habitly:
+            await habitly.add_habit("Yoga", "Stretch", "daily", "Selma")
+            await asyncio.gather(
+                habitly.increment_habit("Yoga", "Selma", "2024-01-01"),
+                habitly.delete_event("Yoga", "Selma", "2024-01-01"), # runs after the coalesced event
+                habitly.increment_habit("Yoga", "Selma", "2024-01-02"),
+            )
+            return await habitly.get_habit_data("Yoga", "Selma")
+
+    assert [row[0] for row in asyncio.run(scenario())] == [date(2024, 1, 2)]
+
+
+@pytest.mark.parametrize("coalesce", [True, False])
+def test_async_increment_of_unknown_habit_fails(tmp_path, coalesce):
+    async def scenario():
+        async with AsyncHabitly(str(tmp_path / "async.db"), coalesce=coalesce) as habitly:
+            await habitly.add_habit("Yoga", "Stretch", "daily", "Selma")
+            return await asyncio.gather(
+                habitly.increment_habit("Flying", "Selma", "2025-01-01"),
+                habitly.increment_habit("Yoga", "Selma", "2025-01-01"),
+                return_exceptions=True,
+            )
+
+    unknown, known = asyncio.run(scenario())
+    assert isinstance(unknown, ValueError) and "Flying" in str(unknown)
+    assert known is None
+
+# Testing the group-commit write queue
+# -----------------------------------
+
+def test_write_queue_commits_many_threads_together(tmp_path):
+    path = str(tmp_path / "queue.db")
+    with WriteQueue(path, max_delay=0.02) as writes:
+        writes.add_habit("Yoga", "Stretch", "daily", "Selma").result()
+        futures = []
+        def check_in(i):
+            for day in range(10):
+                futures.append(writes.increment_habit("Yoga", "Selma", str(date(2025, 1, 1) + timedelta(days=day)), "😐", "😄"))
+
+        threads = [threading.Thread(target=check_in, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert [future.result(timeout=5) for future in futures] == [None] * 80
+        assert writes.transactions < writes.operations
+
+    db = get_db(path)
+    assert calculate_count(db, "Yoga", "Selma") == 80
+    assert get_habit_stats(db, "Yoga", "Selma")["longest_streak"] == 10
+
+
+def test_write_queue_isolates_failures_and_flushes(tmp_path):
+    path = str(tmp_path / "queue.db")
+    writes = WriteQueue(path, max_delay=0.05, max_batch=10, flush_at_exit=False)
+    first = writes.add_habit("Yoga", "Stretch", "daily", "Selma")
+    broken = writes.increment_habit("Yoga", "Selma", "2025-01-01", mood_before=object()) # can't be stored
+    events = [writes.increment_habit("Yoga", "Selma", f"2025-01-{day:02}") for day in range(1, 25)]
+    writes.delete_event("Yoga", "Selma", "2025-01-24")
+    writes.flush()
+
+    assert first.done() and all(event.done() for event in events)
+    with pytest.raises(sqlite3.Error):
+        broken.result()
+    assert calculate_count(get_db(path), "Yoga", "Selma") == 23 # visible to other connections after flush
+    assert writes.transactions >= 3 # no batch holds more than 10 operations
+
+    pending = writes.increment_habit("Yoga", "Selma", "2025-02-01")
+    writes.close()
+    assert pending.done() # closing writes what is still queued
+    with pytest.raises(RuntimeError):
+        writes.increment_habit("Yoga", "Selma", "2025-02-02")
+
+
+def test_write_queue_fails_events_of_unknown_habits(tmp_path):
+    with WriteQueue(str(tmp_path / "queue.db"), flush_at_exit=False) as writes:
+        writes.add_habit("Yoga", "Stretch", "daily", "Selma")
+        unknown = writes.increment_habit("Flying", "Selma", "2025-01-01")
+        known = writes.increment_habit("Yoga", "Selma", "2025-01-01")
+        with pytest.raises(ValueError, match="Flying"):
+            unknown.result(timeout=5)
+        assert known.result(timeout=5) is None
+
+
+
+def test_group_commit_rollback_forgets_cached_ids():
+    from db import group_commit
+    db = get_db(":memory:")
+    with pytest.raises(RuntimeError):
+        with group_commit(db) as run:
+            run(add_habit, "X", "", "daily", "U")
+            run(increment_habit, "X", "U", "2025-01-01", None, None)
+            raise RuntimeError
+    assert get_habit_id(db, "X", "U") is None
+
+    with group_commit(db) as run:
+        run(add_habit, "Y", "", "daily", "U")
+        with pytest.raises(sqlite3.Error):
+            run(increment_habit, "Y", "U", "2025-01-01", object(), None) # undone on its own
+    assert get_habit_id(db, "Y", "U") is not None
+    assert db.execute("SELECT COUNT(*) FROM tracker").fetchone()[0] == 0
+
+# Testing the parallel report runner
+# ---------------------------------
+
+@pytest.fixture
+def report_db(tmp_path):
+    from benchmarks.synthetic import generate
+    path = str(tmp_path / "report.db")
+    db = get_db(path)
+    generate(db, 5, 3, 1, seed=3)
+    db.close()
+    return path
+
+
+@pytest.mark.parametrize("workers, chunk_size", [(1, 2), (2, 2), (3, 1)])
+def test_run_report_matches_batch_analytics(report_db, workers, chunk_size):
+    expected = analyze_all_habits(get_db(report_db, profile="readonly"), use_numpy=False)
+    assert run_report(report_db, workers=workers, chunk_size=chunk_size, use_numpy=False) == expected
+
+
+def test_cli_stats_with_workers(report_db, capsys):
+    code, rows = run_cli(capsys, "--db", report_db, "--json", "stats", "--workers", "2")
+    assert code == 0
+    assert rows == [dict(zip(BATCH_COLUMNS, row)) for row in analyze_all_habits(get_db(report_db))]
+
+
+# Testing per-user sharding
+# -------------------------
+
+def test_sharded_database_matches_single_file(tmp_path):
+    single = get_db(str(tmp_path / "single.db"))
+    router = get_db(str(tmp_path / "shards"), shards=3)
+    assert isinstance(router, ShardRouter)
+
+    users = [f"user{n}" for n in range(8)]
+    for target in (single, router):
+        for user in users:
+            add_habit(target, "Yoga", "Stretch", "daily", user)
+            for day in range(5):
+                increment_habit(target, "Yoga", user, str(today - timedelta(days=day)), "😐", "😄")
+
+    assert get_all_users(router) == get_all_users(single) == sorted(users)
+    for user in users:
+        assert user in get_all_users(router.shard_for(user))
+        assert get_habit_data(router, "Yoga", user) == get_habit_data(single, "Yoga", user)
+        assert summarize_habit(router, "Yoga", user) == summarize_habit(single, "Yoga", user)
+    assert sum(len(get_all_users(shard)) for shard in router.connections) == len(users)
+    assert analyze_all_habits(router) == analyze_all_habits(single)
+    assert analyze_all_habits(router, users[:3]) == analyze_all_habits(single, users[:3])
+    assert rebuild_stats(router) == 0
+
+    delete_habit(router, "Yoga", "user0")
+    assert "user0" not in get_all_users(router)
+
+
+def test_sharded_database_is_reopened_with_its_shard_count(tmp_path):
+    path = str(tmp_path / "shards")
+    get_db(path, shards=2).close()
+
+    router = get_db(path)
+    assert router.shards == 2
+    assert sorted(name for name in os.listdir(path) if name.endswith(".db")) == ["directory.db", "shard_000.db", "shard_001.db"]
+    with pytest.raises(TypeError):
+        router.execute("SELECT 1")
+    router.close()
+
+    with pytest.raises(ValueError):
+        get_db(path, shards=3)
+    with pytest.raises(ValueError):
+        ShardRouter(str(tmp_path / "missing"))
+
+
+def test_migrate_to_shards_and_import(report_db, tmp_path):
+    single = get_db(report_db, profile="readonly")
+    path = str(tmp_path / "shards")
+    assert migrate_to_shards(report_db, path, 3) == len(get_all_users(single))
+
+    router = get_db(path)
+    assert analyze_all_habits(router, use_numpy=False) == analyze_all_habits(single, use_numpy=False)
+    assert run_report(path, workers=2, chunk_size=2, use_numpy=False) == analyze_all_habits(single, use_numpy=False)
+
+    exported, expected = io.StringIO(), io.StringIO()
+    export_events(router, exported)
+    export_events(single, expected)
+    assert sorted(exported.getvalue().splitlines()) == sorted(expected.getvalue().splitlines())
+
+    # Importing the export again doubles every habit's count, on every shard
+    exported.seek(0)
+    result = import_events(router, exported)
+    assert result["inserted"] == len(expected.getvalue().splitlines()) - 1
+    for user, habit, _, count, *_ in analyze_all_habits(single, use_numpy=False):
+        assert calculate_count(router, habit, user) == 2 * count
+
+
+def test_move_user_and_rebalance(report_db, tmp_path):
+    single = get_db(report_db, profile="readonly")
+    expected = analyze_all_habits(single, use_numpy=False)
+    path = str(tmp_path / "shards")
+    migrate_to_shards(report_db, path, 2)
+
+    router = get_db(path)
+    user = get_all_users(router)[0]
+    source = router.shard_index(user)
+    assert move_user(router, user, 1 - source)
+    assert not move_user(router, user, 1 - source)
+    assert user not in get_all_users(router.connections[source])
+    router.close()
+
+    router = get_db(path)  # the move is recorded in the directory
+    assert router.shard_index(user) == 1 - source
+    assert analyze_all_habits(router, use_numpy=False) == expected
+
+    rebalance(router, 4)
+    assert router.shards == 4
+    assert analyze_all_habits(router, use_numpy=False) == expected
+    rebalance(router, 1)
+    router.close()
+    assert [name for name in os.listdir(path) if name.startswith("shard_") and name.endswith(".db")] == ["shard_000.db"]
+    assert analyze_all_habits(get_db(path), use_numpy=False) == expected
+
+
+def test_copy_user_replaces_target_copy(db, tmp_path):
+    target = get_db(str(tmp_path / "target.db"), date_storage="ordinal")
+    add_habit(target, "Old habit", "", "daily", "Selma")
+    assert copy_user(db, target, "Selma") == 2
+    assert get_habits_for_user(target, "Selma") == get_habits_for_user(db, "Selma")
+    assert list(iter_habit_events(target, "Stretching", "Selma")) == list(iter_habit_events(db, "Stretching", "Selma"))
+    copied, original = get_habit_details(target, "Journaling", "Selma"), get_habit_details(db, "Journaling", "Selma")
+    assert {**copied, "id": None} == {**original, "id": None}  # ids are the target's own
+    assert {**get_habit_stats(target, "Stretching", "Selma"), "habit_id": None} == {**get_habit_stats(db, "Stretching", "Selma"), "habit_id": None}
+
+    delete_user(target, "Selma")
+    assert get_all_users(target) == []
+
+
+def test_cli_shard_and_rebalance(report_db, tmp_path, capsys):
+    path = str(tmp_path / "shards")
+    code, result = run_cli(capsys, "--db", report_db, "--json", "shard", path, "--shards", "2")
+    assert code == 0
+    assert result == {"users": 5, "shards": 2, "directory": path}
+
+    code, result = run_cli(capsys, "--db", path, "--json", "rebalance", "--shards", "3")
+    assert code == 0
+    assert result["shards"] == 3
+
+    code, rows = run_cli(capsys, "--db", path, "--json", "stats")
+    assert rows == [dict(zip(BATCH_COLUMNS, row)) for row in analyze_all_habits(get_db(report_db))]
+
+    assert run_cli(capsys, "--db", report_db, "rebalance", "--shards", "2")[0] == 1
+
+
+# Testing the habit report behind the analytics view
+# -------------------------------------------------
+
+def test_habit_report_matches_separate_lookups(db):
+    report = get_habit_report(db, "Journaling", "Selma")
+    events = report.pop("events")
+    stats = report.pop("stats")
+    assert report == get_habit_details(db, "Journaling", "Selma")
+    assert stats == get_habit_stats(db, "Journaling", "Selma")
+    assert events == list(iter_habit_events(db, "Journaling", "Selma"))
+    assert analysis.summarize_events(events, "weekly") == summarize_habit(db, "Journaling", "Selma", backend="python")
+
+
+def test_habit_report_takes_two_queries(db):
+    clear_metadata_cache(db)
+    assert len(capture_queries(db, lambda: get_habit_report(db, "Reading", "Jaakko"))) == 2
+    assert len(capture_queries(db, lambda: get_habit_report(db, "Reading", "Jaakko", events=False))) == 1
+    assert get_habit_report(db, "Reading", "Jaakko", events=False)["events"] is None
+    assert get_habit_report(db, "Unknown", "Jaakko") is None
+
+
+class FakePrompts:
+    """
+    Stands in for questionary in main: every prompt answers with the next scripted value.
+    """
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+
+    def _prompt(self, *args, **kwargs):
+        answer = self.answers.pop(0)
+        return type("Prompt", (), {"ask": lambda _: answer})()
+
+    select = confirm = text = _prompt
+
+
+def test_show_habit_analytics_uses_the_report(db, monkeypatch, capsys):
+    monkeypatch.setattr(main, "questionary", FakePrompts("Selma", "Journaling", True))
+    clear_metadata_cache(db)
+    queries = capture_queries(db, lambda: main.show_habit_analytics(db))
+    assert len(queries) == 4 # users, the user's habits, and the report's two queries
+
+    out = capsys.readouterr().out
+    assert "Current streak: 3 week(s)" in out
+    assert "Total completions: 5" in out
+    assert out.count("Before:") == 5 # the full log comes from the report's events
+
+
+def test_create_new_habit_normalises_the_number(db, monkeypatch):
+    monkeypatch.setattr(main, "questionary", FakePrompts("Selma", "Swimming", "", "N per week", "03"))
+    monkeypatch.setattr(main, "type_writer", lambda text: None)
+    main.create_new_habit(db)
+    assert get_period_for_habit(db, "Swimming", "Selma") == "3 per week"
+
+
+# Testing the opt-in instrumentation
+# ----------------------------------
+
+@pytest.fixture
+def recording():
+    instrumentation.reset()
+    instrumentation.enable()
+    try:
+        yield instrumentation.metrics
+    finally:
+        instrumentation.disable()
+        instrumentation.reset()
+
+
+def test_instrumentation_is_off_by_default():
+    assert not instrumentation.is_enabled()
+    assert "instrumentation" not in increment_habit.__code__.co_filename # the plain functions, no wrappers
+    import db as db_module
+    assert type(get_db(":memory:")) is db_module.Connection
+
+
+def test_instrumentation_counts_calls_rows_and_commits(recording):
+    db = get_db(":memory:")
+    assert isinstance(db, instrumentation.InstrumentedConnection)
+    add_habit(db, "Yoga", "", "daily", "Selma")
+    increment_habit(db, "Yoga", "Selma", "2024-01-01", None, None)
+    increment_habit(db, "Yoga", "Selma", "2024-01-02", None, None)
+    assert len(list(iter_habit_events(db, "Yoga", "Selma"))) == 2
+    summarize_habit(db, "Yoga", "Selma", backend="python")
+
+    snapshot = instrumentation.snapshot()
+    functions = snapshot["functions"]
+    assert functions["db.increment_habit"]["calls"] == 2
+    assert functions["db.iter_habit_events"]["calls"] == 2 # once more by summarize_habit; generators count when done
+    assert functions["analysis.summarize_habit"]["seconds"]["count"] == 1
+    assert snapshot["commits"] >= 3
+    assert snapshot["rows_written"] >= 4 # user, habit and two events
+    assert snapshot["rows_read"] >= 2
+    inserts = snapshot["queries"]["INSERT INTO tracker (date, habit_id, mood_before, mood_after) VALUES (?, ?, ?, ?)"]
+    assert inserts["calls"] == 2 and inserts["rows_written"] == 2
+    json.loads(instrumentation.to_json(snapshot))
+
+
+def test_instrumentation_disable_restores_everything(recording, db):
+    instrumentation.instrument(db)
+    assert "instrumentation" in get_habit_data.__code__.co_filename
+    get_habit_data(db, "Reading", "Jaakko")
+    instrumentation.disable()
+
+    import db as db_module
+    assert get_habit_data is db_module.get_habit_data
+    assert "instrumentation" not in get_habit_data.__code__.co_filename
+    assert analysis.iter_habit_events is db_module.iter_habit_events
+    assert type(db) is db_module.Connection
+    calls = instrumentation.snapshot()["functions"]["db.get_habit_data"]["calls"]
+    get_habit_data(db, "Reading", "Jaakko")
+    assert instrumentation.snapshot()["functions"]["db.get_habit_data"]["calls"] == calls == 1
+
+
+def test_instrumentation_logs_slow_queries(recording, db, caplog):
+    instrumentation.enable(slow_query_seconds=0) # every statement is slow
+    instrumentation.instrument(db)
+    with caplog.at_level("WARNING", logger="habitly.slow_queries"):
+        get_habit_data(db, "Reading", "Jaakko")
+    snapshot = instrumentation.snapshot()
+    assert snapshot["slow_query_count"] == len(snapshot["slow_queries"]) > 0
+    assert any("FROM tracker" in query["sql"] for query in snapshot["slow_queries"])
+    assert any("Slow query" in record.getMessage() for record in caplog.records)
+
+
+def test_instrumentation_counts_errors(recording):
+    with pytest.raises(ValueError):
+        get_db(":memory:", profile="unknown")
+    assert instrumentation.snapshot()["functions"]["db.get_db"]["errors"] == 1
+
+
+def test_instrumentation_prometheus_text(recording, db):
+    instrumentation.instrument(db)
+    analyze_all_habits(db)
+    text = instrumentation.to_prometheus()
+    samples = dict(line.rsplit(" ", 1) for line in text.splitlines() if not line.startswith("#"))
+    assert samples['habitly_function_calls_total{function="analysis.analyze_all_habits"}'] == "1"
+    buckets = [int(value) for name, value in samples.items() if name.startswith('habitly_query_duration_seconds_bucket{statement="select"')]
+    assert buckets == sorted(buckets) # cumulative
+    assert buckets[-1] == int(samples['habitly_query_duration_seconds_count{statement="select"}'])
+    assert "# TYPE habitly_commits_total counter" in text
+
+
+def test_cli_writes_metrics(tmp_path, capsys):
+    path = str(tmp_path / "cli.db")
+    assert cli.run(["--db", path, "log", "Yoga", "--user", "Selma", "--period", "daily", "--metrics", str(tmp_path / "log.json")]) == 0
+    assert cli.run(["--db", path, "stats", "--metrics", str(tmp_path / "stats.prom")]) == 0
+    assert not instrumentation.is_enabled()
+
+    recorded = json.loads((tmp_path / "log.json").read_text())
+    assert recorded["functions"]["db.increment_habit"]["calls"] == 1
+    assert recorded["commits"] >= 1
+    assert 'habitly_function_calls_total{function="analysis.analyze_all_habits"} 1' in (tmp_path / "stats.prom").read_text()
+
+
+# Testing the profiling switch
+# ----------------------------
+
+def test_profiled_writes_stats_and_allocations(tmp_path, db):
+    with profiling.profiled("show_habit_analytics", str(tmp_path), memory=True) as files:
+        blocks = [bytearray(1024) for _ in range(100)] # kept until the end, so they show in the report
+        get_habit_report(db, "Reading", "Jaakko")
+
+    stats = pstats.Stats(files["pstats"])
+    assert any(function == "get_habit_report" for _, _, function in stats.stats)
+    report = open(files["allocations"], encoding="utf-8").read()
+    assert report.startswith("Allocations of show_habit_analytics")
+    assert "test_project.py" in report
+
+    with profiling.profiled("show_habit_analytics", str(tmp_path)) as second:
+        pass
+    assert second["pstats"].endswith("show_habit_analytics-2.pstats") # every run gets its own files
+    assert second["allocations"] is None
+    del blocks
+
+
+def test_profile_settings_from_environment(monkeypatch):
+    monkeypatch.delenv(profiling.PROFILE_VARIABLE, raising=False)
+    monkeypatch.delenv(profiling.MEMORY_VARIABLE, raising=False)
+    assert profiling.profile_settings() == (None, False)
+    assert profiling.profile_if_enabled("log").__enter__() is None
+
+    monkeypatch.setenv(profiling.PROFILE_VARIABLE, "profiles")
+    monkeypatch.setenv(profiling.MEMORY_VARIABLE, "0")
+    assert profiling.profile_settings() == ("profiles", False)
+    assert profiling.profile_settings("other", memory=True) == ("other", True)
+    monkeypatch.setenv(profiling.MEMORY_VARIABLE, "1")
+    assert profiling.profile_settings() == ("profiles", True)
+
+
+def test_cli_profiles_commands(tmp_path, capsys, monkeypatch):
+    path = str(tmp_path / "cli.db")
+    assert cli.run(["--db", path, "log", "Yoga", "--user", "Selma", "--period", "daily", "--profile", str(tmp_path / "profiles")]) == 0
+    monkeypatch.setenv(profiling.PROFILE_VARIABLE, str(tmp_path / "profiles"))
+    assert cli.run(["--db", path, "stats", "--profile-memory"]) == 0
+
+    assert sorted(os.listdir(tmp_path / "profiles")) == ["log.pstats", "stats.allocations.txt", "stats.pstats"]
+    stats = pstats.Stats(str(tmp_path / "profiles" / "stats.pstats"))
+    assert any(function == "analyze_all_habits" for _, _, function in stats.stats)
+
+
+def test_benchmark_scenarios_can_be_profiled(tmp_path):
+    from benchmarks.run import run
+    run(["tiny"], ["show_habit_analytics", "iter_habit_events"], repeat=1, profile=str(tmp_path))
+    assert sorted(os.listdir(tmp_path / "tiny")) == ["iter_habit_events.pstats", "show_habit_analytics.pstats"]
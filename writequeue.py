@@ -0,0 +1,209 @@
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import db
+
+
+# Group commit: writes from many threads collected and committed together
+# ------------------------------------------------------------------------
+
+class WriteQueue:
+    """
+    A write-behind queue that commits the writes of many callers in shared transactions.
+
+    Operations are handed to a background thread that owns its own connection. It collects
+    them for up to max_delay seconds or max_batch operations, whichever comes first, and
+    writes the batch with db.group_commit: one transaction and one fsync for the whole batch
+    instead of one per call. Each caller gets a concurrent.futures.Future that is resolved
+    once the transaction holding its write is committed, or fails with the exception its
+    operation raised (without affecting the rest of the batch).
+
+    Example:
+        with WriteQueue("main.db") as writes:
+            done = writes.increment_habit("Yoga", "Selma", None, "😐", "😄")
+            done.result()  # blocks until the event is durable
+    """
+
+    def __init__(self, name="main.db", profile="durable", max_delay=0.005, max_batch=500, flush_at_exit=True):
+        """
+        Start the writer thread.
+
+        Args:
+            name (str): Database file name. In-memory databases can't be shared with the writer thread.
+            profile (str): Tuning profile of the writer connection.
+            max_delay (float): Seconds to wait for more operations after the first one of a batch.
+            max_batch (int): Most operations written by one transaction.
+            flush_at_exit (bool): Write everything still queued when the interpreter exits.
+        """
+        if name == ":memory:":
+            raise ValueError("An in-memory database can't be shared with the writer thread. Use a file.")
+
+        self.name = name
+        self.profile = profile
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.operations = 0
+        self.transactions = 0
+
+        self._queue = queue.Queue()
+        self._closed = False
+        self._close_lock = threading.Lock()
+        self._ready = Future()  # resolved once the writer thread has opened its connection
+        self._thread = threading.Thread(target=self._run, name="habitly-writes", daemon=True)
+        self._thread.start()
+        self._ready.result()  # raises here if the database can't be opened
+
+        self._flush_at_exit = flush_at_exit
+        if flush_at_exit:
+            atexit.register(self.close)
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Queue a call of function(connection, *args, **kwargs) for the next transaction.
+
+        Returns:
+            Future: Resolves to the function's return value once the transaction is committed.
+        """
+        if self._closed:
+            raise RuntimeError("The write queue is closed.")
+        future = Future()
+        self._queue.put((function, args, kwargs, future))
+        return future
+
+    def increment_habit(self, name, user_name, event_date=None, mood_before=None, mood_after=None):
+        """
+        Queued db.increment_habit.
+
+        Returns:
+            Future: Resolves to None once the event is committed, or fails with ValueError if
+                there is no such habit.
+        """
+        return self.submit(_increment_habit, name, user_name, event_date, mood_before, mood_after)
+
+    def delete_event(self, name, user_name, date):
+        """
+        Queued db.delete_event.
+
+        Returns:
+            Future: Resolves to the number of deleted events once the deletion is committed.
+        """
+        return self.submit(db.delete_event, name, user_name, date)
+
+    def add_habit(self, name, description, period, user_name):
+        """
+        Queued db.add_habit.
+
+        Returns:
+            Future: Resolves to the new habit's id (None if the name was taken) once it is committed.
+        """
+        return self.submit(db.add_habit, name, description, period, user_name)
+
+    def flush(self, timeout=None):
+        """
+        Block until every operation queued so far is committed.
+
+        Args:
+            timeout (float, optional): Seconds to wait at most.
+        """
+        self.submit(lambda connection: None).result(timeout)
+
+    def close(self):
+        """
+        Commit what is still queued, then stop the writer thread and close its connection.
+        """
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(None)  # the writer thread stops once it reaches this marker
+        self._thread.join()
+        if self._flush_at_exit:
+            atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Writer thread
+    # -------------
+
+    def _run(self):
+        """
+        Writer thread: collect batches from the queue and write each in one transaction.
+        """
+        try:
+            connection = db.get_db(self.name, profile=self.profile)
+        except Exception as error:
+            self._ready.set_exception(error)
+            return
+        self._ready.set_result(None)
+
+        running = True
+        while running:
+            batch, running = self._collect()
+            if batch:
+                self._write(connection, batch)
+        connection.close()
+
+    def _collect(self):
+        """
+        Take the next batch: wait for one operation, then up to max_delay for more.
+
+        Returns:
+            tuple: (operations, whether to keep running).
+        """
+        first = self._queue.get()
+        if first is None:
+            return [], False
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                operation = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if operation is None:
+                return batch, False
+            batch.append(operation)
+        return batch, True
+
+    def _write(self, connection, batch):
+        """
+        Run a batch through db.group_commit and resolve the callers' futures after the commit.
+        """
+        outcomes = []
+        try:
+            with db.group_commit(connection) as run:
+                for function, args, kwargs, future in batch:
+                    try:
+                        outcomes.append((future, run(function, *args, **kwargs), None))
+                    except Exception as error:
+                        outcomes.append((future, None, error))
+        except Exception as error:
+            for _, _, _, future in batch:  # the commit itself failed, so nothing of the batch was written
+                future.set_exception(error)
+            return
+
+        self.operations += len(batch)
+        self.transactions += 1
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+def _increment_habit(connection, name, user_name, event_date, mood_before, mood_after):
+    """
+    db.increment_habit, but an unknown habit fails the caller's future instead of printing a warning nobody sees.
+    """
+    if db.get_habit_id(connection, name, user_name) is None:
+        raise ValueError(f"There is no habit named '{name}' for user '{user_name}'.")
+    db.increment_habit(connection, name, user_name, event_date, mood_before, mood_after)